@@ -1,5 +1,12 @@
+import time
+
+# as early as possible, startup time includes the imports
+STARTED_AT = time.perf_counter()
+
 import asyncio
 import logging
+import signal
+from contextlib import suppress
 from aiogram.bot.bot import Bot
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
@@ -10,29 +17,17 @@ import bot.middlewares as middlewares
 from bot.handlers import register_handlers
 from bot.filters import bind_all_filters
 from bot.iec.moitor_outages import OutagesMonitor
-from bot.iec.api import iec_api
-from tortoise import Tortoise
+from bot.broadcast import Broadcaster
+from bot.iec.cities_streets_downloader import fill_db_cities_streets_if_empty
+from bot.db import init_db
+from bot.db.retention import retention_job
+from bot.shutdown import shutdown
+from bot.tuning import tunables
 from bot.config import config
 import os
-import time
 
-
-async def init_db(tz: str):
-    DB_URL = "sqlite://bot/db/data/db.sqlite3"
-    await Tortoise.init(
-        db_url=DB_URL,
-        modules={"models": ["bot.db.models"]},
-        use_tz=True,
-        timezone=tz,
-    )
-    await Tortoise.generate_schemas()
-
-    async def log_db_queryies():
-        conn_wrapper = Tortoise.get_connection("default")
-        await conn_wrapper._connection.set_trace_callback(logging.debug)
-
-    if not config.is_production:
-        await log_db_queryies()
+# seconds from process start until polling for updates
+STARTUP_TARGET = 3.0
 
 
 async def set_bot_commands(bot: Bot):
@@ -61,12 +56,14 @@ async def main():
         datefmt="%d/%m/%Y %H:%M:%S",
     )
 
-    await init_db(TIMEZONE)
+    await init_db(TIMEZONE, log_queries=not config.is_production)
     bot = Bot(
         token=config.bot.token,
         parse_mode=types.ParseMode.HTML,
     )
-    await set_bot_commands(bot)
+    # not needed to start handling updates
+    asyncio.ensure_future(set_bot_commands(bot))
+    asyncio.ensure_future(fill_db_cities_streets_if_empty())
 
     storage = MemoryStorage()
     dp = Dispatcher(bot, storage=storage)
@@ -74,23 +71,45 @@ async def main():
     bind_all_filters(dp)
     register_handlers(dp)
     dp.middleware.setup(middlewares.UserMiddleware())
+    dp.middleware.setup(middlewares.TimingMiddleware())
+
+    broadcaster = Broadcaster(bot)
+    dp["broadcaster"] = broadcaster
+    asyncio.ensure_future(broadcaster.resume_unfinished())
 
     outages_onitor = OutagesMonitor(bot)
+    dp["outages_monitor"] = outages_onitor
+    # the settings changed with /tune by the last run
+    tunables.monitor = outages_onitor
+    tunables.load()
 
     asyncio.ensure_future(outages_onitor.start_monitoring())
+    retention = asyncio.ensure_future(retention_job.run_forever())
 
     try:
         await dp.skip_updates()
-        await dp.start_polling()
+        startup_time = time.perf_counter() - STARTED_AT
+        logging.log(
+            logging.WARNING if startup_time > STARTUP_TARGET else logging.INFO,
+            f"Ready for updates after {startup_time:.2f}s (target {STARTUP_TARGET}s)",
+        )
+        polling = asyncio.ensure_future(dp.start_polling())
+
+        def stop_polling():
+            dp.stop_polling()
+            # not waiting for the long poll to return
+            polling.cancel()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            # not supported on windows, ctrl+c cancels everything there
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, stop_polling)
+        with suppress(asyncio.CancelledError):
+            await polling
     finally:
-        # db and other things
-        await Tortoise.close_connections()
-        outages_onitor.stop_monitoring()
-        await iec_api.session.close()
-        await dp.storage.close()
-        await dp.storage.wait_closed()
-        session = await bot.get_session()
-        await session.close()
+        # stop, drain, flush, snapshot and only then close the db
+        await shutdown(dp, outages_onitor, broadcaster, [retention])
 
 
 try:
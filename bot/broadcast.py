@@ -0,0 +1,292 @@
+import asyncio
+import logging
+from datetime import datetime
+from aiogram.bot.bot import Bot
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+from bot.db.models import BroadcastJob, User
+from bot.db.query_tracker import untrack
+from bot.delivery import classify_delivery_failure, unreachable_users
+from bot.config import config
+
+__all__ = ("Broadcaster",)
+
+# seconds between edits of the admin progress message
+PROGRESS_INTERVAL = 3
+
+
+class Broadcaster:
+    """
+    Sends admin broadcasts to all the users,
+    one job at a time, at config.bot.broadcast_rate
+    messages per second.
+    Users are paged by id and the progress is saved
+    after every page, so a job continues after a restart
+    """
+
+    def __init__(self, telegram_bot: Bot) -> None:
+        """
+        :param telegram_bot: the bot
+        :type telegram_bot: Bot
+        """
+        self.telegram_bot = telegram_bot
+        self.job: BroadcastJob = None
+        self._next_send_ts = 0.0
+        self._last_progress_ts = 0.0
+        self._stopping = False
+        # set from a start or resume until its jobs end,
+        # before the first await so two can not both run
+        self._busy = False
+        # set while no job runs
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def running(self) -> bool:
+        return self.job is not None
+
+    async def start(self, text: str, admin_chat_id: int) -> BroadcastJob:
+        """
+        Creates a job and runs it in the background
+
+        :param text: the message to send
+        :type text: str
+        :param admin_chat_id: chat for the progress message
+        :type admin_chat_id: int
+        :raises RuntimeError: if a job is allready running
+        :return: the job
+        :rtype: BroadcastJob
+        """
+        self._claim()
+        try:
+            job = await BroadcastJob.create(text=text, admin_chat_id=admin_chat_id)
+        except BaseException:
+            self._busy = False
+            raise
+        self.job = job
+        asyncio.ensure_future(self._run_jobs([job]))
+        return job
+
+    async def resume_unfinished(self) -> int:
+        """
+        Continues the jobs that did not finish in the
+        background, on startup and after a job paused
+        on an error
+
+        :raises RuntimeError: if a job is allready running
+        :return: the number of jobs to continue
+        :rtype: int
+        """
+        self._claim()
+        try:
+            jobs = await BroadcastJob.filter(finished_at__isnull=True).order_by("id")
+        except BaseException:
+            self._busy = False
+            raise
+        for job in jobs:
+            self.logger.warning(
+                f"Resuming broadcast {job.id} after user {job.last_user_id}"
+            )
+        asyncio.ensure_future(self._run_jobs(jobs))
+        return len(jobs)
+
+    def _claim(self):
+        """
+        :raises RuntimeError: if a job is allready running
+        """
+        if self._busy:
+            raise RuntimeError("A broadcast is allready running")
+        self._busy = True
+
+    async def _run_jobs(self, jobs: list[BroadcastJob]):
+        """
+        Runs the jobs in order, stops at
+        the first one that did not finish
+
+        :param jobs: the claimed jobs
+        :type jobs: list[BroadcastJob]
+        """
+        try:
+            for job in jobs:
+                if self._stopping:
+                    break
+                await self.run(job)
+                if not job.finished_at:
+                    break
+        finally:
+            self._busy = False
+
+    async def run(self, job: BroadcastJob):
+        """
+        Sends the job to the users after
+        job.last_user_id until all are sent. An error
+        pauses the job with its progress saved,
+        resume_unfinished continues it
+
+        :param job: the job
+        :type job: BroadcastJob
+        """
+        # started from /broadcast, not part of its update
+        untrack()
+        self.job = job
+        self._idle.clear()
+        total = None
+        try:
+            total = await User.filter(is_active=True).count()
+            await self._report(job, total, force=True)
+            while True:
+                users = (
+                    await User.filter(id__gt=job.last_user_id, is_active=True)
+                    .order_by("id")
+                    .limit(config.bot.broadcast_chunk)
+                    .values_list("id", flat=True)
+                )
+                if not users:
+                    break
+                for user_id in users:
+                    if self._stopping:
+                        break
+                    await self._send(job, user_id)
+                    job.last_user_id = user_id
+                await job.save(
+                    update_fields=["last_user_id", "sent", "failed", "blocked"]
+                )
+                if self._stopping:
+                    self.logger.warning(
+                        f"Broadcast {job.id} paused after user {job.last_user_id}"
+                    )
+                    return
+                await self._report(job, total)
+
+            job.finished_at = datetime.now()
+            await job.save(update_fields=["finished_at"])
+            await self._report(job, total, force=True)
+            self.logger.warning(
+                f"Broadcast {job.id} finished: {job.sent} sent, "
+                f"{job.failed} failed, {job.blocked} blocked"
+            )
+        except Exception:
+            self.logger.exception(
+                f"Broadcast {job.id} paused on an error after user {job.last_user_id}"
+            )
+            await self._pause(job, total)
+        finally:
+            self.job = None
+            self._idle.set()
+
+    async def stop(self):
+        """
+        Stops the running job after the current send,
+        it is resumed on the next start
+        """
+        self._stopping = True
+        await self._idle.wait()
+
+    async def _pause(self, job: BroadcastJob, total: int = None):
+        """
+        Saves the progress of a job that stopped on an
+        error and tells the admin it is paused
+
+        :param job: the job
+        :type job: BroadcastJob
+        :param total: users count, None if not counted yet
+        :type total: int, optional
+        """
+        try:
+            await job.save(update_fields=["last_user_id", "sent", "failed", "blocked"])
+        except Exception:
+            self.logger.exception(f"Cannot save broadcast {job.id} progress")
+        if total is None:
+            return
+        try:
+            await self._report(job, total, force=True, paused=True)
+        except Exception:
+            self.logger.exception(f"Cannot report broadcast {job.id} paused")
+
+    async def _delay_if_needed(self):
+        """
+        Sleeps to send at most
+        config.bot.broadcast_rate messages per second
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        interval = 1 / config.bot.broadcast_rate
+        if now >= self._next_send_ts:
+            self._next_send_ts = now + interval
+            return
+        self._next_send_ts += interval
+        await asyncio.sleep(self._next_send_ts - interval - now)
+
+    async def _send(self, job: BroadcastJob, user_id: int):
+        """
+        Sends the job text to a user and counts
+        the result, waits and retries when telegram
+        asks to
+
+        :param job: the job
+        :type job: BroadcastJob
+        :param user_id: telegram user id
+        :type user_id: int
+        """
+        while True:
+            await self._delay_if_needed()
+            try:
+                await self.telegram_bot.send_message(user_id, job.text)
+            except RetryAfter as e:
+                self.logger.warning(f"Broadcast flood limit, waiting {e.timeout}s")
+                await asyncio.sleep(e.timeout)
+                continue
+            except TelegramAPIError as e:
+                failure = classify_delivery_failure(e)
+                if failure:
+                    job.blocked += 1
+                    await unreachable_users.user_unreachable(user_id, failure)
+                else:
+                    job.failed += 1
+            else:
+                job.sent += 1
+            return
+
+    async def _report(self, job: BroadcastJob, total: int, force=False, paused=False):
+        """
+        Sends or edits the admin progress message,
+        at most every PROGRESS_INTERVAL seconds
+
+        :param job: the job
+        :type job: BroadcastJob
+        :param total: users count
+        :type total: int
+        :param force: ignore the interval, defaults to False
+        :type force: bool, optional
+        :param paused: the job stopped on an error, defaults to False
+        :type paused: bool, optional
+        """
+        now = asyncio.get_running_loop().time()
+        if not force and now - self._last_progress_ts < PROGRESS_INTERVAL:
+            return
+        self._last_progress_ts = now
+
+        if job.finished_at:
+            status = "הסתיים ✅"
+        elif paused:
+            status = "הושהה בגלל שגיאה, /broadcast_resume ימשיך אותו"
+        else:
+            status = "בתהליך..."
+        text = (
+            f"<b>שידור #{job.id}</b> {status}\n\n"
+            f"נשלחו: {job.sent}\n"
+            f"נכשלו: {job.failed}\n"
+            f"חסמו את הבוט: {job.blocked}\n"
+            f'סה"כ משתמשים: {total}'
+        )
+        try:
+            if job.progress_msg_id:
+                await self.telegram_bot.edit_message_text(
+                    text, job.admin_chat_id, job.progress_msg_id
+                )
+                return
+            msg = await self.telegram_bot.send_message(job.admin_chat_id, text)
+            job.progress_msg_id = msg.message_id
+            await job.save(update_fields=["progress_msg_id"])
+        except TelegramAPIError:
+            self.logger.warning(f"Cannot report broadcast {job.id} progress")
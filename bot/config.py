@@ -15,11 +15,108 @@ class Bot:
     token: str
     max_addresses_for_user: int
     admin_user_ids: list[int]
+    # admin broadcast messages per second, telegram allows about 30
+    broadcast_rate: int
+    # users loaded and saved as progress at a time
+    broadcast_chunk: int
+    # seconds, slower updates are logged with their db queries
+    slow_update_threshold: float
+    # one time address checks a user can make in check_quota_window seconds
+    check_quota: int
+    check_quota_window: int
+    # users kept in memory by the middleware, and seconds one is reused
+    user_cache_size: int
+    user_cache_ttl: int
+    # json file of the settings changed with /tune, applied over these
+    tunables_file: str
 
 
 @dataclass
 class IEC:
     base_url: str
+    # seconds an rbzid cookie is used before it is replaced
+    rbzid_lifetime: int
+    # seconds before expiry to refresh the cookie in the background
+    rbzid_refresh_ahead: int
+    # consecutive failed requests that stop requests to IEC
+    breaker_failure_threshold: int
+    # seconds requests are stopped the first time, doubles every time
+    breaker_base_backoff: int
+    breaker_max_backoff: int
+    # seconds an outage status is reused for one time checks
+    status_cache_ttl: int
+    # same, for statuses of subscribed addresses polled by the monitor
+    status_cache_monitored_ttl: int
+    # seconds between two IEC requests, the rate budget
+    request_interval: float
+    # 0-0.9, share of the IEC requests user checks can take
+    # ahead of the monitor polling
+    interactive_share: float
+    # seconds an outage status request can take
+    request_timeout: int
+    # .jsonl.gz log all IEC requests and responses are written to,
+    # a file per run with the start time in the name, empty to not record
+    record_file: str
+    # a run log, or a record_file for all its runs, to answer
+    # the requests from instead of IEC, empty to use IEC
+    replay_file: str
+    # the recorded latencies are divided by it, 0 to answer right away
+    replay_speed: float
+
+
+@dataclass
+class Monitor:
+    # seconds between reloads of the monitored addresses from the db
+    reconcile_interval: int
+    # minimum seconds between the start of two rounds over all addresses
+    round_interval: int
+    # IEC requests in flight together (still paced by the api rate limit),
+    # /tune changes the workers but the fetch queue keeps its startup size
+    fetch_concurrency: int
+    # outages saved and sent to telegram together
+    process_concurrency: int
+    # size of the queues after the fetch stage
+    queue_size: int
+    # neighbours checked right away when an outage starts or ends
+    burst_max_addresses: int
+    # seconds before the same street is burst checked again
+    burst_cooldown: int
+    # seconds notifications of a user are collected and sent as one
+    # message for all their addresses, 0 for a message per address
+    digest_window: int
+    # seconds the shutdown waits for the work in flight, all
+    # phases together, keep it below the docker stop_grace_period
+    shutdown_timeout: int
+    # json file of the addresses left unchecked at shutdown
+    state_file: str
+
+
+@dataclass
+class Retention:
+    # ended outages older than this are rolled up into OutageStats
+    horizon_days: int
+    # outages open for longer are ended, the monitor lost them
+    stale_open_days: int
+    # seconds between retention runs
+    interval: int
+    # outages moved in one transaction
+    batch_size: int
+    # seconds between batches, to let the monitor use the db
+    batch_pause: float
+
+
+@dataclass
+class Tracing:
+    # jsonl file of the monitor checks traces, empty to disable
+    file: str
+    # share of the checks that changed nothing that are written,
+    # the ones that failed, changed an outage or were slow allways are
+    sample_rate: float
+    # seconds, checks slower than this are allways written
+    slow_threshold: float
+    # the file is rotated at this size, keeping backups old files
+    max_bytes: int
+    backups: int
 
 
 @dataclass
@@ -27,6 +124,9 @@ class Config:
     is_production: bool
     bot: Bot
     iec: IEC
+    monitor: Monitor
+    retention: Retention
+    tracing: Tracing
 
 
 config = Config(
@@ -35,8 +135,59 @@ config = Config(
         token=env.str("BOT_TOKEN"),
         max_addresses_for_user=env.int("MAX_ADDRESSES_FOR_USER"),
         admin_user_ids=env.list("ADMIN_USER_IDS", subcast=int),
+        broadcast_rate=env.int("BROADCAST_RATE", default=20),
+        broadcast_chunk=env.int("BROADCAST_CHUNK", default=100),
+        slow_update_threshold=env.float("SLOW_UPDATE_THRESHOLD", default=1.0),
+        check_quota=env.int("CHECK_QUOTA", default=5),
+        check_quota_window=env.int("CHECK_QUOTA_WINDOW", default=10 * 60),
+        user_cache_size=env.int("USER_CACHE_SIZE", default=10000),
+        user_cache_ttl=env.int("USER_CACHE_TTL", default=60),
+        tunables_file=env.str("TUNABLES_FILE", default="bot/db/data/tunables.json"),
     ),
     iec=IEC(
         base_url=env.str("IEC_BASE_URL"),
+        rbzid_lifetime=env.int("IEC_RBZID_LIFETIME", default=30 * 60),
+        rbzid_refresh_ahead=env.int("IEC_RBZID_REFRESH_AHEAD", default=5 * 60),
+        breaker_failure_threshold=env.int("IEC_BREAKER_FAILURE_THRESHOLD", default=5),
+        breaker_base_backoff=env.int("IEC_BREAKER_BASE_BACKOFF", default=30),
+        breaker_max_backoff=env.int("IEC_BREAKER_MAX_BACKOFF", default=30 * 60),
+        status_cache_ttl=env.int("IEC_STATUS_CACHE_TTL", default=60),
+        status_cache_monitored_ttl=env.int(
+            "IEC_STATUS_CACHE_MONITORED_TTL", default=10 * 60
+        ),
+        request_interval=env.float("IEC_REQUEST_INTERVAL", default=1.1),
+        interactive_share=env.float("IEC_INTERACTIVE_SHARE", default=0.25),
+        request_timeout=env.int("IEC_REQUEST_TIMEOUT", default=20),
+        record_file=env.str("IEC_RECORD_FILE", default=""),
+        replay_file=env.str("IEC_REPLAY_FILE", default=""),
+        replay_speed=env.float("IEC_REPLAY_SPEED", default=1.0),
+    ),
+    monitor=Monitor(
+        reconcile_interval=env.int("MONITOR_RECONCILE_INTERVAL", default=60 * 60),
+        round_interval=env.int("MONITOR_ROUND_INTERVAL", default=5),
+        fetch_concurrency=env.int("MONITOR_FETCH_CONCURRENCY", default=4),
+        process_concurrency=env.int("MONITOR_PROCESS_CONCURRENCY", default=4),
+        queue_size=env.int("MONITOR_QUEUE_SIZE", default=32),
+        burst_max_addresses=env.int("MONITOR_BURST_MAX_ADDRESSES", default=20),
+        burst_cooldown=env.int("MONITOR_BURST_COOLDOWN", default=2 * 60),
+        digest_window=env.int("MONITOR_DIGEST_WINDOW", default=0),
+        shutdown_timeout=env.int("MONITOR_SHUTDOWN_TIMEOUT", default=20),
+        state_file=env.str(
+            "MONITOR_STATE_FILE", default="bot/db/data/monitor_state.json"
+        ),
+    ),
+    retention=Retention(
+        horizon_days=env.int("RETENTION_HORIZON_DAYS", default=365),
+        stale_open_days=env.int("RETENTION_STALE_OPEN_DAYS", default=30),
+        interval=env.int("RETENTION_INTERVAL", default=24 * 60 * 60),
+        batch_size=env.int("RETENTION_BATCH_SIZE", default=500),
+        batch_pause=env.float("RETENTION_BATCH_PAUSE", default=0.5),
+    ),
+    tracing=Tracing(
+        file=env.str("TRACE_FILE", default="bot/db/data/traces/checks.jsonl"),
+        sample_rate=env.float("TRACE_SAMPLE_RATE", default=0.05),
+        slow_threshold=env.float("TRACE_SLOW_THRESHOLD", default=60),
+        max_bytes=env.int("TRACE_MAX_BYTES", default=20 * 1024 * 1024),
+        backups=env.int("TRACE_BACKUPS", default=5),
     ),
 )
@@ -0,0 +1,106 @@
+import logging
+import os
+from tortoise import Tortoise
+
+__all__ = ("init_db", "db_file_size", "DB_URL", "SCHEMA_VERSION")
+
+DB_URL = "sqlite://bot/db/data/db.sqlite3"
+
+# bump when bot.db.models changes, with a migration in MIGRATIONS
+# if existing tables change (new tables are created automatically)
+SCHEMA_VERSION = 5
+
+# version: statements that upgrade the schema from version - 1
+MIGRATIONS: dict[int, list[str]] = {
+    4: [
+        'ALTER TABLE "user" ADD COLUMN "is_active" INT NOT NULL DEFAULT 1',
+        'ALTER TABLE "user" ADD COLUMN "deactivated_at" TIMESTAMP',
+    ],
+    # incremental auto vacuum, it takes a full VACUUM that locks
+    # the db for minutes, run out of band with python -m bot.db.vacuum
+    5: [],
+}
+
+
+async def get_schema_version() -> int:
+    """
+    Gets the schema version saved in the db (sqlite user_version).
+    A db created before the schema was versioned
+    is version 1.
+
+    :return: schema version, 0 for an empty db
+    :rtype: int
+    """
+    conn = Tortoise.get_connection("default")
+    rows = await conn.execute_query_dict("PRAGMA user_version")
+    version = rows[0]["user_version"]
+    if version:
+        return version
+
+    rows = await conn.execute_query_dict(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='user'"
+    )
+    return 1 if rows else 0
+
+
+async def ensure_schema():
+    """
+    Creates or upgrades the schema,
+    skipped when the db is already at SCHEMA_VERSION
+    """
+    version = await get_schema_version()
+    if version == SCHEMA_VERSION:
+        return
+
+    logger = logging.getLogger(__name__)
+    conn = Tortoise.get_connection("default")
+    if version:
+        for v in range(version + 1, SCHEMA_VERSION + 1):
+            logger.warning(f"Migrating db schema to version {v}")
+            for statement in MIGRATIONS.get(v, []):
+                await conn.execute_script(statement)
+    else:
+        # a new db, before any table is created. The connection set
+        # wal mode allready, it takes a VACUUM, instant while empty
+        await conn.execute_script("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.execute_script("VACUUM")
+
+    await Tortoise.generate_schemas(safe=True)
+    await conn.execute_script(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+async def init_db(tz: str, db_url: str = DB_URL, log_queries: bool = False):
+    """
+    Inits tortoise and makes sure
+    the schema is up to date
+
+    :param tz: timezone
+    :type tz: str
+    :param db_url: db url, defaults to DB_URL
+    :type db_url: str, optional
+    :param log_queries: log all queries (debug), defaults to False
+    :type log_queries: bool, optional
+    """
+    await Tortoise.init(
+        db_url=db_url,
+        modules={"models": ["bot.db.models"]},
+        use_tz=True,
+        timezone=tz,
+    )
+    await ensure_schema()
+
+    if log_queries:
+        conn_wrapper = Tortoise.get_connection("default")
+        await conn_wrapper._connection.set_trace_callback(logging.debug)
+
+
+def db_file_size() -> int:
+    """
+    Size of the db file and its write ahead log,
+    without querying the db
+
+    :return: bytes, 0 for an in memory db
+    :rtype: int
+    """
+    path = Tortoise.get_connection("default").filename
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.isfile(p))
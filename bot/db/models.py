@@ -30,6 +30,10 @@ class User(Model):
 
     id: int = fields.BigIntField(pk=True)
     started_at: datetime = fields.DatetimeField(auto_now_add=True)
+    # False when messages to the user fail (blocked the bot, deleted),
+    # their addresses are not monitored until the next /start
+    is_active: bool = fields.BooleanField(default=True, null=False)
+    deactivated_at: datetime = fields.DatetimeField(null=True)
     addresses: fields.ReverseRelation["Address"]
 
 
@@ -46,6 +50,37 @@ class Address(Model):
     )
 
 
+class Incident(Model):
+    """
+    An incident in iec system, shared by all
+    the outages of the addresses it affects.
+    Holds the latest details of these outages
+    """
+
+    class Meta:
+        table = "incident"
+
+    # iec incident id
+    id: int = fields.IntField(pk=True)
+    first_seen: datetime = fields.DatetimeField(auto_now_add=True)
+    updated_at: datetime = fields.DatetimeField(auto_now=True)
+    # no outages of the incident are left
+    end_time: datetime = fields.DateField(null=True)
+    start_time: datetime = fields.DateField(null=True)
+    is_planned: bool = fields.BooleanField(default=False, null=False)
+    incident_status_code: int = fields.IntField(null=True)
+    incident_source_code: int = fields.IntField(null=True)
+    incident_source_desc: str = fields.TextField(null=True)
+    incident_trouble_code: int = fields.IntField(null=True)
+    incident_trouble_desc: str = fields.TextField(null=True)
+    delay_cause_code: int = fields.IntField(null=True)
+    delay_cause_desc: str = fields.TextField(null=True)
+    crew_name: str = fields.TextField(null=True)
+    crew_assigned_time: datetime = fields.DateField(null=True)
+    restore_est: datetime = fields.DateField(null=True)
+    outages: fields.ReverseRelation["Outage"]
+
+
 class Outage(Model):
     class Meta:
         table = "outage"
@@ -59,8 +94,12 @@ class Outage(Model):
     end_time: datetime = fields.DateField(null=True)
     # planned outage for maintenance
     is_planned: bool = fields.BooleanField(default=False, null=False)
-    # incident in iec system
-    incident_id: int = fields.IntField(null=True)
+    # incident in iec system, the details below are as first seen,
+    # updates of an outage with an incident are saved to the incident.
+    # no db constraint, outages are saved before their incident
+    incident: fields.ForeignKeyNullableRelation[Incident] = fields.ForeignKeyField(
+        "models.Incident", related_name="outages", null=True, db_constraint=False
+    )
     incident_status_code: int = fields.IntField(null=True)
     # the source is what reported the outage probably
     incident_source_code: int = fields.IntField(null=True)
@@ -75,3 +114,49 @@ class Outage(Model):
     crew_name: str = fields.TextField(null=True)
     crew_assigned_time: datetime = fields.DateField(null=True)
     restore_est: datetime = fields.DateField(null=True)
+
+
+class BroadcastJob(Model):
+    """
+    An admin message sent to all the users,
+    progress is saved to resume after a restart
+    """
+
+    class Meta:
+        table = "broadcast_job"
+
+    id: int = fields.IntField(pk=True)
+    text: str = fields.TextField(null=False)
+    # the admin chat and the message with the live progress
+    admin_chat_id: int = fields.BigIntField(null=False)
+    progress_msg_id: int = fields.BigIntField(null=True)
+    created_at: datetime = fields.DatetimeField(auto_now_add=True)
+    finished_at: datetime = fields.DatetimeField(null=True)
+    # users are sent in id order, the last user id handled
+    last_user_id: int = fields.BigIntField(default=0, null=False)
+    sent: int = fields.IntField(default=0, null=False)
+    failed: int = fields.IntField(default=0, null=False)
+    # blocked the bot, deactivated or chat not found
+    blocked: int = fields.IntField(default=0, null=False)
+
+
+class OutageStats(Model):
+    """
+    Outages of an address rolled up, outages older
+    than the retention horizon are moved here
+    """
+
+    class Meta:
+        table = "outage_stats"
+        unique_together = (("city_id", "street_id", "home_num"),)
+
+    id: int = fields.IntField(pk=True)
+    city_id: int = fields.BigIntField(null=False)
+    street_id: int = fields.IntField(null=False)
+    home_num: int = fields.IntField(null=False)
+    outages: int = fields.IntField(default=0, null=False)
+    planned_outages: int = fields.IntField(default=0, null=False)
+    # sum of end - start, start and end are dates
+    total_days: int = fields.IntField(default=0, null=False)
+    first_start: datetime = fields.DateField(null=True)
+    last_start: datetime = fields.DateField(null=True)
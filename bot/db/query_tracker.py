@@ -0,0 +1,92 @@
+"""
+Records the queries run in the current context
+(an update being handled), by wrapping the execute
+methods of the tortoise sqlite client.
+"""
+import functools
+from contextvars import ContextVar, Token
+from typing import Optional
+from tortoise.backends.sqlite.client import SqliteClient, TransactionWrapper
+
+__all__ = (
+    "install_query_tracker",
+    "track_queries",
+    "stop_tracking",
+    "untrack",
+    "tracked_queries",
+)
+
+EXECUTE_METHODS = (
+    "execute_insert",
+    "execute_many",
+    "execute_query",
+    "execute_query_dict",
+    "execute_script",
+)
+# queries longer than this are cut in the list
+MAX_QUERY_LENGTH = 300
+# queries recorded per context, a task started while handling an
+# update copies its context and keeps adding to the same list
+MAX_TRACKED_QUERIES = 500
+
+_queries: ContextVar[Optional[list[str]]] = ContextVar("queries", default=None)
+_installed = False
+
+
+def _tracked(method):
+    @functools.wraps(method)
+    async def execute(self, query: str, *args, **kwargs):
+        queries = _queries.get()
+        if queries is not None and len(queries) < MAX_TRACKED_QUERIES:
+            queries.append(query[:MAX_QUERY_LENGTH])
+        return await method(self, query, *args, **kwargs)
+
+    return execute
+
+
+def install_query_tracker():
+    """
+    Wraps the sqlite client execute methods, once
+    """
+    global _installed
+    if _installed:
+        return
+    for cls in (SqliteClient, TransactionWrapper):
+        for name in EXECUTE_METHODS:
+            if name in cls.__dict__:
+                setattr(cls, name, _tracked(cls.__dict__[name]))
+    _installed = True
+
+
+def track_queries() -> Token:
+    """
+    Starts recording the queries of the current context
+
+    :return: token for stop_tracking
+    :rtype: Token
+    """
+    return _queries.set([])
+
+
+def stop_tracking(token: Token):
+    """
+    :param token: from track_queries
+    :type token: Token
+    """
+    _queries.reset(token)
+
+
+def untrack():
+    """
+    Stops recording in the current task, call first in
+    a background task started while handling an update
+    """
+    _queries.set(None)
+
+
+def tracked_queries() -> list[str]:
+    """
+    :return: the queries since track_queries, empty if not tracking
+    :rtype: list[str]
+    """
+    return _queries.get() or []
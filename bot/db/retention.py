@@ -0,0 +1,198 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+from tortoise import Tortoise
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+from bot.db.models import Incident, Outage, OutageStats
+from bot.config import config
+
+__all__ = ("retention_job", "RetentionJob")
+
+# seconds after startup before the first run
+FIRST_RUN_DELAY = 10 * 60
+# pages freed by one PRAGMA incremental_vacuum
+VACUUM_STEP_PAGES = 256
+
+# (city_id, street_id, home_num)
+StatsKey = tuple[int, int, int]
+
+
+class RetentionJob:
+    """
+    Keeps the outage table small, ended outages older
+    than config.retention.horizon_days are rolled up
+    into per address OutageStats and deleted.
+    Runs in small batches with pauses between them,
+    and then frees the deleted pages with incremental vacuum.
+    Outages open longer than config.retention.stale_open_days
+    are ended first, so they are archived too
+    """
+
+    def __init__(self) -> None:
+        self.archived = 0
+        self.closed_stale = 0
+        self._warned_vacuum = False
+        self.runs = 0
+        self.running = False
+        self.logger = logging.getLogger(__name__)
+
+    async def run_forever(self):
+        """
+        Runs every config.retention.interval
+        """
+        await asyncio.sleep(FIRST_RUN_DELAY)
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                self.logger.exception("Retention run failed")
+            await asyncio.sleep(config.retention.interval)
+
+    async def run_once(self, today: date = None) -> int:
+        """
+        Archives all the outages older than the horizon
+
+        :param today: defaults to today
+        :type today: date, optional
+        :return: outages archived
+        :rtype: int
+        """
+        if self.running:
+            return 0
+        self.running = True
+        try:
+            today = today or date.today()
+            await self._close_stale(
+                today - timedelta(days=config.retention.stale_open_days)
+            )
+            cutoff = today - timedelta(days=config.retention.horizon_days)
+            archived = 0
+            while True:
+                moved = await self._archive_batch(cutoff)
+                if not moved:
+                    break
+                archived += moved
+                await asyncio.sleep(config.retention.batch_pause)
+
+            await Incident.filter(end_time__lt=cutoff).delete()
+            if archived:
+                await self._incremental_vacuum()
+            self.archived += archived
+            self.runs += 1
+            self.logger.info(f"Retention archived {archived} outages before {cutoff}")
+            return archived
+        finally:
+            self.running = False
+
+    async def _close_stale(self, cutoff: date) -> int:
+        """
+        Ends the outages still open that started before the
+        cutoff, left open by a crash or an older version.
+        Their real end is unknown, they end at their start
+
+        :param cutoff: open outages that started before it are ended
+        :type cutoff: date
+        :return: outages ended
+        :rtype: int
+        """
+        closed = await Outage.filter(
+            start_time__lt=cutoff, end_time__isnull=True
+        ).update(end_time=F("start_time"))
+        if closed:
+            self.closed_stale += closed
+            self.logger.warning(f"Ended {closed} outages open since before {cutoff}")
+        return closed
+
+    async def _archive_batch(self, cutoff: date) -> int:
+        """
+        Rolls up and deletes one batch of outages
+
+        :param cutoff: outages that started before it are archived
+        :type cutoff: date
+        :return: outages archived
+        :rtype: int
+        """
+        rows = (
+            await Outage.filter(start_time__lt=cutoff, end_time__not_isnull=True)
+            .order_by("id")
+            .limit(config.retention.batch_size)
+            .values(
+                "id",
+                "city_id",
+                "street_id",
+                "home_num",
+                "start_time",
+                "end_time",
+                "is_planned",
+            )
+        )
+        if not rows:
+            return 0
+
+        rollup: dict[StatsKey, OutageStats] = {}
+        for row in rows:
+            key = (row["city_id"], row["street_id"], row["home_num"])
+            stats = rollup.get(key)
+            if stats is None:
+                stats = rollup[key] = OutageStats(
+                    city_id=key[0], street_id=key[1], home_num=key[2]
+                )
+            stats.outages += 1
+            stats.planned_outages += row["is_planned"]
+            stats.total_days += (row["end_time"] - row["start_time"]).days
+            start = row["start_time"]
+            if stats.first_start is None or start < stats.first_start:
+                stats.first_start = start
+            if stats.last_start is None or start > stats.last_start:
+                stats.last_start = start
+
+        async with in_transaction():
+            existing = await OutageStats.filter(
+                city_id__in={k[0] for k in rollup},
+                street_id__in={k[1] for k in rollup},
+            )
+            for stats in existing:
+                key = (stats.city_id, stats.street_id, stats.home_num)
+                new = rollup.pop(key, None)
+                if new is None:
+                    continue
+                stats.outages += new.outages
+                stats.planned_outages += new.planned_outages
+                stats.total_days += new.total_days
+                stats.first_start = min(stats.first_start, new.first_start)
+                stats.last_start = max(stats.last_start, new.last_start)
+                await stats.save()
+            if rollup:
+                await OutageStats.bulk_create(list(rollup.values()))
+            await Outage.filter(id__in=[row["id"] for row in rows]).delete()
+        return len(rows)
+
+    async def _incremental_vacuum(self):
+        """
+        Frees the deleted pages a few at a time,
+        if the db is in incremental auto vacuum mode
+        """
+        conn = Tortoise.get_connection("default")
+        rows = await conn.execute_query_dict("PRAGMA auto_vacuum")
+        if rows[0]["auto_vacuum"] != 2:
+            if not self._warned_vacuum:
+                self._warned_vacuum = True
+                self.logger.warning(
+                    "The db does not free deleted pages, "
+                    "run python -m bot.db.vacuum while the bot is stopped"
+                )
+            return
+
+        free_pages = None
+        while True:
+            rows = await conn.execute_query_dict("PRAGMA freelist_count")
+            left = rows[0]["freelist_count"]
+            if not left or left == free_pages:
+                return
+            free_pages = left
+            await conn.execute_script(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+            await asyncio.sleep(0)
+
+
+retention_job = RetentionJob()
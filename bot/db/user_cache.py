@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import OrderedDict
+from tortoise.exceptions import IntegrityError
+from bot.config import config
+from bot.db.models import User
+
+__all__ = ("user_cache", "UserCache")
+
+
+class UserCache:
+    """
+    LRU cache of the users by telegram id, so repeat
+    interactions do not query the db.
+    Entries expire after ttl, so changes made
+    elsewhere (directly in the db) show up, changes
+    made by the bot invalidate the user.
+    Concurrent lookups of a user share one db load,
+    a new user is created once.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        """
+        :param max_size: users kept
+        :type max_size: int
+        :param ttl: seconds a user is reused
+        :type ttl: float
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # user id: (user, expires at monotonic)
+        self._entries: OrderedDict[int, tuple[User, float]] = OrderedDict()
+        self._inflight: dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_create(self, user_id: int) -> User:
+        """
+        :param user_id: telegram user id
+        :type user_id: int
+        :return: the user, created if new
+        :rtype: User
+        """
+        entry = self._entries.get(user_id)
+        if entry and time.monotonic() < entry[1]:
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id))
+            self._inflight[user_id] = task
+        # shield, a cancelled update must not cancel the shared load
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id: int) -> User:
+        try:
+            user = await User.filter(id=user_id).first()
+            if user is None:
+                try:
+                    user = await User.create(id=user_id)
+                except IntegrityError:
+                    # created by someone else meanwhile
+                    user = await User.get(id=user_id)
+        finally:
+            # invalidated while loading, may be stale
+            stale = self._inflight.get(user_id) is not asyncio.current_task()
+            if not stale:
+                del self._inflight[user_id]
+        if not stale:
+            self._store(user)
+        return user
+
+    def _store(self, user: User):
+        self._entries[user.id] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """
+        The user changed in the db,
+        the next lookup loads it again
+
+        :param user_id: telegram user id
+        :type user_id: int
+        """
+        self._entries.pop(user_id, None)
+        self._inflight.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+user_cache = UserCache(config.bot.user_cache_size, config.bot.user_cache_ttl)
@@ -0,0 +1,32 @@
+"""
+Converts the db to incremental auto vacuum, so the
+retention job frees the pages of the archived outages.
+A full VACUUM rewrites the whole db and locks it until
+it is done, run it while the bot is stopped.
+
+usage: python -m bot.db.vacuum [db_url]
+"""
+import asyncio
+import sys
+from tortoise import Tortoise
+from bot.db import DB_URL, db_file_size, init_db
+
+
+async def vacuum(db_url: str = DB_URL):
+    """
+    :param db_url: db url, defaults to DB_URL
+    :type db_url: str, optional
+    """
+    await init_db("Asia/Jerusalem", db_url)
+    try:
+        conn = Tortoise.get_connection("default")
+        before = db_file_size()
+        await conn.execute_script("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.execute_script("VACUUM")
+        print(f"db {before / 2**20:.1f}MB -> {db_file_size() / 2**20:.1f}MB")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(vacuum(*sys.argv[1:2]))
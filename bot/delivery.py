@@ -0,0 +1,151 @@
+import logging
+from collections import Counter
+from datetime import datetime
+from enum import Enum
+from typing import Iterable, Optional
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    BotKicked,
+    ChatNotFound,
+    UserDeactivated,
+)
+from bot.db.models import Address, User
+from bot.db.user_cache import user_cache
+from bot.iec.work_set import address_work_set
+
+__all__ = (
+    "DeliveryFailure",
+    "classify_delivery_failure",
+    "unreachable_users",
+    "UnreachableUsers",
+)
+
+
+class DeliveryFailure(Enum):
+    # the user will never get messages, until they /start again
+    BLOCKED = "blocked"
+    CHAT_NOT_FOUND = "chat not found"
+    DEACTIVATED = "deactivated"
+
+
+def classify_delivery_failure(e: BaseException) -> Optional[DeliveryFailure]:
+    """
+    :param e: exception of a telegram send
+    :type e: BaseException
+    :return: the failure if the user is unreachable, None for other errors
+    :rtype: Optional[DeliveryFailure]
+    """
+    if isinstance(e, (BotBlocked, BotKicked)):
+        return DeliveryFailure.BLOCKED
+    if isinstance(e, ChatNotFound):
+        return DeliveryFailure.CHAT_NOT_FOUND
+    if isinstance(e, UserDeactivated):
+        return DeliveryFailure.DEACTIVATED
+    return None
+
+
+class UnreachableUsers:
+    """
+    Marks users that can not get messages as inactive,
+    and removes their addresses from the monitor work set
+    so they are no longer polled for them.
+    A /start reactivates the user.
+    """
+
+    def __init__(self) -> None:
+        self.pruned: Counter[DeliveryFailure] = Counter()
+        # addresses that left the work set, no one else subscribed to them
+        self.reclaimed_addresses = 0
+        self.reactivated = 0
+        self.logger = logging.getLogger(__name__)
+
+    async def check_results(self, user_ids: Iterable[int], results: Iterable):
+        """
+        Prunes the users whose send failed as unreachable
+
+        :param user_ids: telegram user ids
+        :type user_ids: Iterable[int]
+        :param results: asyncio.gather(..., return_exceptions=True) of sends to them
+        :type results: Iterable
+        """
+        for user_id, result in zip(user_ids, results):
+            if not isinstance(result, BaseException):
+                continue
+            failure = classify_delivery_failure(result)
+            if failure:
+                await self.user_unreachable(user_id, failure)
+
+    async def user_unreachable(self, user_id: int, failure: DeliveryFailure):
+        """
+        Marks the user inactive and stops
+        polling their addresses
+
+        :param user_id: telegram user id
+        :type user_id: int
+        :param failure: why
+        :type failure: DeliveryFailure
+        """
+        updated = await User.filter(id=user_id, is_active=True).update(
+            is_active=False, deactivated_at=datetime.now()
+        )
+        user_cache.invalidate(user_id)
+        if not updated:
+            return
+
+        before = len(address_work_set)
+        for add in await self._addresses_of(user_id):
+            address_work_set.remove(*add)
+        reclaimed = before - len(address_work_set)
+
+        self.pruned[failure] += 1
+        self.reclaimed_addresses += reclaimed
+        self.logger.warning(
+            f"User {user_id} is unreachable ({failure.value}), "
+            f"{reclaimed} addresses no longer polled. {self.report()}"
+        )
+
+    async def reactivate(self, user: User):
+        """
+        Marks the user active and polls
+        their addresses again
+
+        :param user: the user
+        :type user: User
+        """
+        if user.is_active:
+            return
+        user.is_active = True
+        user.deactivated_at = None
+        await user.save(update_fields=["is_active", "deactivated_at"])
+        before = len(address_work_set)
+        for add in await self._addresses_of(user.id):
+            address_work_set.add(*add)
+        added = len(address_work_set) - before
+        self.reclaimed_addresses -= min(added, self.reclaimed_addresses)
+        self.reactivated += 1
+
+    @staticmethod
+    async def _addresses_of(user_id: int) -> list[tuple[int, int, int, int]]:
+        return await Address.filter(user_id=user_id).values_list(
+            "city_id", "city__district_id", "street_id", "home_num"
+        )
+
+    def report(self) -> str:
+        """
+        :return: users pruned since the start and the polling budget reclaimed
+        :rtype: str
+        """
+        pruned = sum(self.pruned.values())
+        reasons = ", ".join(f"{f.value}: {n}" for f, n in self.pruned.items())
+        polled = len(address_work_set)
+        total = polled + self.reclaimed_addresses
+        share = self.reclaimed_addresses / total * 100 if total else 0
+        return (
+            f"{pruned} users pruned ({reasons or 'none'}), "
+            f"{self.reactivated} reactivated, "
+            f"{self.reclaimed_addresses} addresses reclaimed, "
+            f"{share:.1f}% of the IEC requests of a round"
+        )
+
+
+unreachable_users = UnreachableUsers()
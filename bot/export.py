@@ -0,0 +1,155 @@
+"""
+Streams the outage history as csv or json lines,
+read in keyset paginated chunks (by id) so memory
+stays the same for any table size.
+
+usage: python -m bot.export [-f csv|jsonl] [--since YYYY-MM-DD]
+       [--until YYYY-MM-DD] [--city CITY_ID] [--planned | --unplanned]
+       [-o OUTPUT] [--db DB_URL]
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import date
+from typing import Optional, TextIO
+from tortoise import Tortoise
+from bot.db import DB_URL, init_db
+from bot.db.models import Outage
+
+__all__ = ("export_outages", "outage_filters", "EXPORT_FORMATS", "EXPORT_FIELDS")
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_FIELDS = (
+    "id",
+    "city_id",
+    "city__name",
+    "street_id",
+    "street__name",
+    "home_num",
+    "start_time",
+    "end_time",
+    "is_planned",
+    "incident_id",
+    "incident_status_code",
+    "incident_source_code",
+    "incident_source_desc",
+    "incident_trouble_code",
+    "incident_trouble_desc",
+    "delay_cause_code",
+    "delay_cause_desc",
+    "crew_name",
+    "crew_assigned_time",
+    "restore_est",
+)
+CHUNK_SIZE = 1000
+
+
+def outage_filters(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    city_id: Optional[int] = None,
+    planned: Optional[bool] = None,
+) -> dict:
+    """
+    :param since: outages that started on or after, defaults to None
+    :type since: Optional[date], optional
+    :param until: outages that started on or before, defaults to None
+    :type until: Optional[date], optional
+    :param city_id: iec city id, defaults to None
+    :type city_id: Optional[int], optional
+    :param planned: only planned or unplanned outages, defaults to None
+    :type planned: Optional[bool], optional
+    :return: Outage.filter kwargs
+    :rtype: dict
+    """
+    filters = {}
+    if since:
+        filters["start_time__gte"] = since
+    if until:
+        filters["start_time__lte"] = until
+    if city_id is not None:
+        filters["city_id"] = city_id
+    if planned is not None:
+        filters["is_planned"] = planned
+    return filters
+
+
+async def export_outages(
+    out: TextIO, fmt: str = "csv", filters: dict = None, chunk_size=CHUNK_SIZE
+) -> int:
+    """
+    Writes the outages to out, chunk by chunk
+
+    :param out: text file to write to
+    :type out: TextIO
+    :param fmt: one of EXPORT_FORMATS, defaults to "csv"
+    :type fmt: str, optional
+    :param filters: see outage_filters, defaults to None
+    :type filters: dict, optional
+    :param chunk_size: rows read at a time, defaults to CHUNK_SIZE
+    :type chunk_size: int, optional
+    :raises ValueError: unknown format
+    :return: rows written
+    :rtype: int
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt}")
+
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(f.replace("__", "_") for f in EXPORT_FIELDS)
+
+    filters = filters or {}
+    last_id = 0
+    rows = 0
+    while True:
+        chunk = (
+            await Outage.filter(id__gt=last_id, **filters)
+            .order_by("id")
+            .limit(chunk_size)
+            .values(*EXPORT_FIELDS)
+        )
+        if not chunk:
+            break
+        for row in chunk:
+            if fmt == "csv":
+                writer.writerow(row[f] for f in EXPORT_FIELDS)
+            else:
+                record = {f.replace("__", "_"): row[f] for f in EXPORT_FIELDS}
+                out.write(json.dumps(record, default=str, ensure_ascii=False))
+                out.write("\n")
+        rows += len(chunk)
+        last_id = chunk[-1]["id"]
+    return rows
+
+
+async def main(args: argparse.Namespace):
+    await init_db("Asia/Jerusalem", args.db)
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else None
+    try:
+        rows = await export_outages(
+            out or sys.stdout,
+            args.format,
+            outage_filters(args.since, args.until, args.city, args.planned),
+        )
+        print(f"Exported {rows} outages", file=sys.stderr)
+    finally:
+        if out:
+            out.close()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bot.export")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--since", type=date.fromisoformat)
+    parser.add_argument("--until", type=date.fromisoformat)
+    parser.add_argument("--city", type=int)
+    planned = parser.add_mutually_exclusive_group()
+    planned.add_argument("--planned", action="store_true", default=None)
+    planned.add_argument("--unplanned", dest="planned", action="store_false")
+    parser.add_argument("-o", "--output", help="file path, stdout by default")
+    parser.add_argument("--db", default=DB_URL, help=f"defaults to {DB_URL}")
+    asyncio.run(main(parser.parse_args()))
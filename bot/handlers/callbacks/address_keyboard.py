@@ -2,6 +2,7 @@ from datetime import datetime
 from aiogram import types, Dispatcher
 from bot.db.models import Address, Outage, User
 from bot.handlers import commands
+from bot.iec.work_set import address_work_set
 import bot.keyboards as kb
 from bot.middlewares import prefetch_user
 from aiogram.utils.callback_data import CallbackData
@@ -55,8 +56,14 @@ async def delete(call: types.CallbackQuery, callback_data: dict[str, str], user:
     add_id = callback_data.get("id")
     if not add_id:
         return
-    add = await Address.filter(id=add_id, user=user).first()
+    add = await Address.filter(id=add_id, user=user).select_related("city").first()
+    if not add:
+        return
     await add.delete()
+    kb.address_menus.invalidate(user.id)
+    address_work_set.remove(
+        add.city_id, add.city.district_id, add.street_id, add.home_num
+    )
 
     await call.answer("הכתובת נמחקה בהצלחה")
     await commands.cmd_addresses_menu(call.message, user, True)
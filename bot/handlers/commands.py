@@ -1,16 +1,30 @@
 import logging
+import os
+import tempfile
+from datetime import date
 from aiogram import types, Dispatcher
+from bot.broadcast import Broadcaster
+from bot.delivery import unreachable_users
+from bot.export import EXPORT_FORMATS, export_outages, outage_filters
 from aiogram.dispatcher.storage import FSMContext
-from bot.db.models import Address, User
+from bot.db.models import User
 import bot.handlers.states.address_form as address_form
 from bot.iec.cities_streets_downloader import fill_db_cities_streets
-from bot.keyboards import get_addresses_keyboard
-from bot.middlewares import prefetch_user
+from bot.keyboards import address_menus
+from bot.middlewares import handler_timings, prefetch_user
+from bot.profiler import profiler
+from bot.stats import collect_stats, format_stats
+from bot.tuning import tunables
 import traceback
 
+# /profile sampling time
+PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 120
+
 
 @prefetch_user
 async def cmd_start(message: types.Message, user: User):
+    await unreachable_users.reactivate(user)
     first_name: str = message.chat.first_name or ""
     await message.answer(
         f"היי {first_name}\n"
@@ -26,12 +40,11 @@ async def cmd_start(message: types.Message, user: User):
 
 @prefetch_user
 async def cmd_addresses_menu(message: types.Message, user: User, edit_message=False):
-    user_addresses = await Address.filter(user=user).select_related("city", "street")
     text = (
         "לחץ/י על הוספת כתובת חדשה כדי להוסיף כתובת, \n"
         "לחץ/י על כתובת להסרה/לצפיה בהיסטוריה"
     )
-    kb = get_addresses_keyboard(user_addresses, add_new_btn=True)
+    kb, _ = await address_menus.get(user.id)
     if edit_message:
         await message.edit_text(text, reply_markup=kb)
     else:
@@ -74,6 +87,133 @@ async def cmd_local_cities_streets(message: types.Message):
         logging.exception("canot fill_db_cities_streets (local)")
 
 
+async def cmd_broadcast(message: types.Message):
+    parts = message.html_text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.reply("שימוש: /broadcast ההודעה לשליחה לכל המשתמשים")
+        return
+
+    broadcaster: Broadcaster = Dispatcher.get_current()["broadcaster"]
+    if broadcaster.running:
+        await message.reply(f"שידור #{broadcaster.job.id} עדיין בתהליך")
+        return
+    try:
+        await broadcaster.start(parts[1], message.chat.id)
+    except RuntimeError:
+        await message.reply("שידור אחר עדיין בתהליך")
+
+
+async def cmd_broadcast_resume(message: types.Message):
+    broadcaster: Broadcaster = Dispatcher.get_current()["broadcaster"]
+    try:
+        count = await broadcaster.resume_unfinished()
+    except RuntimeError:
+        await message.reply("שידור אחר עדיין בתהליך")
+        return
+    if not count:
+        await message.reply("אין שידורים מושהים")
+
+
+async def cmd_pruned_users(message: types.Message):
+    inactive = await User.filter(is_active=False).count()
+    await message.reply(
+        f"משתמשים לא פעילים: {inactive}\n\n"
+        f"<code>{unreachable_users.report()}</code>"
+    )
+
+
+async def cmd_stats(message: types.Message):
+    dp = Dispatcher.get_current()
+    stats = collect_stats(dp["outages_monitor"], dp["broadcaster"])
+    await message.reply(f"<code>{format_stats(stats)}</code>")
+
+
+async def cmd_export_outages(message: types.Message):
+    usage = (
+        "שימוש: /export_outages [csv|jsonl] [since=YYYY-MM-DD] "
+        "[until=YYYY-MM-DD] [city=CITY_ID] [planned=yes|no]"
+    )
+    fmt = "csv"
+    args = {}
+    try:
+        for arg in message.get_args().split():
+            if arg in EXPORT_FORMATS:
+                fmt = arg
+                continue
+            key, value = arg.split("=", 1)
+            if key in ("since", "until"):
+                args[key] = date.fromisoformat(value)
+            elif key == "city":
+                args["city_id"] = int(value)
+            elif key == "planned":
+                args["planned"] = value == "yes"
+            else:
+                raise ValueError(key)
+    except ValueError:
+        await message.reply(usage)
+        return
+
+    fd, path = tempfile.mkstemp(suffix="." + fmt)
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            rows = await export_outages(f, fmt, outage_filters(**args))
+        await message.reply_document(
+            types.InputFile(path, filename=f"outages.{fmt}"),
+            caption=f"הפסקות: {rows}",
+        )
+    except Exception:
+        await message.reply("אירעה שגיאה בעת הייצוא")
+        logging.exception("canot export outages")
+    finally:
+        os.remove(path)
+
+
+async def cmd_profile(message: types.Message):
+    args = message.get_args()
+    if args and not args.isdigit():
+        await message.reply("שימוש: /profile [שניות]")
+        return
+    seconds = min(int(args or PROFILE_SECONDS), MAX_PROFILE_SECONDS)
+    if profiler.running:
+        await message.reply("פרופיילינג כבר רץ")
+        return
+    await message.reply(f"אוסף דגימות במשך {seconds} שניות")
+    report = await profiler.profile(seconds)
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(handler_timings.report())
+            f.write("\n\n")
+            f.write(report)
+        await message.reply_document(types.InputFile(path, filename="profile.txt"))
+    finally:
+        os.remove(path)
+
+
+async def cmd_tune(message: types.Message):
+    usage = "שימוש: /tune [section.field=value ...] או /tune reset [section.field ...]"
+    args = message.get_args().split()
+    try:
+        if not args:
+            await message.reply(f"<code>{tunables.describe()}</code>")
+            return
+        if args[0] == "reset":
+            changed = tunables.reset(args[1:])
+        else:
+            changes = dict(arg.split("=", 1) for arg in args)
+            changed = tunables.apply(changes)
+    except ValueError as e:
+        await message.reply(f"{usage}\n\n<code>{e}</code>")
+        return
+
+    if not changed:
+        await message.reply("לא שונה דבר")
+        return
+    lines = "\n".join(f"{key}: {old} → {new}" for key, (old, new) in changed.items())
+    await message.reply(f"<code>{lines}</code>")
+
+
 async def cmd_cancel_state(message: types.Message, state: FSMContext):
     cur_state = await state.get_state()
     if not cur_state:
@@ -94,3 +234,16 @@ def register_cmds(dp: Dispatcher):
     dp.register_message_handler(
         cmd_local_cities_streets, commands="local_cities_streets", is_admin=True
     )
+    dp.register_message_handler(cmd_broadcast, commands="broadcast", is_admin=True)
+    dp.register_message_handler(
+        cmd_broadcast_resume, commands="broadcast_resume", is_admin=True
+    )
+    dp.register_message_handler(
+        cmd_pruned_users, commands="pruned_users", is_admin=True
+    )
+    dp.register_message_handler(
+        cmd_export_outages, commands="export_outages", is_admin=True
+    )
+    dp.register_message_handler(cmd_profile, commands="profile", is_admin=True)
+    dp.register_message_handler(cmd_stats, commands="stats", is_admin=True)
+    dp.register_message_handler(cmd_tune, commands="tune", is_admin=True)
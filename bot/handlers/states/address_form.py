@@ -1,3 +1,4 @@
+import math
 from aiogram import types
 from aiogram.dispatcher.dispatcher import Dispatcher
 from aiogram.dispatcher.storage import FSMContext
@@ -6,9 +7,13 @@ from bot.config import config
 from bot.db.models import Address, City, Street, User
 from bot.middlewares import prefetch_user
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from bot.iec.api import iec_api
+from bot.iec.active_outages import MAX_HOME_NUM
+from bot.iec.api import IECUnavailableError
+from bot.iec.status_cache import outage_status_cache
+from bot.iec.work_set import address_work_set
+from bot.quota import check_quota
 from bot.utils import detail_text_from_outage
-from bot.keyboards import get_back_to_menu_keyboard
+from bot.keyboards import address_menus, get_back_to_menu_keyboard
 
 
 class AddressForm(StatesGroup):
@@ -19,7 +24,7 @@ class AddressForm(StatesGroup):
 
 @prefetch_user
 async def start_address_form(query: types.CallbackQuery, user: User):
-    user_addresses_count = await Address.filter(user=user).count()
+    _, user_addresses_count = await address_menus.get(user.id)
     max = config.bot.max_addresses_for_user
     if user_addresses_count >= max:
         await query.answer(
@@ -91,6 +96,12 @@ async def process_address_form_street(message: types.Message, state: FSMContext)
     )
 
 
+def is_home_num(text: str) -> bool:
+    text = text.strip()
+    # larger numbers do not fit an outage key
+    return text.isdecimal() and int(text) <= MAX_HOME_NUM
+
+
 async def address_form_home_not_num(message: types.Message):
     await message.reply(
         "מספר הבניין חייב להיות מספר בלבד, ללא כל תווים אחרים",
@@ -113,9 +124,22 @@ async def process_address_form_home(
     full_address = f"{street.name} {home_num}, {city.name}"
 
     if one_time_check:
+        key = (city.id, city.district_id, street.id, home_num)
+        # cached answers cost IEC nothing, only requests count
+        if outage_status_cache.get_cached(key) is None:
+            wait = check_quota.acquire(user.id)
+            if wait:
+                minutes = max(math.ceil(wait / 60), 1)
+                await message.answer(
+                    "ביצעת הרבה בדיקות בזמן קצר.\n"
+                    f"ניתן לבדוק שוב בעוד כ{minutes} דקות"
+                )
+                await state.finish()
+                return
+
         await message.reply("נא להמתין...")
         try:
-            outage_status = await iec_api.get_outage_for_address(
+            outage_status = await outage_status_cache.get_outage_for_address(
                 city.id, city.district_id, street.id, home_num
             )
             if (
@@ -123,22 +147,30 @@ async def process_address_form_home(
                 and not outage_status.is_planned_outage
             ):
                 await message.answer(f"לא ידוע כרגע על הפסקת חשמל ב{full_address}")
-                return
-            text = detail_text_from_outage(
-                outage_status.get_outage_model(), full_address
+            else:
+                text = detail_text_from_outage(
+                    outage_status.get_outage_model(), full_address
+                )
+                await message.answer("ידוע כרגע על " + text)
+        except IECUnavailableError as e:
+            minutes = max(round(e.retry_after / 60), 1)
+            await message.answer(
+                f"אתר חברת החשמל אינו זמין כרגע.\nיש לנסות שוב בעוד כ{minutes} דקות"
             )
-            await message.answer("ידוע כרגע על " + text)
         except Exception:
-            message.answer("אירעה שגיאה בבדיקת הסטטוס. יש לנסות שוב מאוחר יותר")
+            await message.answer("אירעה שגיאה בבדיקת הסטטוס. יש לנסות שוב מאוחר יותר")
         await state.finish()
         return
 
-    address, _ = await Address.get_or_create(
+    address, created = await Address.get_or_create(
         city=city,
         street=street,
         home_num=home_num,
         user=user,
     )
+    if created:
+        address_menus.invalidate(user.id)
+        address_work_set.add(city.id, city.district_id, street.id, home_num)
 
     await message.answer(
         "זהו!\n"
@@ -158,11 +190,11 @@ def register_handlers(dp: Dispatcher):
     dp.register_message_handler(process_address_form_street, state=AddressForm.street)
     dp.register_message_handler(
         address_form_home_not_num,
-        lambda message: not message.text.strip().isnumeric(),
+        lambda message: not is_home_num(message.text),
         state=AddressForm.home_num,
     )
     dp.register_message_handler(
         process_address_form_home,
-        lambda message: message.text.strip().isnumeric(),
+        lambda message: is_home_num(message.text),
         state=AddressForm.home_num,
     )
@@ -0,0 +1,376 @@
+from array import array
+from datetime import datetime, time
+from bot.iec.decoding import IECOutageStatus
+
+__all__ = (
+    "ActiveOutageData",
+    "ActiveIncident",
+    "OUTAGE_STATUS_FIELDS",
+    "INCIDENT_FIELDS",
+    "INCIDENT_SHARED_FIELDS",
+    "MAX_STREET_ID",
+    "MAX_HOME_NUM",
+    "gen_outage_key",
+    "split_outage_key",
+    "format_outage_key",
+    "outage_fields_from_status",
+    "incident_fields",
+    "shared_incident_fields",
+    "dump_fields",
+    "load_fields",
+    "db_outage_fields",
+)
+
+# bits of a packed outage key, IEC street ids go above 100000000
+_HOME_BITS = 20
+_STREET_BITS = 27
+_HOME_MASK = (1 << _HOME_BITS) - 1
+_STREET_MASK = (1 << _STREET_BITS) - 1
+# the largest ids a key holds, the city id is not limited
+MAX_STREET_ID = _STREET_MASK
+MAX_HOME_NUM = _HOME_MASK
+
+# db Outage field: IECOutageStatus attribute
+OUTAGE_STATUS_FIELDS = {
+    "is_planned": "is_planned_outage",
+    "start_time": "outage_time",
+    "incident_id": "incident_id",
+    "incident_source_code": "incident_source_code",
+    "incident_source_desc": "incident_source_desc",
+    "incident_status_code": "incident_status_code",
+    "incident_trouble_code": "incident_trouble_code",
+    "incident_trouble_desc": "incident_trouble_desc",
+    "delay_cause_code": "delay_cause_code",
+    "delay_cause_desc": "delay_cause_desc",
+    "crew_name": "crew_name",
+    "crew_assigned_time": "last_crew_assignment_time",
+    "restore_est": "restore_est",
+}
+
+# the Outage fields that are saved to the db Incident of an outage
+INCIDENT_FIELDS = tuple(f for f in OUTAGE_STATUS_FIELDS if f != "incident_id")
+# the ones diffed and updated for all the outages of an incident, the
+# start time stays per outage, linked addresses can report different ones
+INCIDENT_SHARED_FIELDS = tuple(f for f in INCIDENT_FIELDS if f != "start_time")
+
+# the Outage fields that are datetimes, iso strings in a saved state
+_DATETIME_FIELDS = ("start_time", "crew_assigned_time", "restore_est")
+
+
+def gen_outage_key(city_id: int, street_id: int, home_num: int) -> int:
+    """
+    Packs city_id,street_id,home_num into one int,
+    much smaller than a string or tuple key
+
+    :param city_id: iec city id
+    :type city_id: int
+    :param street_id: iec street id
+    :type street_id: int
+    :param home_num: the home number
+    :type home_num: int
+    :raises ValueError: street_id or home_num does not fit
+    :return: the key
+    :rtype: int
+    """
+    if not 0 <= street_id <= MAX_STREET_ID or not 0 <= home_num <= MAX_HOME_NUM:
+        raise ValueError(
+            f"address {city_id}-{street_id}-{home_num} does not fit an outage key"
+        )
+    return (
+        (city_id << (_STREET_BITS + _HOME_BITS)) | (street_id << _HOME_BITS) | home_num
+    )
+
+
+def split_outage_key(key: int) -> tuple[int, int, int]:
+    """
+    :param key: a key from gen_outage_key
+    :type key: int
+    :return: (city_id, street_id, home_num)
+    :rtype: tuple[int, int, int]
+    """
+    return (
+        key >> (_STREET_BITS + _HOME_BITS),
+        (key >> _HOME_BITS) & _STREET_MASK,
+        key & _HOME_MASK,
+    )
+
+
+def format_outage_key(key: int) -> str:
+    """
+    :param key: a key from gen_outage_key
+    :type key: int
+    :return: {city_id}-{street_id}-{home_num}, for logs
+    :rtype: str
+    """
+    return "-".join(str(i) for i in split_outage_key(key))
+
+
+def outage_fields_from_status(outage: IECOutageStatus) -> dict:
+    """
+    The db Outage fields from an outage status
+
+    :param outage: outage status iec
+    :type outage: IECOutageStatus
+    :return: {field: value}
+    :rtype: dict
+    """
+    return {
+        field: getattr(outage, attr) for field, attr in OUTAGE_STATUS_FIELDS.items()
+    }
+
+
+def dump_fields(fields: dict) -> dict:
+    """
+    :param fields: db Outage or Incident fields
+    :type fields: dict
+    :return: the fields json serializable
+    :rtype: dict
+    """
+    return {
+        field: value.isoformat()
+        if field in _DATETIME_FIELDS and value is not None
+        else value
+        for field, value in fields.items()
+    }
+
+
+def load_fields(fields: dict) -> dict:
+    """
+    :param fields: fields from dump_fields
+    :type fields: dict
+    :return: the fields
+    :rtype: dict
+    """
+    return {
+        field: datetime.fromisoformat(value)
+        if field in _DATETIME_FIELDS and value is not None
+        else value
+        for field, value in fields.items()
+    }
+
+
+def db_outage_fields(fields: dict) -> dict:
+    """
+    The db keeps only the date of the datetime
+    fields, they are restored as midnight datetimes
+
+    :param fields: db Outage fields as read from the db
+    :type fields: dict
+    :return: the fields
+    :rtype: dict
+    """
+    return {
+        field: datetime.combine(value, time())
+        if field in _DATETIME_FIELDS
+        and value is not None
+        and not isinstance(value, datetime)
+        else value
+        for field, value in fields.items()
+    }
+
+
+def incident_fields(fields: dict) -> dict:
+    """
+    :param fields: db Outage fields, see outage_fields_from_status
+    :type fields: dict
+    :return: only the db Incident fields
+    :rtype: dict
+    """
+    return {field: fields[field] for field in INCIDENT_FIELDS}
+
+
+def shared_incident_fields(fields: dict) -> dict:
+    """
+    :param fields: db Outage fields, see outage_fields_from_status
+    :type fields: dict
+    :return: only the fields shared by all the outages of an incident
+    :rtype: dict
+    """
+    return {field: fields[field] for field in INCIDENT_SHARED_FIELDS}
+
+
+class ActiveOutageData:
+    """
+    An ongoing outage of an address.
+    Holds only what is diffed and rendered, the
+    attribute names are the same as the db Outage model
+    so it can be rendered with detail_text_from_outage.
+    """
+
+    __slots__ = (
+        "outage_id",
+        "district_id",
+        "full_address_name",
+        "end_time",
+        # hash of the last text sent to telegram
+        "telegram_last_sent_hash",
+        # flat [chat_id, message_id, chat_id, message_id, ...]
+        "telegram_msg_ids",
+        *OUTAGE_STATUS_FIELDS,
+    )
+
+    def __init__(
+        self,
+        outage_id: int,
+        district_id: int,
+        full_address_name: str,
+        fields: dict,
+    ) -> None:
+        """
+        :param outage_id: db Outage id
+        :type outage_id: int
+        :param district_id: iec city district id
+        :type district_id: int
+        :param full_address_name: full address formated
+        :type full_address_name: str
+        :param fields: db Outage fields, see outage_fields_from_status
+        :type fields: dict
+        """
+        self.outage_id = outage_id
+        self.district_id = district_id
+        self.full_address_name = full_address_name
+        self.end_time: datetime = None
+        self.telegram_last_sent_hash = 0
+        self.telegram_msg_ids = array("q")
+        self.update(fields)
+
+    def update(self, fields: dict):
+        """
+        :param fields: db Outage fields, see outage_fields_from_status
+        :type fields: dict
+        """
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    def to_state(self) -> dict:
+        """
+        :return: the outage json serializable, see from_state
+        :rtype: dict
+        """
+        return {
+            "outage_id": self.outage_id,
+            "district_id": self.district_id,
+            "full_address_name": self.full_address_name,
+            "telegram_last_sent_hash": self.telegram_last_sent_hash,
+            "telegram_msg_ids": self.telegram_msg_ids.tolist(),
+            "fields": dump_fields(
+                {field: getattr(self, field) for field in OUTAGE_STATUS_FIELDS}
+            ),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ActiveOutageData":
+        """
+        :param state: from to_state
+        :type state: dict
+        :return: the outage
+        :rtype: ActiveOutageData
+        """
+        data = cls(
+            state["outage_id"],
+            state["district_id"],
+            state["full_address_name"],
+            load_fields(state["fields"]),
+        )
+        data.telegram_last_sent_hash = state["telegram_last_sent_hash"]
+        data.telegram_msg_ids = array("q", state["telegram_msg_ids"])
+        return data
+
+    def get_msg_id(self, chat_id: int) -> int:
+        """
+        :param chat_id: telegram chat id
+        :type chat_id: int
+        :return: the last message id sent to the chat, -1 if none
+        :rtype: int
+        """
+        ids = self.telegram_msg_ids
+        for i in range(0, len(ids), 2):
+            if ids[i] == chat_id:
+                return ids[i + 1]
+        return -1
+
+    def set_msg_ids(self, msg_ids: dict[int, int]):
+        """
+        :param msg_ids: {chat_id: message_id}
+        :type msg_ids: dict[int, int]
+        """
+        ids = array("q")
+        for chat_id, msg_id in msg_ids.items():
+            ids.append(chat_id)
+            ids.append(msg_id)
+        self.telegram_msg_ids = ids
+
+
+class ActiveIncident:
+    """
+    An ongoing iec incident and the active
+    outages (keys) linked to it.
+    Its details are diffed and saved once for
+    all the linked outages.
+    """
+
+    __slots__ = (
+        "incident_id",
+        "outage_keys",
+        # the outage checked first every round
+        "representative",
+        *INCIDENT_FIELDS,
+    )
+
+    def __init__(self, incident_id: int, fields: dict) -> None:
+        """
+        :param incident_id: iec incident id
+        :type incident_id: int
+        :param fields: db Outage fields, see outage_fields_from_status
+        :type fields: dict
+        """
+        self.incident_id = incident_id
+        self.outage_keys: set[int] = set()
+        self.representative: int = None
+        self.update(fields)
+
+    def update(self, fields: dict):
+        """
+        :param fields: db Outage or Incident fields,
+            the missing ones are kept
+        :type fields: dict
+        """
+        for field in INCIDENT_FIELDS:
+            if field in fields:
+                setattr(self, field, fields[field])
+
+    def fields(self) -> dict:
+        """
+        :return: the db Incident fields
+        :rtype: dict
+        """
+        return {field: getattr(self, field) for field in INCIDENT_FIELDS}
+
+    def matches(self, fields: dict) -> bool:
+        """
+        :param fields: db Outage fields, see outage_fields_from_status
+        :type fields: dict
+        :return: True if the shared incident details are the same
+        :rtype: bool
+        """
+        return all(
+            getattr(self, field) == fields[field] for field in INCIDENT_SHARED_FIELDS
+        )
+
+    def link(self, outage_key: int):
+        """
+        :param outage_key: a key from gen_outage_key
+        :type outage_key: int
+        """
+        self.outage_keys.add(outage_key)
+        if self.representative is None:
+            self.representative = outage_key
+
+    def unlink(self, outage_key: int):
+        """
+        :param outage_key: a key from gen_outage_key
+        :type outage_key: int
+        """
+        self.outage_keys.discard(outage_key)
+        if self.representative == outage_key:
+            self.representative = next(iter(self.outage_keys), None)
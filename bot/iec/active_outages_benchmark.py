@@ -0,0 +1,146 @@
+"""
+Memory benchmark of OutagesMonitor.active_outages,
+before (str keys, dataclass with a tortoise Outage, sent text,
+msg ids dict) and after (bot.iec.active_outages).
+
+usage: python -m bot.iec.active_outages_benchmark [count ...]
+"""
+import asyncio
+import gc
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from tortoise import Tortoise
+from bot.db.models import Outage
+from bot.iec.active_outages import ActiveOutageData, gen_outage_key
+
+# users registered to each address
+USERS_PER_ADDRESS = 2
+
+
+@dataclass
+class LegacyActiveOutageData:
+    db_outage: Outage
+    telegram_last_sent_text: str
+    telegram_last_msg_ids: dict[int:int]
+    full_address_name: str
+    city_id: int
+    street_id: int
+    home_num: int
+    district_id: int
+
+
+def outage_fields(i: int) -> dict:
+    now = datetime.now().replace(microsecond=0)
+    return dict(
+        is_planned=False,
+        start_time=now,
+        incident_id=4417745 + i // 500,
+        incident_source_code=3,
+        incident_source_desc="DMS",
+        incident_status_code=4,
+        incident_trouble_code=12,
+        incident_trouble_desc="מנגנון גיבוי",
+        delay_cause_code=2,
+        delay_cause_desc="עומס תקלות חריג",
+        crew_name="איציק, שי",
+        crew_assigned_time=now,
+        restore_est=now,
+    )
+
+
+def address(i: int) -> tuple[int, int, int, str]:
+    city_id, street_id, home_num = 1000 + i % 1200, 10000 + i, 1 + i % 90
+    return city_id, street_id, home_num, f"בר כוכבא {home_num}, אשקלון {i}"
+
+
+def message_text(name: str) -> str:
+    # about the size of detail_text_from_outage
+    return (
+        f"הפסקת חשמל ב{name}\n\n"
+        "<b>התחילה ב:</b> 05/12 11:19\n<b>צפי לסיום:</b> 05/12 14:19\n"
+        "<b>מקור מדווח:</b> DMS (מערכת ניתור אוט')\n<b>התקלה:</b> מנגנון גיבוי\n"
+        "<b>צוות מטפל:</b> איציק, שי (05/12 11:54)\n"
+        "<b>סיבת עיכוב:</b> עומס תקלות חריג"
+    )
+
+
+def build_legacy(count: int) -> dict:
+    active = {}
+    for i in range(count):
+        city_id, street_id, home_num, name = address(i)
+        db_outage = Outage(
+            id=i,
+            city_id=city_id,
+            street_id=street_id,
+            home_num=home_num,
+            **outage_fields(i),
+        )
+        active[f"{city_id}-{street_id}-{home_num}"] = LegacyActiveOutageData(
+            db_outage=db_outage,
+            telegram_last_sent_text=message_text(name),
+            telegram_last_msg_ids={
+                100000 + i * USERS_PER_ADDRESS + u: 5000 + i
+                for u in range(USERS_PER_ADDRESS)
+            },
+            full_address_name=name,
+            city_id=city_id,
+            street_id=street_id,
+            home_num=home_num,
+            district_id=901,
+        )
+    return active
+
+
+def build_compact(count: int) -> dict:
+    active = {}
+    for i in range(count):
+        city_id, street_id, home_num, name = address(i)
+        data = ActiveOutageData(
+            outage_id=i,
+            district_id=901,
+            full_address_name=name,
+            fields=outage_fields(i),
+        )
+        data.telegram_last_sent_hash = hash(message_text(name))
+        data.set_msg_ids(
+            {
+                100000 + i * USERS_PER_ADDRESS + u: 5000 + i
+                for u in range(USERS_PER_ADDRESS)
+            }
+        )
+        active[gen_outage_key(city_id, street_id, home_num)] = data
+    return active
+
+
+def measure(build, count: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    active = build(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(active) == count
+    return size
+
+
+async def main():
+    # models can only be made after init, nothing is queried
+    await Tortoise.init(
+        db_url="sqlite://:memory:", modules={"models": ["bot.db.models"]}
+    )
+    counts = [int(c) for c in sys.argv[1:]] or [10_000, 100_000]
+    for count in counts:
+        before = measure(build_legacy, count)
+        after = measure(build_compact, count)
+        print(
+            f"{count:>7} active outages: "
+            f"before {before / 2**20:7.1f}MB ({before // count} B/outage), "
+            f"after {after / 2**20:7.1f}MB ({after // count} B/outage), "
+            f"{before / after:.1f}x smaller"
+        )
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,61 +1,76 @@
 from dataclasses import dataclass
-import re
+from typing import Any, Callable, Optional
 import aiohttp
 import asyncio
 import time
-from datetime import datetime
-import json5
-from bot.db.models import Outage
 from bot.config import config
-
-__all__ = ("iec_api", "IECOutageStatus", "IECStreet", "IECCity")
+from bot.iec.circuit_breaker import CircuitBreaker, FailureKind, IECUnavailableError
+from bot.iec.decoding import IECOutageStatus, decode_outage_status, json_loads
+from bot.iec.rbzid import RbzidCookieManager, parse_rbzid_seed
+from bot.iec.recording import RecordingSession, ReplaySession
+from bot.iec.request_scheduler import RequestScheduler
+from bot.iec.window_counter import WindowCounter
+from bot.tracing import span
+
+__all__ = (
+    "iec_api",
+    "IECOutageStatus",
+    "IECStreet",
+    "IECCity",
+    "IECChallengeError",
+    "IECUnavailableError",
+    "classify_failure",
+)
+
+
+class IECChallengeError(Exception):
+    """
+    IEC responded with a bot challenge
+    page instead of json
+    """
 
 
-@dataclass
-class IECOutageStatus:
+def is_challenge_response(resp: aiohttp.ClientResponse, body: bytes) -> bool:
     """
-    Represents get_outage_for_address response
+    Checks if a response is the IEC bot
+    challenge page instead of json
+
+    :param resp: the response
+    :type resp: aiohttp.ClientResponse
+    :param body: the response body
+    :type body: bytes
+    :return: True if it is a challenge page
+    :rtype: bool
     """
+    if "html" in resp.content_type:
+        return True
+    return body.lstrip()[:1] == b"<"
 
-    is_active_incident: bool
-    is_planned_outage: bool
-    outage_time: datetime
-    incident_id: int
-    incident_source_code: int
-    incident_source_desc: str
-    incident_status_code: int
-    incident_status_name: str
-    incident_trouble_code: int
-    incident_trouble_desc: str
-    delay_cause_code: int
-    delay_cause_desc: str
-    crew_name: str
-    last_crew_assignment_time: datetime
-    restore_est: datetime
-
-    def get_outage_model(self) -> Outage:
-        """
-        Makes a db model
-        from partial outage response
 
-        :return: db Outage model
-        :rtype: Outage
-        """
-        return Outage(
-            is_planned=self.is_planned_outage,
-            start_time=self.outage_time,
-            incident_id=self.incident_id,
-            incident_source_code=self.incident_source_code,
-            incident_source_desc=self.incident_source_desc,
-            incident_status_code=self.incident_status_code,
-            incident_trouble_code=self.incident_trouble_code,
-            incident_trouble_desc=self.incident_trouble_desc,
-            delay_cause_code=self.delay_cause_code,
-            delay_cause_desc=self.delay_cause_desc,
-            crew_name=self.crew_name,
-            crew_assigned_time=self.last_crew_assignment_time,
-            restore_est=self.restore_est,
-        )
+def classify_failure(e: BaseException) -> Optional[FailureKind]:
+    """
+    Classifies an exception raised by
+    an IEC request for the circuit breaker
+
+    :param e: the exception
+    :type e: BaseException
+    :return: the failure kind, None if it is not an IEC failure
+    :rtype: Optional[FailureKind]
+    """
+    if isinstance(e, asyncio.TimeoutError):
+        return FailureKind.TIMEOUT
+    if isinstance(e, IECChallengeError):
+        return FailureKind.CHALLENGE
+    if isinstance(e, aiohttp.ClientResponseError):
+        if e.status in (403, 429):
+            return FailureKind.BLOCKED
+        return FailureKind.HTTP_ERROR
+    if isinstance(e, aiohttp.ClientError):
+        return FailureKind.CONNECTION
+    if isinstance(e, ValueError):
+        # not json, or not the json we expect
+        return FailureKind.HTTP_ERROR
+    return None
 
 
 @dataclass
@@ -83,6 +98,20 @@ class IECCity:
     loaded_streets: list[IECStreet]
 
 
+def get_retry_after(e: BaseException) -> Optional[float]:
+    """
+    Retry-After seconds of a failed response
+
+    :param e: the exception
+    :type e: BaseException
+    :return: seconds, None if not sent
+    :rtype: Optional[float]
+    """
+    headers = getattr(e, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    return float(value) if value and value.isdigit() else None
+
+
 class IECApi:
     """
     IEC Api client.
@@ -93,38 +122,72 @@ class IECApi:
 
     def __init__(self) -> None:
         self.session: aiohttp.ClientSession = None
-        self._rbzid: str = None
-        self._rbzid_updated_time: int = None
-        self._rate_limit_next_req_ts = time.time()
-        self.max_rqps = 1.1
+        self.rbzid = RbzidCookieManager(
+            self.__req_rbzid_cookie,
+            lifetime=config.iec.rbzid_lifetime,
+            refresh_ahead=config.iec.rbzid_refresh_ahead,
+        )
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=config.iec.breaker_failure_threshold,
+            base_backoff=config.iec.breaker_base_backoff,
+            max_backoff=config.iec.breaker_max_backoff,
+        )
+        # a request every request_interval seconds, user checks first
+        self.scheduler = RequestScheduler(
+            interval=config.iec.request_interval,
+            interactive_share=config.iec.interactive_share,
+        )
+        # request_json calls sent and failed in the last minute
+        self.requests = WindowCounter(60)
+        self.failures = WindowCounter(60)
         pass
 
-    async def _delay_if_needed(self):
+    @property
+    def rate_limit_waiting(self) -> int:
         """
-        Sleep until a req can be made
-        keeps track of the requests times and
-        sleeps if needed to comply with the
-        max req per sec that can be made
+        Requests waiting for the rate limit
         """
-        now = time.time()
-        if now >= self._rate_limit_next_req_ts:
-            self._rate_limit_next_req_ts = now + self.max_rqps
-            return
+        return self.scheduler.waiting
+
+    @property
+    def rate_limit_backlog(self) -> float:
+        """
+        Seconds until the rate limit lets a new request through
+        """
+        return self.scheduler.backlog
+
+    async def _delay_if_needed(self, interactive: bool = False):
+        """
+        Sleep until a req can be made,
+        to comply with the max req per sec
+        that can be made
 
-        self._rate_limit_next_req_ts = self._rate_limit_next_req_ts + self.max_rqps
-        diff = self._rate_limit_next_req_ts - now
-        return await asyncio.sleep(diff)
+        :param interactive: a user waits for the answer, defaults to False
+        :type interactive: bool, optional
+        """
+        with span("rate_limit"):
+            await self.scheduler.acquire(interactive)
 
     async def __create_session(self):
         """
-        Creates an aiohttp session
+        Creates an aiohttp session, or the
+        recording or replay one if configured
         """
+        if config.iec.replay_file:
+            self.session = ReplaySession(
+                config.iec.replay_file, config.iec.replay_speed
+            )
+            return
         self.session = aiohttp.ClientSession(
             base_url=config.iec.base_url,
             connector=aiohttp.TCPConnector(ssl=False),
         )
+        if config.iec.record_file:
+            self.session = RecordingSession(self.session, config.iec.record_file)
 
-    async def request(self, method: str, path: str, **kwargs) -> aiohttp.ClientResponse:
+    async def request(
+        self, method: str, path: str, interactive: bool = False, **kwargs
+    ) -> aiohttp.ClientResponse:
         """ """
         """
         Request the api
@@ -133,14 +196,100 @@ class IECApi:
         :type method: str
         :param path: path not including base
         :type path: str
+        :param interactive: a user waits for the answer,
+            goes before the monitor requests, defaults to False
+        :type interactive: bool, optional
 
         :return: the request response
         :rtype: ClientResponse
         """
-        await self._delay_if_needed()
+        await self._delay_if_needed(interactive)
         if not self.session:
             await self.__create_session()
-        return await self.session.request(method, path, **kwargs)
+        with span("iec_http"):
+            return await self.session.request(method, path, **kwargs)
+
+    async def request_json(
+        self,
+        method: str,
+        path: str,
+        require_rbzid: bool = False,
+        decode: Callable[[bytes], Any] = json_loads,
+        interactive: bool = False,
+        **kwargs,
+    ) -> Any:
+        """
+        Requests the api and decodes the json body.
+        Sends the rbzid cookie, if the response is a
+        challenge page refreshes the cookie and retries once.
+        Goes through the circuit breaker, fails fast
+        while IEC is considered unavailable.
+
+        :param method: HTTP method (GET,POST,DELETE, etc..)
+        :type method: str
+        :param path: path not including base
+        :type path: str
+        :param require_rbzid: wait for a cookie before the first try,
+            otherwise only a cached one is sent, defaults to False
+        :type require_rbzid: bool, optional
+        :param decode: decodes the body, defaults to json_loads
+        :type decode: Callable[[bytes], Any], optional
+        :param interactive: a user waits for the answer, defaults to False
+        :type interactive: bool, optional
+        :raises IECUnavailableError: if the circuit is open
+        :raises IECChallengeError: if still challenged after the retry
+        :return: the decoded json
+        :rtype: Any
+        """
+        self.circuit_breaker.before_request()
+        self.requests.add()
+        try:
+            result = await self._request_json(
+                method, path, require_rbzid, decode, interactive, **kwargs
+            )
+        except Exception as e:
+            self.failures.add()
+            kind = classify_failure(e)
+            if kind:
+                self.circuit_breaker.record_failure(kind, get_retry_after(e))
+            else:
+                self.circuit_breaker.release()
+            raise
+        except BaseException:
+            self.circuit_breaker.release()
+            raise
+        self.circuit_breaker.record_success()
+        return result
+
+    async def _request_json(
+        self,
+        method: str,
+        path: str,
+        require_rbzid: bool,
+        decode: Callable[[bytes], Any],
+        interactive: bool,
+        **kwargs,
+    ) -> Any:
+        rbzid = await self.rbzid.get() if require_rbzid else self.rbzid.current
+        headers = kwargs.pop("headers", {})
+        for retry in (False, True):
+            if rbzid:
+                headers["cookie"] = "rbzid=" + rbzid
+            resp = await self.request(
+                method, path, interactive, headers=headers, **kwargs
+            )
+            resp.raise_for_status()
+            with span("iec_read"):
+                body = await resp.read()
+            if not is_challenge_response(resp, body):
+                with span("decode"):
+                    return decode(body)
+            if retry:
+                break
+            with span("rbzid_refresh"):
+                rbzid = await self.rbzid.refresh_after_challenge(rbzid)
+
+        raise IECChallengeError(f"challenge page for {path}")
 
     async def __req_rbzid_cookie(self) -> str:
         """
@@ -155,8 +304,7 @@ class IECApi:
             "/IecServicesHandler.ashx?allRes=true&a=FindStreets",
         )
         raw = await resp.text()
-        js_obj = "{" + re.search("(?<=window\.rbzns={)(.*)(?=};)", raw)[0] + "}"
-        return json5.loads(js_obj)["seed"]
+        return parse_rbzid_seed(raw)
 
     async def get_rbzid(self) -> str:
         """
@@ -166,11 +314,7 @@ class IECApi:
         :return: rbzid
         :rtype: str
         """
-        update_every = 30 * 60
-        if not self._rbzid or self._rbzid_updated_time - time.time() > update_every:
-            self._rbzid = await self.__req_rbzid_cookie()
-            self._rbzid_updated_time = time.time()
-        return self._rbzid
+        return await self.rbzid.get()
 
     @staticmethod
     def is_unknown_name_id(id: int, name: str):
@@ -198,10 +342,9 @@ class IECApi:
             )
 
         params = {"a": "RetrieveCitiesEx", "city": q}
-        resp = await self.request(
+        raw_cities = await self.request_json(
             "GET", "/pages/IecServicesHandler.ashx", params=params
         )
-        raw_cities = await resp.json()
         return [
             normalize_city(c)
             for c in raw_cities[:1500]
@@ -229,15 +372,13 @@ class IECApi:
             name.replace("-", " ")
             return IECStreet(id=street["K_REHOV"], name=street["REHOV"])
 
-        rbzid = await self.get_rbzid()
         params = {"a": "FindStreets", "allRes": "true", "cityID": city_id, "street": q}
-        resp = await self.request(
+        raw_streets = await self.request_json(
             "GET",
             "/pages/IecServicesHandler.ashx",
+            require_rbzid=True,
             params=params,
-            headers={"cookie": "rbzid=" + rbzid},
         )
-        raw_streets = await resp.json()
         return [
             normalize_street(s)
             for s in raw_streets
@@ -245,7 +386,12 @@ class IECApi:
         ]
 
     async def get_outage_for_address(
-        self, city_id: int, district_id: int, street_id: int, home_num: int
+        self,
+        city_id: int,
+        district_id: int,
+        street_id: int,
+        home_num: int,
+        interactive: bool = False,
     ) -> IECOutageStatus:
         """
         Gets outage status from IEC
@@ -259,6 +405,8 @@ class IECApi:
         :type street_id: int
         :param home_num: the house number
         :type home_num: int
+        :param interactive: a user waits for the answer, defaults to False
+        :type interactive: bool, optional
         :return: the outage status
         :rtype: IECOutageStatus
         """
@@ -273,48 +421,14 @@ class IECApi:
         if district_id:
             params["Districtid"] = district_id
 
-        def normalize_outage(outage: dict):
-            restore_est_matches = re.search(
-                r"\d{2}:\d{2}[ X]\d{2}\/\d{2}\/\d{4}",
-                outage.get("IncidentStatusName", ""),
-            )
-            restore_est = (
-                datetime.strptime(restore_est_matches[0], "%H:%M %d/%m/%Y")
-                if restore_est_matches
-                else None
-            )
-
-            return IECOutageStatus(
-                is_active_incident=outage.get("IsActiveIncident"),
-                is_planned_outage=outage.get("IsPlannedOutage"),
-                outage_time=datetime.strptime(
-                    outage["Time_Outage"], "%Y-%m-%dT%H:%M:%S"
-                )
-                if outage["Time_OutageSpecified"]
-                else None,
-                incident_id=outage.get("IncidentID") or None,
-                incident_source_code=outage.get("IncidentSourceCode") or None,
-                incident_source_desc=outage.get("IncidentSourceDesc"),
-                incident_status_code=outage.get("IncidentStatusCode") or None,
-                incident_status_name=outage.get("IncidentStatusName"),
-                incident_trouble_code=outage.get("IncidentTroubleCode") or None,
-                incident_trouble_desc=outage.get("IncidentTroubleDesc"),
-                delay_cause_code=outage.get("DelayCauseCode") or None,
-                delay_cause_desc=outage.get("DelayCauseDesc"),
-                crew_name=outage.get("CrewName"),
-                last_crew_assignment_time=datetime.strptime(
-                    outage["LastCrewAssignment"], "%Y-%m-%dT%H:%M:%S"
-                )
-                if outage["LastCrewAssignmentSpecified"]
-                else None,
-                restore_est=restore_est,
-            )
-
-        resp = await self.request(
-            "GET", "/pages/IecServicesHandler.ashx", params=params, timeout=20
+        return await self.request_json(
+            "GET",
+            "/pages/IecServicesHandler.ashx",
+            decode=decode_outage_status,
+            interactive=interactive,
+            params=params,
+            timeout=config.iec.request_timeout,
         )
-        raw_outage = await resp.json()
-        return normalize_outage(raw_outage)
 
 
 iec_api = IECApi()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from enum import Enum
+from bot.tracing import span
+
+__all__ = (
+    "CircuitBreaker",
+    "CircuitState",
+    "FailureKind",
+    "IECUnavailableError",
+)
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    # backoff passed, one probe request is allowed
+    HALF_OPEN = "half_open"
+
+
+class FailureKind(Enum):
+    TIMEOUT = "timeout"
+    CONNECTION = "connection"
+    HTTP_ERROR = "http_error"
+    # a challenge page instead of json, even after refreshing rbzid
+    CHALLENGE = "challenge"
+    # 429/403, IEC is rate limiting or blocking us
+    BLOCKED = "blocked"
+
+
+class IECUnavailableError(Exception):
+    """
+    The circuit is open, the request
+    was not sent to IEC
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        self.retry_after = retry_after
+        super().__init__(f"IEC circuit is open, retry after {retry_after:.0f}s")
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to IEC after repeated
+    failures, every request sent while IEC is blocking
+    us keeps us blocked longer.
+    The backoff grows exponentially (with jitter) each
+    time the circuit opens again, after it a single
+    probe request decides if the circuit closes.
+    """
+
+    def __init__(
+        self, failure_threshold: int, base_backoff: float, max_backoff: float
+    ) -> None:
+        """
+        :param failure_threshold: consecutive failures that open the circuit
+        :type failure_threshold: int
+        :param base_backoff: seconds the circuit stays open the first time
+        :type base_backoff: float
+        :param max_backoff: max seconds the circuit stays open
+        :type max_backoff: float
+        """
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._consecutive_failures = 0
+        # times opened without a successful probe between
+        self._consecutive_opens = 0
+        self._open_until: float = None
+        self._probing = False
+        self.failures_by_kind: Counter[FailureKind] = Counter()
+        self.times_opened = 0
+        self.rejected_requests = 0
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def state(self) -> CircuitState:
+        if self._open_until is None:
+            return CircuitState.CLOSED
+        if time.monotonic() < self._open_until:
+            return CircuitState.OPEN
+        return CircuitState.HALF_OPEN
+
+    @property
+    def retry_after(self) -> float:
+        """
+        Seconds until a request may be sent
+        """
+        if self._open_until is None:
+            return 0.0
+        return max(self._open_until - time.monotonic(), 0.0)
+
+    def allows_request(self) -> bool:
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        return state == CircuitState.HALF_OPEN and not self._probing
+
+    def before_request(self):
+        """
+        Called before every request
+
+        :raises IECUnavailableError: if the request should not be sent
+        """
+        if not self.allows_request():
+            self.rejected_requests += 1
+            raise IECUnavailableError(self.retry_after)
+        if self.state == CircuitState.HALF_OPEN:
+            self._probing = True
+
+    def record_success(self):
+        if self._open_until is not None:
+            self.logger.warning("IEC circuit closed")
+        self._consecutive_failures = 0
+        self._consecutive_opens = 0
+        self._open_until = None
+        self._probing = False
+
+    def release(self):
+        """
+        Called when a request ended without a
+        result (cancelled), lets another request probe
+        """
+        self._probing = False
+
+    def record_failure(self, kind: FailureKind, retry_after: float = None):
+        """
+        :param kind: the failure kind
+        :type kind: FailureKind
+        :param retry_after: Retry-After sent by IEC, defaults to None
+        :type retry_after: float, optional
+        """
+        self.failures_by_kind[kind] += 1
+        self._consecutive_failures += 1
+
+        probe_failed = self._probing
+        self._probing = False
+        if (
+            probe_failed
+            or kind == FailureKind.BLOCKED
+            or self._consecutive_failures >= self.failure_threshold
+        ):
+            self._open(kind, retry_after)
+
+    def _open(self, kind: FailureKind, retry_after: float = None):
+        self._consecutive_opens += 1
+        self.times_opened += 1
+        backoff = min(
+            self.base_backoff * 2 ** (self._consecutive_opens - 1), self.max_backoff
+        )
+        # jitter, to not probe at the same moment IEC frees us every time
+        backoff = random.uniform(backoff / 2, backoff)
+        if retry_after:
+            backoff = max(backoff, retry_after)
+        self._open_until = time.monotonic() + backoff
+        self._consecutive_failures = 0
+        self.logger.warning(f"IEC circuit opened for {backoff:.0f}s ({kind.value})")
+
+    async def wait_until_closed(self):
+        """
+        Sleeps while requests are not allowed,
+        used to pause background polling
+        """
+        if self.allows_request():
+            return
+        with span("breaker_wait"):
+            while not self.allows_request():
+                await asyncio.sleep(self.retry_after or 1)
@@ -1,10 +1,15 @@
 import asyncio
+import logging
+from tortoise.transactions import in_transaction
 from bot.db.models import City, Street
-from bot.iec.api import IECCity, iec_api
+from bot.iec.api import IECCity, IECStreet, iec_api
+from bot.iec.reference_snapshot import JSON_PATH, open_snapshot
 import aiofiles
 import json
 from dacite import from_dict
 
+BULK_BATCH_SIZE = 1000
+
 
 async def get_all_cities_with_streets() -> list[IECCity]:
     """
@@ -36,12 +41,33 @@ async def get_all_cities_with_streets() -> list[IECCity]:
 async def get_all_cities_and_streets_file() -> list[IECCity]:
     """
     Loads cities and streets from
-    local file
+    local file, the binary snapshot, built
+    again when the json changed, otherwise the json
 
     :return: IECCity with loaded_cities
     :rtype: list[IECCity]
     """
-    async with aiofiles.open("bot/iec/cities_streets.json", mode="r") as f:
+    snapshot = open_snapshot(rebuild=True)
+    if snapshot:
+        with snapshot:
+            return [
+                IECCity(
+                    id=city.id,
+                    name=city.name,
+                    mahoz_id=city.mahoz_id,
+                    mahoz_name=city.mahoz_name,
+                    distinct_name=city.distinct_name,
+                    distinct_id=city.distinct_id,
+                    loaded_streets=[
+                        IECStreet(id=s.id, name=s.name)
+                        for s in snapshot.streets_of(city)
+                    ],
+                )
+                for city in snapshot.cities()
+            ]
+
+    # no snapshot, see bot.iec.reference_snapshot
+    async with aiofiles.open(JSON_PATH, mode="r") as f:
         raw = await f.read()
         cities = json.loads(raw)
         return [from_dict(data_class=IECCity, data=c) for c in cities]
@@ -62,24 +88,39 @@ async def fill_db_cities_streets(download: bool) -> tuple:
         else await get_all_cities_and_streets_file()
     )
 
-    added_cities_count = 0
-    added_streets_count = 0
+    existing_city_ids = set(await City.all().values_list("id", flat=True))
+    existing_street_ids = set(await Street.all().values_list("id", flat=True))
 
+    new_cities = [
+        City(name=city.name, id=city.id, district_id=city.distinct_id)
+        for city in cities
+        if city.id not in existing_city_ids
+    ]
+    new_streets = []
     for city in cities:
-        exists = await City.filter(id=city.id).first()
-        db_city = (
-            exists
-            if exists
-            else await City.create(
-                name=city.name, id=city.id, district_id=city.distinct_id
-            )
-        )
-        if not exists:
-            added_cities_count += 1
-
         for street in city.loaded_streets:
-            if not await Street.exists(id=street.id):
-                await Street.create(name=street.name, id=street.id, city=db_city)
-                added_streets_count += 1
+            if street.id not in existing_street_ids:
+                # same id can be in more than one city, first wins
+                existing_street_ids.add(street.id)
+                new_streets.append(
+                    Street(name=street.name, id=street.id, city_id=city.id)
+                )
+
+    async with in_transaction():
+        for i in range(0, len(new_cities), BULK_BATCH_SIZE):
+            await City.bulk_create(new_cities[i : i + BULK_BATCH_SIZE])
+        for i in range(0, len(new_streets), BULK_BATCH_SIZE):
+            await Street.bulk_create(new_streets[i : i + BULK_BATCH_SIZE])
+
+    return (len(new_cities), len(new_streets))
 
-    return (added_cities_count, added_streets_count)
+
+async def fill_db_cities_streets_if_empty():
+    """
+    Fills the cities and streets from the
+    local file on the first run (empty db)
+    """
+    if await City.exists():
+        return
+    added_cities, added_streets = await fill_db_cities_streets(False)
+    logging.warning(f"Added {added_cities} cities and {added_streets} streets")
@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+import json
+import re
+from datetime import datetime
+from typing import Any
+from bot.db.models import Outage
+
+try:
+    # optional, faster json backend
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = (
+    "IECOutageStatus",
+    "NO_OUTAGE",
+    "json_loads",
+    "decode_outage_status",
+    "normalize_outage",
+)
+
+
+@dataclass
+class IECOutageStatus:
+    """
+    Represents get_outage_for_address response
+    """
+
+    is_active_incident: bool
+    is_planned_outage: bool
+    outage_time: datetime
+    incident_id: int
+    incident_source_code: int
+    incident_source_desc: str
+    incident_status_code: int
+    incident_status_name: str
+    incident_trouble_code: int
+    incident_trouble_desc: str
+    delay_cause_code: int
+    delay_cause_desc: str
+    crew_name: str
+    last_crew_assignment_time: datetime
+    restore_est: datetime
+
+    def get_outage_model(self) -> Outage:
+        """
+        Makes a db model
+        from partial outage response
+
+        :return: db Outage model
+        :rtype: Outage
+        """
+        return Outage(
+            is_planned=self.is_planned_outage,
+            start_time=self.outage_time,
+            incident_id=self.incident_id,
+            incident_source_code=self.incident_source_code,
+            incident_source_desc=self.incident_source_desc,
+            incident_status_code=self.incident_status_code,
+            incident_trouble_code=self.incident_trouble_code,
+            incident_trouble_desc=self.incident_trouble_desc,
+            delay_cause_code=self.delay_cause_code,
+            delay_cause_desc=self.delay_cause_desc,
+            crew_name=self.crew_name,
+            crew_assigned_time=self.last_crew_assignment_time,
+            restore_est=self.restore_est,
+        )
+
+
+# shared status for every "no outage" response, must not be modified
+NO_OUTAGE = IECOutageStatus(
+    is_active_incident=False,
+    is_planned_outage=False,
+    outage_time=None,
+    incident_id=None,
+    incident_source_code=None,
+    incident_source_desc=None,
+    incident_status_code=None,
+    incident_status_name=None,
+    incident_trouble_code=None,
+    incident_trouble_desc=None,
+    delay_cause_code=None,
+    delay_cause_desc=None,
+    crew_name=None,
+    last_crew_assignment_time=None,
+    restore_est=None,
+)
+
+# all in a "no outage" response, an error body like
+# {"Message":"An error has occurred."} has none of them
+_NO_OUTAGE_MARKERS = tuple(
+    re.compile(rb'"%s"\s*:\s*false' % field)
+    for field in (b"IsActiveIncident", b"IsPlannedOutage", b"Time_OutageSpecified")
+)
+# restore estimation inside IncidentStatusName, "14:19 05/12/2021"
+_RESTORE_EST_RE = re.compile(r"(\d{2}):(\d{2})[ X](\d{2})/(\d{2})/(\d{4})")
+
+
+def json_loads(raw: bytes) -> Any:
+    """
+    Decodes json, with orjson if installed
+
+    :param raw: json
+    :type raw: bytes
+    :return: decoded object
+    :rtype: Any
+    """
+    if orjson:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _parse_iec_datetime(raw: str) -> datetime:
+    # "%Y-%m-%dT%H:%M:%S", fromisoformat is much faster than strptime
+    return datetime.fromisoformat(raw)
+
+
+def _parse_restore_est(status_name: str) -> datetime:
+    if not status_name:
+        return None
+    match = _RESTORE_EST_RE.search(status_name)
+    if not match:
+        return None
+    hour, minute, day, month, year = match.groups()
+    return datetime(int(year), int(month), int(day), int(hour), int(minute))
+
+
+def normalize_outage(outage: dict) -> IECOutageStatus:
+    """
+    Makes an IECOutageStatus from a
+    decoded CheckInterruptByAddress response
+
+    :param outage: decoded response
+    :type outage: dict
+    :return: the outage status
+    :rtype: IECOutageStatus
+    """
+    return IECOutageStatus(
+        is_active_incident=outage.get("IsActiveIncident"),
+        is_planned_outage=outage.get("IsPlannedOutage"),
+        outage_time=_parse_iec_datetime(outage["Time_Outage"])
+        if outage["Time_OutageSpecified"]
+        else None,
+        incident_id=outage.get("IncidentID") or None,
+        incident_source_code=outage.get("IncidentSourceCode") or None,
+        incident_source_desc=outage.get("IncidentSourceDesc"),
+        incident_status_code=outage.get("IncidentStatusCode") or None,
+        incident_status_name=outage.get("IncidentStatusName"),
+        incident_trouble_code=outage.get("IncidentTroubleCode") or None,
+        incident_trouble_desc=outage.get("IncidentTroubleDesc"),
+        delay_cause_code=outage.get("DelayCauseCode") or None,
+        delay_cause_desc=outage.get("DelayCauseDesc"),
+        crew_name=outage.get("CrewName"),
+        last_crew_assignment_time=_parse_iec_datetime(outage["LastCrewAssignment"])
+        if outage["LastCrewAssignmentSpecified"]
+        else None,
+        restore_est=_parse_restore_est(outage.get("IncidentStatusName")),
+    )
+
+
+def decode_outage_status(raw: bytes) -> IECOutageStatus:
+    """
+    Decodes a CheckInterruptByAddress response body.
+    Most responses are "no outage", those are detected
+    on the raw bytes and return the shared NO_OUTAGE
+    without decoding the json at all. Any other body
+    is fully decoded, a malformed one raises.
+
+    :param raw: response body
+    :type raw: bytes
+    :raises KeyError: not an outage status
+    :return: the outage status
+    :rtype: IECOutageStatus
+    """
+    if raw.lstrip()[:1] == b"{" and all(
+        marker.search(raw) for marker in _NO_OUTAGE_MARKERS
+    ):
+        return NO_OUTAGE
+    return normalize_outage(json_loads(raw))
@@ -0,0 +1,147 @@
+"""
+Micro benchmark of CheckInterruptByAddress response decoding,
+before (resp.json + strptime) and after (bot.iec.decoding).
+
+usage: python -m bot.iec.decoding_benchmark [bodies_file]
+
+bodies_file has one recorded response body per line, or is
+an IEC_RECORD_FILE log (.jsonl.gz), without it a built in
+no-outage/outage sample is used.
+"""
+import json
+import re
+import sys
+import timeit
+from datetime import datetime
+from bot.iec.decoding import IECOutageStatus, decode_outage_status, orjson
+from bot.iec.recording import recorded_bodies
+
+NO_OUTAGE_BODY = json.dumps(
+    {
+        "IsActiveIncident": False,
+        "IsPlannedOutage": False,
+        "Time_Outage": "0001-01-01T00:00:00",
+        "Time_OutageSpecified": False,
+        "IncidentID": 0,
+        "IncidentSourceCode": 0,
+        "IncidentSourceDesc": None,
+        "IncidentStatusCode": 0,
+        "IncidentStatusName": None,
+        "IncidentTroubleCode": 0,
+        "IncidentTroubleDesc": None,
+        "DelayCauseCode": 0,
+        "DelayCauseDesc": None,
+        "CrewName": None,
+        "LastCrewAssignment": "0001-01-01T00:00:00",
+        "LastCrewAssignmentSpecified": False,
+    }
+).encode()
+
+OUTAGE_BODY = json.dumps(
+    {
+        "IsActiveIncident": True,
+        "IsPlannedOutage": False,
+        "Time_Outage": "2021-12-05T11:19:00",
+        "Time_OutageSpecified": True,
+        "IncidentID": 4417745,
+        "IncidentSourceCode": 3,
+        "IncidentSourceDesc": "DMS",
+        "IncidentStatusCode": 4,
+        "IncidentStatusName": "צפי לסיום 14:19 05/12/2021",
+        "IncidentTroubleCode": 12,
+        "IncidentTroubleDesc": "מנגנון גיבוי",
+        "DelayCauseCode": 2,
+        "DelayCauseDesc": "עומס תקלות חריג",
+        "CrewName": "איציק, שי",
+        "LastCrewAssignment": "2021-12-05T11:54:00",
+        "LastCrewAssignmentSpecified": True,
+    },
+    ensure_ascii=False,
+).encode()
+
+
+def legacy_decode(raw: bytes) -> IECOutageStatus:
+    """
+    The decoding as it was done before bot.iec.decoding
+    """
+    outage = json.loads(raw)
+    restore_est_matches = re.search(
+        r"\d{2}:\d{2}[ X]\d{2}\/\d{2}\/\d{4}",
+        outage.get("IncidentStatusName") or "",
+    )
+    restore_est = (
+        datetime.strptime(restore_est_matches[0], "%H:%M %d/%m/%Y")
+        if restore_est_matches
+        else None
+    )
+    return IECOutageStatus(
+        is_active_incident=outage.get("IsActiveIncident"),
+        is_planned_outage=outage.get("IsPlannedOutage"),
+        outage_time=datetime.strptime(outage["Time_Outage"], "%Y-%m-%dT%H:%M:%S")
+        if outage["Time_OutageSpecified"]
+        else None,
+        incident_id=outage.get("IncidentID") or None,
+        incident_source_code=outage.get("IncidentSourceCode") or None,
+        incident_source_desc=outage.get("IncidentSourceDesc"),
+        incident_status_code=outage.get("IncidentStatusCode") or None,
+        incident_status_name=outage.get("IncidentStatusName"),
+        incident_trouble_code=outage.get("IncidentTroubleCode") or None,
+        incident_trouble_desc=outage.get("IncidentTroubleDesc"),
+        delay_cause_code=outage.get("DelayCauseCode") or None,
+        delay_cause_desc=outage.get("DelayCauseDesc"),
+        crew_name=outage.get("CrewName"),
+        last_crew_assignment_time=datetime.strptime(
+            outage["LastCrewAssignment"], "%Y-%m-%dT%H:%M:%S"
+        )
+        if outage["LastCrewAssignmentSpecified"]
+        else None,
+        restore_est=restore_est,
+    )
+
+
+def load_bodies(path: str) -> list[bytes]:
+    if path.endswith(".gz"):
+        # an IEC_RECORD_FILE log
+        return recorded_bodies(path)
+    with open(path, "rb") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def bench(name: str, decode, bodies: list[bytes]) -> float:
+    def run():
+        for body in bodies:
+            decode(body)
+
+    number = max(1, 20000 // len(bodies))
+    best = min(timeit.repeat(run, number=number, repeat=5))
+    per_response = best / (number * len(bodies)) * 1e6
+    print(f"{name:<32} {per_response:8.2f} us/response")
+    return per_response
+
+
+def main():
+    if len(sys.argv) > 1:
+        bodies = load_bodies(sys.argv[1])
+        sets = {"recorded": bodies}
+    else:
+        # roughly the production mix, almost all "no outage"
+        sets = {
+            "no outage": [NO_OUTAGE_BODY],
+            "outage": [OUTAGE_BODY],
+            "mix 98/2": [NO_OUTAGE_BODY] * 49 + [OUTAGE_BODY],
+        }
+
+    for bodies in sets.values():
+        for body in bodies:
+            assert legacy_decode(body) == decode_outage_status(body)
+
+    print(f"json backend: {'orjson' if orjson else 'json'}")
+    for set_name, bodies in sets.items():
+        print(f"-- {set_name} ({len(bodies)} bodies)")
+        before = bench("before", legacy_decode, bodies)
+        after = bench("after", decode_outage_status, bodies)
+        print(f"{'speedup':<32} {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
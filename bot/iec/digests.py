@@ -0,0 +1,209 @@
+import asyncio
+import logging
+from typing import Iterator, Union
+from aiogram.bot.bot import Bot
+from aiogram.types.message import Message
+from bot.delivery import unreachable_users
+
+__all__ = ("DigestNotifier",)
+
+# telegram max message length
+MAX_MESSAGE_LENGTH = 4096
+SEPARATOR = "\n\n" + "➖" * 8 + "\n\n"
+
+
+class UserDigest:
+    """
+    The pending and sent notifications of a user
+    """
+
+    __slots__ = ("outages", "ended", "msg_ids", "flush_task", "flushing", "dirty")
+
+    def __init__(self) -> None:
+        # outage id: text of the outage, while active
+        self.outages: dict[int, str] = {}
+        # end texts not sent yet
+        self.ended: list[str] = []
+        # the last digest messages
+        self.msg_ids: list[int] = []
+        self.flush_task: asyncio.Task = None
+        # flush_task is sending, not waiting for the window
+        self.flushing = False
+        # changed since the last flush started
+        self.dirty = False
+
+
+class DigestNotifier:
+    """
+    Merges the outage notifications of a user, for all
+    of their addresses, into one message.
+    The first change starts a coalescing window, at its
+    end the last digest is deleted and one message with
+    all the active outages (and the ones that ended) is sent
+    """
+
+    def __init__(self, telegram_bot: Bot, window: float) -> None:
+        """
+        :param telegram_bot: the bot
+        :type telegram_bot: Bot
+        :param window: seconds changes are collected before sending
+        :type window: float
+        """
+        self.telegram_bot = telegram_bot
+        self.window = window
+        self.digests: dict[int, UserDigest] = {}
+        self.sent_digests = 0
+        self.logger = logging.getLogger(__name__)
+
+    def outage_changed(self, user_id: int, outage_id: int, text: str):
+        """
+        An outage of the user started or was updated
+
+        :param user_id: telegram user id
+        :type user_id: int
+        :param outage_id: db Outage id
+        :type outage_id: int
+        :param text: the outage text
+        :type text: str
+        """
+        digest = self.digests.setdefault(user_id, UserDigest())
+        digest.outages[outage_id] = text
+        self._schedule(user_id, digest)
+
+    def outage_ended(self, user_id: int, outage_id: int, text: str):
+        """
+        An outage of the user ended
+
+        :param user_id: telegram user id
+        :type user_id: int
+        :param outage_id: db Outage id
+        :type outage_id: int
+        :param text: the end text
+        :type text: str
+        """
+        digest = self.digests.setdefault(user_id, UserDigest())
+        digest.outages.pop(outage_id, None)
+        digest.ended.append(text)
+        self._schedule(user_id, digest)
+
+    def _schedule(self, user_id: int, digest: UserDigest):
+        digest.dirty = True
+        if digest.flush_task is None:
+            digest.flush_task = asyncio.ensure_future(self._flush_later(user_id))
+
+    async def _flush_later(self, user_id: int):
+        await asyncio.sleep(self.window)
+        try:
+            await self.flush(user_id)
+        except Exception:
+            self.logger.exception(f"Digest of {user_id} failed")
+
+    async def flush(self, user_id: int):
+        """
+        Replaces the last digest of the user
+
+        :param user_id: telegram user id
+        :type user_id: int
+        """
+        digest = self.digests.get(user_id)
+        if digest is None:
+            return
+        digest.dirty = False
+        digest.flushing = True
+        try:
+            parts = list(digest.outages.values()) + digest.ended
+            digest.ended = []
+
+            old_msg_ids, digest.msg_ids = digest.msg_ids, []
+            await asyncio.gather(
+                *[self.telegram_bot.delete_message(user_id, i) for i in old_msg_ids],
+                return_exceptions=True,
+            )
+            msgs_results: list[Union[Message, Exception]] = await asyncio.gather(
+                *[
+                    self.telegram_bot.send_message(user_id, text)
+                    for text in self._render(parts)
+                ],
+                return_exceptions=True,
+            )
+            digest.msg_ids = [m.message_id for m in msgs_results if type(m) == Message]
+            self.sent_digests += 1
+            await unreachable_users.check_results(
+                [user_id] * len(msgs_results), msgs_results
+            )
+        finally:
+            # also when it failed, else no flush is scheduled again
+            digest.flush_task = None
+            digest.flushing = False
+            if digest.dirty:
+                self._schedule(user_id, digest)
+            elif not digest.outages and self.digests.get(user_id) is digest:
+                # nothing active, the next outage starts a new digest
+                del self.digests[user_id]
+
+    @staticmethod
+    def _render(parts: list[str]) -> list[str]:
+        """
+        :param parts: the outages texts
+        :type parts: list[str]
+        :return: the messages, split if too long for one
+        :rtype: list[str]
+        """
+        messages = []
+        text = ""
+        for part in DigestNotifier._split_part(parts):
+            if text and len(text) + len(SEPARATOR) + len(part) > MAX_MESSAGE_LENGTH:
+                messages.append(text)
+                text = ""
+            text = text + SEPARATOR + part if text else part
+        if text:
+            messages.append(text)
+        return messages
+
+    @staticmethod
+    def _split_part(parts: list[str]) -> Iterator[str]:
+        """
+        :param parts: the outages texts
+        :type parts: list[str]
+        :yield: the texts, the ones too long for a message
+            split between lines (or inside a too long line)
+        :rtype: Iterator[str]
+        """
+        for part in parts:
+            if len(part) <= MAX_MESSAGE_LENGTH:
+                yield part
+                continue
+            lines: list[str] = []
+            size = 0
+            for line in part.split("\n"):
+                while len(line) > MAX_MESSAGE_LENGTH:
+                    if lines:
+                        yield "\n".join(lines)
+                        lines, size = [], 0
+                    yield line[:MAX_MESSAGE_LENGTH]
+                    line = line[MAX_MESSAGE_LENGTH:]
+                if lines and size + 1 + len(line) > MAX_MESSAGE_LENGTH:
+                    yield "\n".join(lines)
+                    lines, size = [], 0
+                size += len(line) + (1 if lines else 0)
+                lines.append(line)
+            if lines:
+                yield "\n".join(lines)
+
+    async def flush_all(self):
+        """
+        Sends all the pending digests now
+        """
+        sending = []
+        waiting = []
+        for user_id, digest in self.digests.items():
+            if digest.flush_task is None:
+                continue
+            if digest.flushing:
+                sending.append(digest.flush_task)
+            else:
+                digest.flush_task.cancel()
+                digest.flush_task = None
+                waiting.append(user_id)
+        await asyncio.gather(*sending, return_exceptions=True)
+        await asyncio.gather(*[self.flush(user_id) for user_id in waiting])
@@ -1,42 +1,55 @@
 import asyncio
 from asyncio.tasks import Task
-from dataclasses import dataclass
+from collections import Counter, deque
+import json
 import logging
-from typing import Union
+import os
+import time
+from typing import Optional, Union
 from aiogram.bot.bot import Bot
 from aiogram.types.message import Message
 from datetime import datetime
-from bot.db.models import Address, Outage
+from bot.db.models import Address, City, Incident, Outage
 from bot.utils import (
     compare_db_outage_outage_status,
     detail_text_from_outage,
     get_full_address_formated,
+    outage_details_text,
     time_diff_between_two_dates_text,
 )
-from bot.iec.api import IECOutageStatus, iec_api
-
-
-@dataclass
-class ActiveOutageData:
-    db_outage: Outage
-    telegram_last_sent_text: str
-    telegram_last_msg_ids: dict[int:int]
-    full_address_name: str
-    city_id: int
-    street_id: int
-    home_num: int
-    district_id: int
-
-
-# @dataclass
-# class AddressIds:
-#     city_id: int
-#     street_id: int
-#     home_num: int
-#     city_district_id: int
-
-
-# TODO - LOAD ACTIVE DATA FROM DB WHEN STARTING
+from bot.iec.active_outages import (
+    ActiveIncident,
+    ActiveOutageData,
+    OUTAGE_STATUS_FIELDS,
+    db_outage_fields,
+    dump_fields,
+    format_outage_key,
+    gen_outage_key,
+    incident_fields,
+    load_fields,
+    outage_fields_from_status,
+    shared_incident_fields,
+    split_outage_key,
+)
+from bot.iec.digests import DigestNotifier
+from bot.delivery import unreachable_users
+from bot.iec.api import (
+    IECOutageStatus,
+    IECUnavailableError,
+    classify_failure,
+    iec_api,
+)
+from bot.iec.status_cache import outage_status_cache
+from bot.iec.work_set import AddressKey, address_work_set
+from bot.tracing import (
+    OUTCOME_PROCESSED,
+    Trace,
+    active_trace,
+    span,
+    traced,
+    tracer,
+)
+from bot.config import config
 
 
 class OutagesMonitor:
@@ -48,54 +61,126 @@ class OutagesMonitor:
     also saves to the db.
     """
 
-    @staticmethod
-    def gen_outage_key(city_id: int, street_id: int, home_num: int) -> str:
+    def get_addresses_to_check(self) -> list[AddressKey]:
         """
-        Genrates a key based on city_id,street_id,home_num
-        {city_id}-{street_id}-{home_num}
+        Gets the unique subscribed addresses
+        for checking their status, and all the
+        active outages to know when they end.
+        One representative address of every active
+        incident is first.
+
+        :return: list[(city_id, district_id,street_id,home_num)]
+        :rtype: list[AddressKey]
+        """
+        addresses = [
+            self._address_of(incident.representative)
+            for incident in self.active_incidents.values()
+            if incident.representative is not None
+        ]
+        first = set(addresses)
+        addresses += [add for add in self.work_set if add not in first]
+        for outage_key in self.active_outages:
+            add = self._address_of(outage_key)
+            if add not in self.work_set and add not in first:
+                addresses.append(add)
+        return addresses
+
+    def _address_of(self, outage_key: int) -> AddressKey:
+        """
+        :param outage_key: key of an active outage
+        :type outage_key: int
+        :return: (city_id, district_id, street_id, home_num)
+        :rtype: AddressKey
+        """
+        city_id, street_id, home_num = split_outage_key(outage_key)
+        district_id = self.active_outages[outage_key].district_id
+        return (city_id, district_id, street_id, home_num)
+
+    async def reconcile_work_set_if_needed(self):
+        """
+        Reloads the work set from the db
+        every config.monitor.reconcile_interval
+        """
+        now = asyncio.get_running_loop().time()
+        if now - self._last_reconcile < config.monitor.reconcile_interval:
+            return
+        self._last_reconcile = now
+        try:
+            await self.work_set.reconcile()
+        except Exception:
+            self.logger.exception("Work set reconcile failed")
+
+    def burst_neighbours(self, city_id: int, street_id: int, home_num: int):
+        """
+        Outages usually hit a whole street or neighbourhood,
+        moves the subscribed addresses on the same street, then
+        in the same city (and district) to the front of the poll queue.
+        At most config.monitor.burst_max_addresses, once per
+        street every config.monitor.burst_cooldown seconds
 
         :param city_id: iec city id
         :type city_id: int
         :param street_id: iec street id
         :type street_id: int
-        :param home_num: the home number
+        :param home_num: home number of the outage that started or ended
         :type home_num: int
-        :return: {city_id}-{street_id}-{home_num}
-        :rtype: str
         """
-        return f"{city_id}-{street_id}-{home_num}"
+        now = asyncio.get_running_loop().time()
+        street_key = (city_id, street_id)
+        last_burst = self._last_bursts.get(street_key)
+        if last_burst is not None and now - last_burst < config.monitor.burst_cooldown:
+            return
+        self._last_bursts[street_key] = now
+        if len(self._last_bursts) > 1024:
+            self._prune_bursts(now)
+
+        budget = config.monitor.burst_max_addresses
+        front: list[AddressKey] = []
+        picked: set[AddressKey] = set()
+        # nearest homes on the street first
+        street = sorted(
+            self.work_set.on_street(city_id, street_id),
+            key=lambda add: abs(add[3] - home_num),
+        )
+        for neighbours in (street, self.work_set.in_city(city_id)):
+            for add in neighbours:
+                if len(front) == budget:
+                    break
+                if add in picked or add in self._in_flight:
+                    continue
+                if add[2] == street_id and add[3] == home_num:
+                    continue
+                picked.add(add)
+                front.append(add)
+
+        if not front:
+            return
+        self.bursts += 1
+        self.burst_checks += len(front)
+        self.move_to_front(front)
+        self.logger.info(
+            f"Burst checking {len(front)} addresses near {city_id}-{street_id}"
+        )
 
-    async def get_addresses_to_check(self) -> set[tuple[int, int, int, int]]:
+    def move_to_front(self, addresses: list[AddressKey]):
         """
-        Gets from the db unique addresses
-        for checking their status, and all the
-        active outages to know when they end.
+        Checks the addresses next, before
+        the rest of the poll queue
 
-        :return: set[(city_id, district_id,street_id,home_num)]
-        :rtype: set[tuple[int, int, int, int]]
+        :param addresses: [(city_id, district_id, street_id, home_num)]
+        :type addresses: list[AddressKey]
         """
-        raw = (
-            await Address.all()
-            .select_related(
-                "city",
-            )
-            .distinct()
-            .values("city_id", "street_id", "home_num", district_id="city__district_id")
+        front = [add for add in addresses if add not in self._in_flight]
+        moved = set(front)
+        self.poll_queue = deque(
+            front + [add for add in self.poll_queue if add not in moved]
         )
-        set = {
-            (a["city_id"], a["district_id"], a["street_id"], a["home_num"]) for a in raw
+
+    def _prune_bursts(self, now: float):
+        cooldown = config.monitor.burst_cooldown
+        self._last_bursts = {
+            k: t for k, t in self._last_bursts.items() if now - t < cooldown
         }
-        for outage_data in self.active_outages.values():
-            outage_data: ActiveOutageData
-            set.add(
-                (
-                    outage_data.city_id,
-                    outage_data.district_id,
-                    outage_data.street_id,
-                    outage_data.home_num,
-                )
-            )
-        return set
 
     async def get_registered_user_ids_for_addresses(
         self, city_id: int, street_id: int, home_num: int
@@ -113,21 +198,24 @@ class OutagesMonitor:
         :return: list of telegram user ids
         :rtype: list[int]
         """
-        return [
-            a["user_id"]
-            for a in (
+        with span("db.read", table="address"):
+            addresses = (
                 await Address.filter(
-                    city_id=city_id, street_id=street_id, home_num=home_num
+                    city_id=city_id,
+                    street_id=street_id,
+                    home_num=home_num,
+                    user__is_active=True,
                 )
                 .all()
                 .values("user_id")
             )
-        ]
+        return [a["user_id"] for a in addresses]
 
     async def send_telegram_outage_msg(
         self,
         user_ids: int,
         active_outage_data: ActiveOutageData,
+        details: str = None,
     ):
         """
         Send a telegram messsage with the
@@ -140,37 +228,53 @@ class OutagesMonitor:
         :type user_ids: int
         :param active_outage_data: saved outage data
         :type active_outage_data: ActiveOutageData
+        :param details: outage_details_text if allready rendered
+        :type details: str, optional
         """
         if len(user_ids) == 0:
             return
 
-        outage = active_outage_data.db_outage
         add_name = active_outage_data.full_address_name
-        text = detail_text_from_outage(outage, add_name)
+        text = detail_text_from_outage(active_outage_data, add_name, details)
 
-        if active_outage_data.telegram_last_sent_text == text:
+        text_hash = hash(text)
+        if active_outage_data.telegram_last_sent_hash == text_hash:
             return
 
-        active_outage_data.telegram_last_sent_text = text
+        active_outage_data.telegram_last_sent_hash = text_hash
+
+        if self.digests:
+            with span("digest", users=len(user_ids)):
+                for uid in user_ids:
+                    self.digests.outage_changed(uid, active_outage_data.outage_id, text)
+            return
 
         # delete
         delete_tasks = [
-            self.telegram_bot.delete_message(
-                uid, active_outage_data.telegram_last_msg_ids.get(uid, "-1")
+            traced(
+                self.telegram_bot.delete_message(
+                    uid, active_outage_data.get_msg_id(uid)
+                ),
+                "telegram.delete",
+                user_id=uid,
             )
             for uid in user_ids
         ]
-        await asyncio.gather(*delete_tasks, return_exceptions=True)
+        await self._gather_sends(delete_tasks)
         # delete
 
-        tasks = [self.telegram_bot.send_message(uid, text) for uid in user_ids]
-        msgs_results: Union[Message, Exception] = await asyncio.gather(
-            *tasks, return_exceptions=True
-        )
+        tasks = [
+            traced(
+                self.telegram_bot.send_message(uid, text), "telegram.send", user_id=uid
+            )
+            for uid in user_ids
+        ]
+        msgs_results: Union[Message, Exception] = await self._gather_sends(tasks)
 
-        active_outage_data.telegram_last_msg_ids = {
-            m.chat.id: m.message_id for m in msgs_results if type(m) == Message
-        }
+        active_outage_data.set_msg_ids(
+            {m.chat.id: m.message_id for m in msgs_results if type(m) == Message}
+        )
+        await unreachable_users.check_results(user_ids, msgs_results)
 
     async def send_telegram_end_msg(
         self, user_ids: list[int], active_outage_data: ActiveOutageData
@@ -186,7 +290,7 @@ class OutagesMonitor:
         :type active_outage_data: ActiveOutageData
         """
 
-        outage = active_outage_data.db_outage
+        outage = active_outage_data
         total_time = time_diff_between_two_dates_text(
             outage.end_time, outage.start_time
         )
@@ -197,15 +301,68 @@ class OutagesMonitor:
         text += f"<b>התחלה:</b> {start}\n"
         text += f"<b>סיום:</b> {end}"
 
-        tasks = [self.telegram_bot.send_message(uid, text) for uid in user_ids]
-        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.digests:
+            with span("digest", users=len(user_ids)):
+                for uid in user_ids:
+                    self.digests.outage_ended(uid, active_outage_data.outage_id, text)
+            return
+
+        tasks = [
+            traced(
+                self.telegram_bot.send_message(uid, text), "telegram.send", user_id=uid
+            )
+            for uid in user_ids
+        ]
+        results = await self._gather_sends(tasks)
+        await unreachable_users.check_results(user_ids, results)
+
+    async def _gather_sends(self, tasks: list) -> list:
+        """
+        Runs telegram calls together,
+        counted in telegram_in_flight
+
+        :param tasks: the calls
+        :type tasks: list
+        :return: the results or exceptions
+        :rtype: list
+        """
+        self.telegram_in_flight += len(tasks)
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            self.telegram_in_flight -= len(tasks)
+
+    def needs_processing(self, add: AddressKey, outage: IECOutageStatus) -> bool:
+        """
+        The diff stage, checks in memory if a fetched
+        status creates, updates or ends an outage
+
+        :param add: (city_id, district_id, street_id, home_num)
+        :type add: AddressKey
+        :param outage: outage status iec
+        :type outage: IECOutageStatus
+        :return: True if it has to be persisted and sent
+        :rtype: bool
+        """
+        city_id, _, street_id, home_num = add
+        ongoing_power_outage = outage.is_active_incident or outage.is_planned_outage
+        active_outage_data = self.active_outages.get(
+            gen_outage_key(city_id, street_id, home_num)
+        )
+        if active_outage_data is None:
+            return ongoing_power_outage
+        if not ongoing_power_outage:
+            return True
+        return not compare_db_outage_outage_status(active_outage_data, outage)
 
     async def check_and_process(
         self, city_id: int, district_id: int, street_id: int, home_num: int
     ):
         """
         Checks for outage at a specific address,
-        and creates, updates, or ends it
+        and creates, updates, or ends it.
+        Outside of the monitoring pipeline, traced
+        as a check
 
         :param city_id: iec city id
         :type city_id: int
@@ -216,12 +373,46 @@ class OutagesMonitor:
         :param home_num: home number
         :type home_num: int
         """
-        outage = await iec_api.get_outage_for_address(
-            city_id, district_id, street_id, home_num
-        )
+        add = (city_id, district_id, street_id, home_num)
+        trace = tracer.start("check", *add)
+        try:
+            with active_trace(trace):
+                outage = await outage_status_cache.refresh(*add)
+                with span("diff"):
+                    if self.needs_processing(add, outage):
+                        trace.outcome = OUTCOME_PROCESSED
+                await self.process_outage_status(*add, outage)
+        except Exception as e:
+            tracer.finish(trace, type(e).__name__)
+            raise
+        tracer.finish(trace)
+
+    async def process_outage_status(
+        self,
+        city_id: int,
+        district_id: int,
+        street_id: int,
+        home_num: int,
+        outage: IECOutageStatus,
+    ):
+        """
+        Creates, updates, or ends the outage
+        of an address from its status
+
+        :param city_id: iec city id
+        :type city_id: int
+        :param district_id: iec city district id
+        :type district_id: int
+        :param street_id: iec street id
+        :type street_id: int
+        :param home_num: home number
+        :type home_num: int
+        :param outage: outage status iec
+        :type outage: IECOutageStatus
+        """
         ongoing_power_outage = outage.is_active_incident or outage.is_planned_outage
 
-        outage_key = self.gen_outage_key(city_id, street_id, home_num)
+        outage_key = gen_outage_key(city_id, street_id, home_num)
 
         # no outage, we dont have to do anything
         if not ongoing_power_outage and outage_key not in self.active_outages:
@@ -239,12 +430,12 @@ class OutagesMonitor:
             await self._process_new_outage(
                 outage, outage_key, city_id, district_id, street_id, home_num
             )
-            self.logger.info("New outage detected: " + outage_key)
+            self.logger.info("New outage detected: " + format_outage_key(outage_key))
 
         # outage ended
         if not ongoing_power_outage and outage_key in self.active_outages:
             await self._process_outage_ended(outage_key, city_id, street_id, home_num)
-            self.logger.info("Outage end detected: " + outage_key)
+            self.logger.info("Outage end detected: " + format_outage_key(outage_key))
 
     async def _process_outage_update_if_needed(
         self,
@@ -269,23 +460,34 @@ class OutagesMonitor:
         :param home_num: iec home number
         :type home_num: int
         """
-        db_outage = active_outage_data.db_outage
-        if compare_db_outage_outage_status(db_outage, outage):
+        if compare_db_outage_outage_status(active_outage_data, outage):
+            return
+        fields = outage_fields_from_status(outage)
+        outage_key = gen_outage_key(city_id, street_id, home_num)
+
+        incident = self.active_incidents.get(outage.incident_id)
+        if (
+            incident is not None
+            and active_outage_data.incident_id == incident.incident_id
+        ):
+            if incident.matches(fields):
+                # only the start time of this outage, not sent
+                active_outage_data.update(fields)
+                with span("db.write", table="outage"):
+                    await Outage.filter(id=active_outage_data.outage_id).update(
+                        **fields
+                    )
+                return
+            # once for all the outages of the incident
+            await self._process_incident_update(incident, fields)
             return
-        db_outage.is_planned = outage.is_planned_outage
-        db_outage.start_time = outage.outage_time
-        db_outage.incident_id = outage.incident_id
-        db_outage.incident_source_code = outage.incident_source_code
-        db_outage.incident_source_desc = outage.incident_source_desc
-        db_outage.incident_status_code = outage.incident_status_code
-        db_outage.incident_trouble_code = outage.incident_trouble_code
-        db_outage.incident_trouble_desc = outage.incident_trouble_desc
-        db_outage.delay_cause_code = outage.delay_cause_code
-        db_outage.delay_cause_desc = outage.delay_cause_desc
-        db_outage.crew_name = outage.crew_name
-        db_outage.crew_assigned_time = outage.last_crew_assignment_time
-        db_outage.restore_est = outage.restore_est
-        await db_outage.save()
+
+        if active_outage_data.incident_id != outage.incident_id:
+            await self._unlink_incident(outage_key, active_outage_data)
+        active_outage_data.update(fields)
+        with span("db.write", table="outage"):
+            await Outage.filter(id=active_outage_data.outage_id).update(**fields)
+        await self._link_incident(outage_key, fields)
 
         user_ids = await self.get_registered_user_ids_for_addresses(
             city_id, street_id, home_num
@@ -293,10 +495,112 @@ class OutagesMonitor:
 
         await self.send_telegram_outage_msg(user_ids, active_outage_data)
 
+    async def _link_incident(self, outage_key: int, fields: dict):
+        """
+        Links an active outage to its incident,
+        saves the incident if first seen or
+        processes it's update if its details changed
+
+        :param outage_key: gen outage key
+        :type outage_key: int
+        :param fields: db Outage fields of the outage
+        :type fields: dict
+        """
+        incident_id = fields["incident_id"]
+        if incident_id is None:
+            return
+
+        incident = self.active_incidents.get(incident_id)
+        if incident is None:
+            incident = ActiveIncident(incident_id, fields)
+            self.active_incidents[incident_id] = incident
+            with span("db.write", table="incident"):
+                await Incident.update_or_create(
+                    id=incident_id,
+                    defaults=dict(end_time=None, **incident_fields(fields)),
+                )
+        elif not incident.matches(fields):
+            await self._process_incident_update(incident, fields)
+        incident.link(outage_key)
+
+    async def _unlink_incident(
+        self, outage_key: int, active_outage_data: ActiveOutageData, ended=False
+    ):
+        """
+        Unlinks an active outage from its incident,
+        ends the incident if it was the last outage
+
+        :param outage_key: gen outage key
+        :type outage_key: int
+        :param active_outage_data: active outage data
+        :type active_outage_data: ActiveOutageData
+        :param ended: the outage ended, defaults to False
+        :type ended: bool, optional
+        """
+        incident = self.active_incidents.get(active_outage_data.incident_id)
+        if incident is None:
+            return
+
+        was_representative = incident.representative == outage_key
+        incident.unlink(outage_key)
+        if not incident.outage_keys:
+            del self.active_incidents[incident.incident_id]
+            with span("db.write", table="incident"):
+                await Incident.filter(id=incident.incident_id).update(
+                    end_time=datetime.now().replace(microsecond=0)
+                )
+        elif ended and was_representative:
+            # power is probably back in the rest of the incident too
+            self.move_to_front([self._address_of(k) for k in incident.outage_keys])
+
+    async def _process_incident_update(self, incident: ActiveIncident, fields: dict):
+        """
+        Saves the new details of an incident once,
+        and sends them to the users of all
+        its outages
+
+        :param incident: the active incident
+        :type incident: ActiveIncident
+        :param fields: db Outage fields of an outage of the incident
+        :type fields: dict
+        """
+        shared = shared_incident_fields(fields)
+        incident.update(shared)
+        with span("db.write", table="incident"):
+            await Incident.filter(id=incident.incident_id).update(**shared)
+        self.incident_updates += 1
+
+        details = outage_details_text(incident)
+        tasks = []
+        for outage_key in incident.outage_keys:
+            active_outage_data = self.active_outages[outage_key]
+            active_outage_data.update(shared)
+            tasks.append(
+                self._send_incident_update(outage_key, active_outage_data, details)
+            )
+        await asyncio.gather(*tasks)
+
+    async def _send_incident_update(
+        self, outage_key: int, active_outage_data: ActiveOutageData, details: str
+    ):
+        """
+        :param outage_key: key of an outage of the incident
+        :type outage_key: int
+        :param active_outage_data: the outage, it can end
+            while the users are read
+        :type active_outage_data: ActiveOutageData
+        :param details: the incident outage_details_text
+        :type details: str
+        """
+        user_ids = await self.get_registered_user_ids_for_addresses(
+            *split_outage_key(outage_key)
+        )
+        await self.send_telegram_outage_msg(user_ids, active_outage_data, details)
+
     async def _process_new_outage(
         self,
         outage: IECOutageStatus,
-        outage_key: str,
+        outage_key: int,
         city_id: int,
         district_id: int,
         street_id: int,
@@ -311,7 +615,7 @@ class OutagesMonitor:
         :param outage: outage status iec
         :type outage: IECOutageStatus
         :param outage_key: gen outage key
-        :type outage_key: str
+        :type outage_key: int
         :param city_id: iec city id
         :type city_id: int
         :param district_id: iec city district id
@@ -321,36 +625,25 @@ class OutagesMonitor:
         :param home_num: home number
         :type home_num: int
         """
-        db_outage = await Outage.create(
-            city_id=city_id,
-            street_id=street_id,
-            home_num=home_num,
-            is_planned=outage.is_planned_outage,
-            start_time=outage.outage_time,
-            incident_id=outage.incident_id,
-            incident_source_code=outage.incident_source_code,
-            incident_source_desc=outage.incident_source_desc,
-            incident_status_code=outage.incident_status_code,
-            incident_trouble_code=outage.incident_trouble_code,
-            incident_trouble_desc=outage.incident_trouble_desc,
-            delay_cause_code=outage.delay_cause_code,
-            delay_cause_desc=outage.delay_cause_desc,
-            crew_name=outage.crew_name,
-            crew_assigned_time=outage.last_crew_assignment_time,
-            restore_est=outage.restore_est,
-        )
-        self.active_outages[outage_key] = ActiveOutageData(
-            db_outage=db_outage,
-            telegram_last_msg_ids={},
-            telegram_last_sent_text="",
-            full_address_name=await get_full_address_formated(
+        fields = outage_fields_from_status(outage)
+        with span("db.write", table="outage"):
+            db_outage = await Outage.create(
+                city_id=city_id,
+                street_id=street_id,
+                home_num=home_num,
+                **fields,
+            )
+        with span("db.read", table="street"):
+            full_address_name = await get_full_address_formated(
                 city_id, street_id, home_num
-            ),
-            city_id=city_id,
-            street_id=street_id,
-            home_num=home_num,
+            )
+        self.active_outages[outage_key] = ActiveOutageData(
+            outage_id=db_outage.id,
             district_id=district_id,
+            full_address_name=full_address_name,
+            fields=fields,
         )
+        await self._link_incident(outage_key, fields)
 
         user_ids = await self.get_registered_user_ids_for_addresses(
             city_id, street_id, home_num
@@ -360,9 +653,10 @@ class OutagesMonitor:
             user_ids,
             self.active_outages[outage_key],
         )
+        self.burst_neighbours(city_id, street_id, home_num)
 
     async def _process_outage_ended(
-        self, outage_key: str, city_id: int, street_id: int, home_num: int
+        self, outage_key: int, city_id: int, street_id: int, home_num: int
     ):
         """
         Processes an outage that ended.
@@ -371,7 +665,7 @@ class OutagesMonitor:
         removes from active_outages_data
 
         :param outage_key: a generated outage key
-        :type outage_key: str
+        :type outage_key: int
         :param city_id: iec city id
         :type city_id: int
         :param street_id: iec street id
@@ -380,58 +674,539 @@ class OutagesMonitor:
         :type home_num: int
         """
         active_outage_data: ActiveOutageData = self.active_outages[outage_key]
-        active_outage_data.db_outage.end_time = datetime.now().replace(microsecond=0)
-        await active_outage_data.db_outage.save()
+        active_outage_data.end_time = datetime.now().replace(microsecond=0)
+        with span("db.write", table="outage"):
+            await Outage.filter(id=active_outage_data.outage_id).update(
+                end_time=active_outage_data.end_time
+            )
 
         user_ids = await self.get_registered_user_ids_for_addresses(
             city_id, street_id, home_num
         )
 
-        await self.send_telegram_end_msg(user_ids, active_outage_data)
-        del self.active_outages[outage_key]
+        try:
+            await self.send_telegram_end_msg(user_ids, active_outage_data)
+        finally:
+            # a failed send does not keep the ended outage active
+            del self.active_outages[outage_key]
+            await self._unlink_incident(outage_key, active_outage_data, ended=True)
+        self.burst_neighbours(city_id, street_id, home_num)
 
     def __init__(self, telegram_bot: Bot) -> None:
-        self.active_outages: dict[str:ActiveOutageData] = dict()
+        self.active_outages: dict[int, ActiveOutageData] = dict()
+        # iec incident id: incident
+        self.active_incidents: dict[int, ActiveIncident] = dict()
+        self.incident_updates = 0
         self.telegram_bot: Bot = telegram_bot
+        # one message per user for all their addresses, if enabled
+        self.digests = (
+            DigestNotifier(telegram_bot, config.monitor.digest_window)
+            if config.monitor.digest_window
+            else None
+        )
+        self.work_set = address_work_set
+        self._last_reconcile = 0.0
+        # addresses left to check in this round, in order
+        self.poll_queue: deque[AddressKey] = deque()
+        # addresses somewhere in the pipeline, at most one check per address
+        # so its fetch, diff and process stay in order
+        self._in_flight: set[AddressKey] = set()
+        self._check_finished = asyncio.Event()
+        # (city_id, street_id): loop time of the last burst
+        self._last_bursts: dict[tuple[int, int], float] = {}
+        self.bursts = 0
+        self.burst_checks = 0
+        self._round_started = None
+        self.rounds = 0
+        self._round_size = 0
+        self.last_round_duration: float = None
+        self.telegram_in_flight = 0
+        self._round_checks = 0
+        self._round_failures = Counter()
+        # addresses left unchecked by the last run, checked first
+        self._resume: list[AddressKey] = []
+        self._monitoring_task: Optional[Task] = None
+        self._producer: Optional[Task] = None
+        self._fetch_workers: set[Task] = set()
+        self._process_workers: set[Task] = set()
         self.monitor = False
         self.logger = logging.getLogger(__name__)
-        pass
 
     async def start_monitoring(self):
         """
         Starts monitoring and checking all
         addresses in the background, and processes
-        them
+        them.
+
+        A pipeline of stages connected by bounded queues,
+        producer -> fetch from IEC -> diff -> persist and notify.
+        A full queue blocks the stage before it, and slow
+        db or telegram work does not hold fetch slots.
         """
         self.monitor = True
+        self._monitoring_task = asyncio.current_task()
         self.logger.info("Started monitoring")
+        await self.load_state()
+        await self.work_set.seed()
+        self._last_reconcile = asyncio.get_running_loop().time()
+
+        # just enough to keep the fetch workers busy, so addresses
+        # moved to the front of the poll queue are checked next
+        self._fetch_queue: asyncio.Queue = asyncio.Queue(
+            config.monitor.fetch_concurrency
+        )
+        queue_size = config.monitor.queue_size
+        self._diff_queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._process_queue: asyncio.Queue = asyncio.Queue(queue_size)
+
+        diff_worker = asyncio.ensure_future(self._diff_worker())
+        self.resize_workers()
+        self._producer = asyncio.ensure_future(self._produce())
+        try:
+            try:
+                await self._producer
+            except asyncio.CancelledError:
+                # stop_monitoring cancels the producer,
+                # else the monitor itself was cancelled
+                if self.monitor:
+                    raise
+            # finish the checks allready in the pipeline
+            await self._fetch_queue.join()
+            await self._diff_queue.join()
+            await self._process_queue.join()
+        finally:
+            workers = [diff_worker, *self._fetch_workers, *self._process_workers]
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def resize_workers(self):
+        """
+        Starts workers up to config.monitor.fetch_concurrency
+        and process_concurrency, the extra ones stop before
+        taking their next check. The fetch queue keeps the
+        size it got at start, it is only a handoff, waiting
+        workers take every put right away
+        """
+        if not self.monitor:
+            return
+        stages = (
+            (self._fetch_workers, config.monitor.fetch_concurrency, self._fetch_worker),
+            (
+                self._process_workers,
+                config.monitor.process_concurrency,
+                self._process_worker,
+            ),
+        )
+        for workers, concurrency, worker in stages:
+            while len(workers) < concurrency:
+                task = asyncio.ensure_future(worker())
+                workers.add(task)
+                task.add_done_callback(workers.discard)
+
+    @staticmethod
+    def _is_extra_worker(workers: set[Task], concurrency: int) -> bool:
+        """
+        :return: True if the calling worker should stop,
+            it is removed right away so only the extra ones stop
+        :rtype: bool
+        """
+        if len(workers) <= concurrency:
+            return False
+        workers.discard(asyncio.current_task())
+        return True
+
+    async def _start_round(self):
+        """
+        Waits for the round interval and
+        fills the poll queue with all the
+        addresses to check
+        """
+        loop = asyncio.get_running_loop()
+        if self._round_started is not None:
+            self.last_round_duration = loop.time() - self._round_started
+            self._log_round_failures()
+            wait = self._round_started + config.monitor.round_interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        self._round_started = loop.time()
+        self.rounds += 1
+        await self.reconcile_work_set_if_needed()
+        addresses = self.get_addresses_to_check()
+        self.logger.info(f"Checking {len(addresses)} addresses")
+        self._round_size = len(addresses)
+        self.poll_queue.extend(addresses)
+        if self._resume:
+            monitored = set(addresses)
+            self.move_to_front([add for add in self._resume if add in monitored])
+            self._resume = []
+
+    async def _produce(self):
+        """
+        Feeds the fetch stage from the poll queue,
+        a new round starts when it is empty
+        """
+        loop = asyncio.get_running_loop()
+        produced = True
         while self.monitor:
-            addresses = await self.get_addresses_to_check()
-            self.logger.info(f"Checking {len(addresses)} addresses")
-            tasks: list[Task] = []
-            for add in addresses:
-                city_id, district_id, street_id, home_num = add
-                task = asyncio.ensure_future(
-                    self.check_and_process(
-                        city_id,
-                        district_id,
-                        street_id,
-                        home_num,
-                    )
-                )
-                tasks.append(task)
-                await asyncio.sleep(1.2)
+            if not self.poll_queue:
+                if not produced:
+                    await self._wait_for_progress()
+                await self._start_round()
+                produced = False
+                continue
 
-                if not self.monitor:
-                    break
+            add = self.poll_queue.popleft()
+            if add in self._in_flight:
+                continue
+            self._in_flight.add(add)
+            produced = True
+            trace = tracer.start("poll", *add)
+            trace.round_wait = loop.time() - self._round_started
+            trace.queued()
+            try:
+                await self._fetch_queue.put((add, trace))
+            except asyncio.CancelledError:
+                # stopped while waiting for the fetch stage, not started
+                self._in_flight.discard(add)
+                self.poll_queue.appendleft(add)
+                raise
+
+    async def _wait_for_progress(self):
+        """
+        Waits for a check to leave the pipeline,
+        when a round had nothing new to check
+        """
+        if not self._in_flight:
+            await asyncio.sleep(1)
+            return
+        self._check_finished.clear()
+        await self._check_finished.wait()
+
+    async def _fetch_worker(self):
+        """
+        Gets the addresses statuses from IEC,
+        config.monitor.fetch_concurrency run together
+        """
+        while not self._is_extra_worker(
+            self._fetch_workers, config.monitor.fetch_concurrency
+        ):
+            add, trace = await self._fetch_queue.get()
+            trace.dequeued("fetch")
+            try:
+                with active_trace(trace):
+                    # pause while IEC is unavailable instead of failing every check
+                    await iec_api.circuit_breaker.wait_until_closed()
+                    outage = await outage_status_cache.refresh(*add)
+            except Exception as e:
+                self._check_done(add, e, trace)
+            else:
+                trace.queued()
+                await self._diff_queue.put((add, outage, trace))
+            finally:
+                self._fetch_queue.task_done()
+
+    async def _diff_worker(self):
+        """
+        Passes only the statuses that changed
+        an outage to the process stage
+        """
+        while True:
+            add, outage, trace = await self._diff_queue.get()
+            trace.dequeued("diff")
+            try:
+                with active_trace(trace), span("diff"):
+                    changed = self.needs_processing(add, outage)
+                if changed:
+                    trace.queued()
+                    await self._process_queue.put((add, outage, trace))
+                else:
+                    self._check_done(add, trace=trace)
+            finally:
+                self._diff_queue.task_done()
+
+    async def _process_worker(self):
+        """
+        Saves the changes to the db and sends the
+        telegram messages,
+        config.monitor.process_concurrency run together
+        """
+        while not self._is_extra_worker(
+            self._process_workers, config.monitor.process_concurrency
+        ):
+            add, outage, trace = await self._process_queue.get()
+            trace.dequeued("process")
+            trace.outcome = OUTCOME_PROCESSED
+            try:
+                with active_trace(trace):
+                    await self.process_outage_status(*add, outage)
+            except Exception as e:
+                self._check_done(add, e, trace)
+            else:
+                self._check_done(add, trace=trace)
+            finally:
+                self._process_queue.task_done()
+
+    def _check_done(
+        self, add: AddressKey, error: Exception = None, trace: Trace = None
+    ):
+        """
+        An address check left the pipeline
 
-            await asyncio.gather(*tasks, return_exceptions=True)
-            await asyncio.sleep(2)
+        :param add: (city_id, district_id, street_id, home_num)
+        :type add: AddressKey
+        :param error: the check failure, defaults to None
+        :type error: Exception, optional
+        :param trace: the check trace, defaults to None
+        :type trace: Trace, optional
+        """
+        self._in_flight.discard(add)
+        self._check_finished.set()
+        self._round_checks += 1
+        if error is None:
+            tracer.finish(trace)
+            return
+
+        kind = classify_failure(error)
+        if isinstance(error, IECUnavailableError):
+            failure = "skipped, circuit open"
+        elif kind:
+            failure = kind.value
+        else:
+            failure = type(error).__name__
+            self.logger.error("Check failed", exc_info=error)
+        self._round_failures[failure] += 1
+        tracer.finish(trace, failure)
+
+    @property
+    def checks_in_flight(self) -> int:
+        """
+        Addresses somewhere in the pipeline
+        """
+        return len(self._in_flight)
+
+    def queue_depths(self) -> dict[str, int]:
+        """
+        :return: checks waiting in every pipeline queue, by stage
+        :rtype: dict[str, int]
+        """
+        if not hasattr(self, "_fetch_queue"):
+            return {}
+        return {
+            "fetch": self._fetch_queue.qsize(),
+            "diff": self._diff_queue.qsize(),
+            "process": self._process_queue.qsize(),
+        }
+
+    def round_progress(self) -> tuple[int, int, Optional[float]]:
+        """
+        :return: (checked, total, eta seconds or None) of the current round
+        :rtype: tuple[int, int, Optional[float]]
+        """
+        total = self._round_size
+        # burst checks can add addresses allready checked in the round
+        remaining = min(len(self.poll_queue) + len(self._in_flight), total)
+        checked = total - remaining
+        if not checked or self._round_started is None:
+            return checked, total, None
+        elapsed = asyncio.get_running_loop().time() - self._round_started
+        return checked, total, remaining * elapsed / checked
+
+    def _log_round_failures(self):
+        """
+        Logs a summary of the checks that
+        failed since the last round
+        """
+        failures = sum(self._round_failures.values())
+        if failures:
+            summary = ", ".join(f"{k}: {v}" for k, v in self._round_failures.items())
+            self.logger.warning(
+                f"{failures} of {self._round_checks} checks failed ({summary})"
+            )
+        self._round_checks = 0
+        self._round_failures = Counter()
 
     def stop_monitoring(self):
         """
-        Stops addresses monitoring
-        note: this can take some time
+        Stops addresses monitoring, no new checks start.
+        note: the checks in the pipeline go on, see drain
         """
         self.logger.info("Stoped monitoring")
         self.monitor = False
+        if self._producer is not None:
+            self._producer.cancel()
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Waits for the checks in the pipeline to finish
+        after stop_monitoring, cancels them at the timeout
+
+        :param timeout: seconds
+        :type timeout: float
+        :return: checks that did not finish
+        :rtype: int
+        """
+        task = self._monitoring_task
+        if task is not None and not task.done():
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if not done:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        return len(self._in_flight)
+
+    def save_state(self, path: str = None) -> int:
+        """
+        Saves the addresses not checked yet in this round
+        (and the checks that did not finish), so the next
+        run checks them first, and the active outages and
+        incidents with what the db does not hold, the
+        telegram messages to edit and exact times
+
+        :param path: json file, defaults to config.monitor.state_file
+        :type path: str, optional
+        :return: addresses saved
+        :rtype: int
+        """
+        path = path or config.monitor.state_file
+        unchecked = list(self._in_flight) + [
+            add for add in self.poll_queue if add not in self._in_flight
+        ]
+        state = {
+            "saved_at": time.time(),
+            "round": self.rounds,
+            "unchecked": unchecked,
+            "active_outages": [
+                data.to_state() for data in self.active_outages.values()
+            ],
+            "active_incidents": [
+                {
+                    "incident_id": incident.incident_id,
+                    "fields": dump_fields(incident.fields()),
+                    "representative": self.active_outages[
+                        incident.representative
+                    ].outage_id
+                    if incident.representative in self.active_outages
+                    else None,
+                }
+                for incident in self.active_incidents.values()
+            ],
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+        return len(unchecked)
+
+    async def load_state(self, path: str = None):
+        """
+        Loads the state saved by the last run, once, and
+        restores the active outages from the open db outages,
+        so the ongoing ones are not detected again as new
+
+        :param path: json file, defaults to config.monitor.state_file
+        :type path: str, optional
+        """
+        path = path or config.monitor.state_file
+        state = {}
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            self.logger.exception("Could not load the monitor state")
+        self._resume = [tuple(add) for add in state.get("unchecked", ())]
+        if self._resume:
+            self.logger.info(f"Checking first {len(self._resume)} unchecked addresses")
+        await self._restore_active(
+            state.get("active_outages", ()), state.get("active_incidents", ())
+        )
+
+    async def _restore_active(self, saved_outages: list, saved_incidents: list):
+        """
+        Rebuilds active_outages and active_incidents from the
+        open db outages, with the saved state of the outages
+        that are in it. Without it (the bot crashed) the first
+        check of an outage sends an update, the db dates have
+        no time. An address with a few open outages keeps the
+        last, the rest are ended
+
+        :param saved_outages: ActiveOutageData.to_state of the last run
+        :type saved_outages: list
+        :param saved_incidents: incidents of the last run
+        :type saved_incidents: list
+        """
+        saved = {state["outage_id"]: state for state in saved_outages}
+        with span("db.read", table="outage"):
+            rows = (
+                await Outage.filter(end_time__isnull=True)
+                .order_by("id")
+                .values("id", "city_id", "street_id", "home_num", *OUTAGE_STATUS_FIELDS)
+            )
+        districts = dict(
+            await City.filter(id__in={row["city_id"] for row in rows}).values_list(
+                "id", "district_id"
+            )
+        )
+
+        replaced = []
+        outage_keys: dict[int, int] = {}
+        for row in rows:
+            address = (row["city_id"], row["street_id"], row["home_num"])
+            try:
+                outage_key = gen_outage_key(*address)
+            except ValueError as e:
+                self.logger.warning(f"Open outage {row['id']} not restored: {e}")
+                continue
+            if row["id"] in saved:
+                data = ActiveOutageData.from_state(saved[row["id"]])
+            else:
+                data = ActiveOutageData(
+                    outage_id=row["id"],
+                    district_id=districts.get(row["city_id"]),
+                    full_address_name=await get_full_address_formated(*address),
+                    fields=db_outage_fields(
+                        {field: row[field] for field in OUTAGE_STATUS_FIELDS}
+                    ),
+                )
+            if outage_key in self.active_outages:
+                replaced.append(self.active_outages[outage_key].outage_id)
+                del outage_keys[replaced[-1]]
+            self.active_outages[outage_key] = data
+            outage_keys[row["id"]] = outage_key
+
+        if replaced:
+            with span("db.write", table="outage"):
+                await Outage.filter(id__in=replaced).update(
+                    end_time=datetime.now().replace(microsecond=0)
+                )
+
+        saved_incidents = {state["incident_id"]: state for state in saved_incidents}
+        for outage_key, data in self.active_outages.items():
+            if data.incident_id is None:
+                continue
+            incident = self.active_incidents.get(data.incident_id)
+            if incident is None:
+                state = saved_incidents.get(data.incident_id)
+                fields = (
+                    load_fields(state["fields"])
+                    if state
+                    else {field: getattr(data, field) for field in OUTAGE_STATUS_FIELDS}
+                )
+                incident = ActiveIncident(data.incident_id, fields)
+                self.active_incidents[data.incident_id] = incident
+            incident.link(outage_key)
+        for incident_id, state in saved_incidents.items():
+            incident = self.active_incidents.get(incident_id)
+            representative = outage_keys.get(state["representative"])
+            if incident is not None and representative in incident.outage_keys:
+                incident.representative = representative
+
+        self.logger.info(
+            f"Restored {len(self.active_outages)} active outages "
+            f"({len(set(saved) & set(outage_keys))} from the saved state), "
+            f"{len(self.active_incidents)} incidents, ended {len(replaced)} duplicates"
+        )
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+import json5
+
+__all__ = ("RbzidCookieManager", "RbzidMetrics", "parse_rbzid_seed")
+
+# window.rbzns={...seed: "..." ...};
+_RBZNS_SEED_RE = re.compile(
+    r"window\.rbzns\s*=\s*\{[^}]*?\bseed\s*:\s*[\"']([^\"']+)[\"']", re.DOTALL
+)
+_RBZNS_OBJ_RE = re.compile(r"(?<=window\.rbzns={)(.*)(?=};)")
+
+
+def parse_rbzid_seed(raw: str) -> str:
+    """
+    Extracts the rbzid seed from the IEC
+    challenge page.
+    Tries a single precompiled regex first and
+    only falls back to json5 parsing of the
+    whole rbzns object when it fails.
+
+    :param raw: the challenge page html
+    :type raw: str
+    :raises ValueError: if no seed is found
+    :return: rbzid
+    :rtype: str
+    """
+    match = _RBZNS_SEED_RE.search(raw)
+    if match:
+        return match[1]
+
+    match = _RBZNS_OBJ_RE.search(raw)
+    if not match:
+        raise ValueError("rbzns object not found in page")
+    return json5.loads("{" + match[0] + "}")["seed"]
+
+
+@dataclass
+class RbzidMetrics:
+    """
+    Counters of the rbzid cookie manager
+    """
+
+    # cookie returned from cache
+    hits: int = 0
+    # fetches made to the iec server
+    fetches: int = 0
+    fetch_failures: int = 0
+    # callers that joined an in flight fetch
+    # instead of fetching themselves
+    shared_waits: int = 0
+    background_refreshes: int = 0
+    # refreshes because a response was a challenge page
+    challenge_refreshes: int = 0
+    last_fetch_duration: float = 0.0
+    last_fetch_time: float = None
+
+
+class RbzidCookieManager:
+    """
+    Keeps a valid rbzid cookie.
+    Only one fetch is in flight at a time,
+    all callers waiting for the cookie share it.
+    The cookie is refreshed in the background
+    before it expires so callers rarely wait.
+    """
+
+    def __init__(
+        self,
+        fetch_cookie: Callable[[], Awaitable[str]],
+        lifetime: float,
+        refresh_ahead: float,
+    ) -> None:
+        """
+        :param fetch_cookie: coroutine function that gets a new rbzid
+        :type fetch_cookie: Callable[[], Awaitable[str]]
+        :param lifetime: seconds a cookie is considered valid
+        :type lifetime: float
+        :param refresh_ahead: seconds before expiry to refresh in the background
+        :type refresh_ahead: float
+        """
+        self._fetch_cookie = fetch_cookie
+        self.lifetime = lifetime
+        self.refresh_ahead = refresh_ahead
+        self._rbzid: str = None
+        self._expires_at: float = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+        self._refresh_handle: Optional[asyncio.TimerHandle] = None
+        self.metrics = RbzidMetrics()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def current(self) -> Optional[str]:
+        """
+        The cached cookie if still valid, never fetches
+        """
+        if self._rbzid and time.monotonic() < self._expires_at:
+            return self._rbzid
+        return None
+
+    async def get(self) -> str:
+        """
+        Gets the cached cookie or
+        waits for a (shared) fetch
+
+        :return: rbzid
+        :rtype: str
+        """
+        rbzid = self.current
+        if rbzid:
+            self.metrics.hits += 1
+            return rbzid
+        return await self.refresh()
+
+    async def refresh(self) -> str:
+        """
+        Fetches a new cookie, joins the
+        in flight fetch if there is one
+
+        :return: rbzid
+        :rtype: str
+        """
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+        else:
+            self.metrics.shared_waits += 1
+        # shield, a cancelled waiter must not cancel the shared fetch
+        return await asyncio.shield(self._inflight)
+
+    async def refresh_after_challenge(self, used_rbzid: Optional[str]) -> str:
+        """
+        Called when a response was a challenge page
+        instead of json.
+        If the cookie was already replaced since the
+        failed request was sent returns the new one,
+        so a burst of challenged requests refreshes once.
+
+        :param used_rbzid: the cookie the failed request was sent with
+        :type used_rbzid: Optional[str]
+        :return: rbzid
+        :rtype: str
+        """
+        if self._inflight is not None:
+            self.metrics.shared_waits += 1
+            return await asyncio.shield(self._inflight)
+
+        rbzid = self.current
+        if rbzid and rbzid != used_rbzid:
+            self.metrics.hits += 1
+            return rbzid
+
+        self.metrics.challenge_refreshes += 1
+        self._rbzid = None
+        return await self.refresh()
+
+    async def _fetch(self) -> str:
+        start = time.monotonic()
+        self.metrics.fetches += 1
+        try:
+            rbzid = await self._fetch_cookie()
+        except BaseException:
+            self.metrics.fetch_failures += 1
+            raise
+        finally:
+            self._inflight = None
+            self.metrics.last_fetch_duration = time.monotonic() - start
+
+        self._rbzid = rbzid
+        self._expires_at = time.monotonic() + self.lifetime
+        self.metrics.last_fetch_time = time.time()
+        self._schedule_background_refresh()
+        return rbzid
+
+    def _schedule_background_refresh(self):
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+        delay = max(self.lifetime - self.refresh_ahead, 0)
+        loop = asyncio.get_running_loop()
+        self._refresh_handle = loop.call_later(
+            delay, lambda: asyncio.ensure_future(self._background_refresh())
+        )
+
+    async def _background_refresh(self):
+        self._refresh_handle = None
+        self.metrics.background_refreshes += 1
+        try:
+            await self.refresh()
+        except Exception:
+            # the old cookie stays until it expires,
+            # the next get() will try again
+            self.logger.warning("Background rbzid refresh failed", exc_info=True)
+
+    def close(self):
+        """
+        Stops the background refresh
+        """
+        if self._refresh_handle:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
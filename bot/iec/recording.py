@@ -0,0 +1,358 @@
+"""
+Records the IEC requests and their responses (or errors)
+to a gzip json lines log, a file per run, and replays them
+instead of the network, for reproducing bugs and benchmarks
+on real responses.
+
+usage: python -m bot.iec.recording FILE ...
+       prints a summary of the recordings
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Iterator, Optional
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+__all__ = (
+    "RecordingSession",
+    "ReplaySession",
+    "ReplayMissError",
+    "read_recording",
+    "recorded_bodies",
+    "recording_files",
+)
+
+# records written between flushes, a crash loses at most these
+FLUSH_EVERY = 50
+# response headers kept, the rest are noise
+KEPT_HEADERS = ("Retry-After",)
+# params that change every request, not matched on replay
+VOLATILE_PARAMS = ("guid",)
+# recorded error: raised on replay, others are ClientConnectionError
+REPLAYED_ERRORS = {
+    "TimeoutError": asyncio.TimeoutError,
+    "ServerTimeoutError": aiohttp.ServerTimeoutError,
+    "ServerDisconnectedError": aiohttp.ServerDisconnectedError,
+    "ClientPayloadError": aiohttp.ClientPayloadError,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayMissError(LookupError):
+    """
+    Nothing was recorded for the request
+    """
+
+
+def request_key(method: str, path: str, params: Optional[dict]) -> tuple:
+    """
+    :return: what a replayed request is matched by
+    :rtype: tuple
+    """
+    params = params or {}
+    return (
+        method.upper(),
+        path,
+        tuple(
+            sorted((k, str(v)) for k, v in params.items() if k not in VOLATILE_PARAMS)
+        ),
+    )
+
+
+def _encode_body(body: bytes) -> dict:
+    try:
+        return {"body": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body_b64": base64.b64encode(body).decode()}
+
+
+def _run_path(path: str, started: float) -> str:
+    """
+    :param path: the configured log, like iec.jsonl.gz
+    :type path: str
+    :param started: epoch time of the run start
+    :type started: float
+    :return: the log of the run, like iec-20220101-120000.jsonl.gz
+    :rtype: str
+    """
+    directory, name = os.path.split(path)
+    stem, dot, extension = name.partition(".")
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+    return os.path.join(directory, f"{stem}-{stamp}{dot}{extension}")
+
+
+def recording_files(path: str) -> list[str]:
+    """
+    :param path: a run log, or the configured log
+        to read all its runs
+    :type path: str
+    :raises FileNotFoundError: no log
+    :return: the logs, oldest first
+    :rtype: list[str]
+    """
+    if os.path.exists(path):
+        return [path]
+    directory, name = os.path.split(path)
+    stem, dot, extension = name.partition(".")
+    pattern = os.path.join(glob.escape(directory), f"{glob.escape(stem)}-*{dot}")
+    paths = sorted(glob.glob(pattern + glob.escape(extension)))
+    if not paths:
+        raise FileNotFoundError(f"no IEC recording {path}")
+    return paths
+
+
+def _decode_body(record: dict) -> bytes:
+    if "body_b64" in record:
+        return base64.b64decode(record["body_b64"])
+    return record.get("body", "").encode("utf-8")
+
+
+class RecordingSession:
+    """
+    Wraps the aiohttp session of the IEC api and
+    writes every request with its response to the log.
+    Every run gets its own file, a run killed in the
+    middle of a gzip write does not break the next one
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, path: str) -> None:
+        """
+        :param session: the real session
+        :type session: aiohttp.ClientSession
+        :param path: the log, .jsonl.gz, the run start
+            time is added to the name
+        :type path: str
+        """
+        self.session = session
+        self.path = _run_path(path, time.time())
+        self._file = None
+        self._unflushed = 0
+        self.recorded = 0
+
+    async def request(self, method: str, path: str, **kwargs) -> aiohttp.ClientResponse:
+        record = {
+            "ts": round(time.time(), 3),
+            "method": method,
+            "path": path,
+            "params": kwargs.get("params"),
+        }
+        start = time.perf_counter()
+        try:
+            resp = await self.session.request(method, path, **kwargs)
+            # cached by aiohttp, the api reads it again
+            body = await resp.read()
+        except Exception as e:
+            record["latency"] = round(time.perf_counter() - start, 4)
+            record["error"] = type(e).__name__
+            record["message"] = str(e)
+            self._write(record)
+            raise
+        record["latency"] = round(time.perf_counter() - start, 4)
+        record["status"] = resp.status
+        record["reason"] = resp.reason
+        record["content_type"] = resp.content_type
+        record["headers"] = {
+            k: resp.headers[k] for k in KEPT_HEADERS if k in resp.headers
+        }
+        record.update(_encode_body(body))
+        self._write(record)
+        return resp
+
+    def _write(self, record: dict):
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = gzip.open(self.path, "wt", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.recorded += 1
+            self._unflushed += 1
+            if self._unflushed >= FLUSH_EVERY:
+                self._file.flush()
+                self._unflushed = 0
+        except Exception:
+            logger.exception("Could not record an IEC request")
+
+    async def close(self):
+        await self.session.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ReplayedResponse:
+    """
+    The parts of aiohttp.ClientResponse the api uses
+    """
+
+    def __init__(self, method: str, path: str, record: dict) -> None:
+        self.status: int = record["status"]
+        self.reason: str = record.get("reason") or ""
+        self.content_type: str = record.get("content_type", "application/json")
+        self.headers = CIMultiDictProxy(CIMultiDict(record.get("headers") or {}))
+        self.request_info = aiohttp.RequestInfo(
+            URL(path), method, CIMultiDictProxy(CIMultiDict())
+        )
+        self._body = _decode_body(record)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(
+                self.request_info,
+                (),
+                status=self.status,
+                message=self.reason,
+                headers=self.headers,
+            )
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding: str = "utf-8") -> str:
+        return self._body.decode(encoding, errors="replace")
+
+
+class ReplaySession:
+    """
+    Serves the recorded responses instead of the network,
+    matched by method, path and params. A request recorded
+    many times gets its responses in the recorded order,
+    and again from the first after the last
+    """
+
+    def __init__(self, path: str, speed: float = 1.0) -> None:
+        """
+        :param path: a run log, or the configured log for all its runs
+        :type path: str
+        :param speed: the recorded latencies are divided by it,
+            0 to answer right away, defaults to 1.0
+        :type speed: float, optional
+        """
+        self.speed = speed
+        self._records: dict[tuple, list[dict]] = defaultdict(list)
+        for record in read_recording(path):
+            key = request_key(record["method"], record["path"], record["params"])
+            self._records[key].append(record)
+        self._served = Counter()
+        self.served = 0
+        self.misses = 0
+
+    async def request(
+        self, method: str, path: str, params: dict = None, **kwargs
+    ) -> ReplayedResponse:
+        key = request_key(method, path, params)
+        records = self._records.get(key)
+        if not records:
+            self.misses += 1
+            raise ReplayMissError(f"not recorded: {method} {path} {params}")
+        record = records[self._served[key] % len(records)]
+        self._served[key] += 1
+        if self.speed:
+            await asyncio.sleep(record["latency"] / self.speed)
+        self.served += 1
+        if "error" in record:
+            error = REPLAYED_ERRORS.get(record["error"], aiohttp.ClientConnectionError)
+            raise error(record.get("message") or record["error"])
+        return ReplayedResponse(method, path, record)
+
+    async def close(self):
+        pass
+
+
+def read_recording(path: str) -> Iterator[dict]:
+    """
+    :param path: a run log, or the configured log for all its
+        runs. A log can end cut (the bot was killed)
+    :type path: str
+    :yield: the records, of a cut log until the cut
+    :rtype: Iterator[dict]
+    """
+    for run_path in recording_files(path):
+        with gzip.open(run_path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except (EOFError, ValueError, OSError, zlib.error):
+                # OSError is gzip.BadGzipFile
+                logger.warning(f"{run_path} ends cut, read until there")
+
+
+def recorded_bodies(path: str) -> list[bytes]:
+    """
+    :param path: a run log, or the configured log for all its runs
+    :type path: str
+    :return: bodies of the CheckInterruptByAddress json responses
+    :rtype: list[bytes]
+    """
+    return [
+        _decode_body(record)
+        for record in read_recording(path)
+        if record.get("status") == 200
+        and "json" in record.get("content_type", "")
+        and (record.get("params") or {}).get("a") == "CheckInterruptByAddress"
+    ]
+
+
+def summarize(paths: list[str]) -> str:
+    """
+    :param paths: logs
+    :type paths: list[str]
+    :return: counts by path and result, latencies
+    :rtype: str
+    """
+    results = Counter()
+    latencies = []
+    first = last = None
+    for path in paths:
+        for record in read_recording(path):
+            first = min(first or record["ts"], record["ts"])
+            last = max(last or record["ts"], record["ts"])
+            latencies.append(record["latency"])
+            action = (record.get("params") or {}).get("a") or record["path"]
+            body = record.get("body", "")
+            if "error" in record:
+                result = record["error"]
+            elif record["status"] != 200:
+                result = f"http {record['status']}"
+            elif "html" in record.get("content_type", "") or body.lstrip()[:1] == "<":
+                result = "challenge page"
+            elif '"IsActiveIncident":true' in body.replace(" ", ""):
+                result = "active incident"
+            elif '"IsPlannedOutage":true' in body.replace(" ", ""):
+                result = "planned outage"
+            else:
+                result = "ok"
+            results[(action, result)] += 1
+
+    if not latencies:
+        return "no records"
+    latencies.sort()
+    lines = [
+        f"{len(latencies)} requests from {time.ctime(first)} to {time.ctime(last)}",
+        f"latency p50 {latencies[len(latencies) // 2] * 1000:.0f}ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f}ms, "
+        f"max {latencies[-1] * 1000:.0f}ms",
+        "",
+    ]
+    lines += [
+        f"{count:>8} {action} {result}"
+        for (action, result), count in results.most_common()
+    ]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bot.iec.recording")
+    parser.add_argument("files", nargs="+", help="IEC_RECORD_FILE logs")
+    print(summarize(parser.parse_args().files))
@@ -0,0 +1,378 @@
+"""
+Compact binary snapshot of cities_streets.json.
+
+The json is ~2.5MB and parsing it (plus dacite per city) is
+the slowest part of loading the reference data. The snapshot is
+memory mapped and read with struct, records are only decoded
+when accessed.
+
+layout (little endian):
+    header   magic, format version, cities/streets/strings count, strings size,
+             size and mtime of the json it was built from
+    cities   fixed size records sorted by id, streets are contiguous per city
+    streets  fixed size records
+    offsets  strings count + 1 offsets into the strings blob
+    strings  utf-8 NUL separated strings, records point to a string index
+
+usage: python -m bot.iec.reference_snapshot [json_path] [snapshot_path]
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from typing import Iterator, NamedTuple, Optional
+from bot.iec.active_outages import MAX_HOME_NUM, gen_outage_key, split_outage_key
+
+__all__ = (
+    "ReferenceSnapshot",
+    "SnapshotCity",
+    "SnapshotStreet",
+    "build_snapshot",
+    "open_snapshot",
+    "JSON_PATH",
+    "SNAPSHOT_PATH",
+)
+
+JSON_PATH = "bot/iec/cities_streets.json"
+SNAPSHOT_PATH = "bot/iec/cities_streets.bin"
+
+MAGIC = b"IECR"
+# bump when the layout changes, old snapshots are then ignored
+FORMAT_VERSION = 2
+
+# magic, version, cities count, streets count, strings count, strings size,
+# json size, json mtime ns
+_HEADER = struct.Struct("<4sHxxIIIIQq")
+# id, mahoz_id, distinct_id, name, mahoz_name, distinct_name, first street, streets count
+_CITY = struct.Struct("<iiiIIIII")
+# id, name
+_STREET = struct.Struct("<iI")
+_OFFSET = struct.Struct("<I")
+
+
+class SnapshotStreet(NamedTuple):
+    id: int
+    name: str
+
+
+class SnapshotCity(NamedTuple):
+    id: int
+    name: str
+    mahoz_id: int
+    mahoz_name: str
+    distinct_name: str
+    distinct_id: int
+    streets_start: int
+    streets_count: int
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.strings: list[str] = []
+        self._indexes: dict[str, int] = {}
+
+    def add(self, s: Optional[str]) -> int:
+        s = s or ""
+        if s not in self._indexes:
+            self._indexes[s] = len(self.strings)
+            self.strings.append(s)
+        return self._indexes[s]
+
+    def pack(self) -> tuple[bytes, bytes]:
+        blob = bytearray()
+        offsets = bytearray()
+        for s in self.strings:
+            offsets += _OFFSET.pack(len(blob))
+            blob += s.encode() + b"\0"
+        offsets += _OFFSET.pack(len(blob))
+        return bytes(offsets), bytes(blob)
+
+
+def _source_stamp(json_path: str) -> Optional[tuple[int, int]]:
+    """
+    :param json_path: cities_streets.json path
+    :type json_path: str
+    :return: (size, mtime ns) of the json, None if missing
+    :rtype: Optional[tuple[int, int]]
+    """
+    try:
+        stat = os.stat(json_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_snapshot(json_path: str = JSON_PATH, snapshot_path: str = SNAPSHOT_PATH):
+    """
+    Builds the binary snapshot from
+    the cities and streets json
+
+    :param json_path: cities_streets.json path
+    :type json_path: str
+    :param snapshot_path: output path
+    :type snapshot_path: str
+    :raises ValueError: a street does not fit an outage key
+    """
+    source_size, source_mtime = _source_stamp(json_path)
+    with open(json_path, "rb") as f:
+        cities = sorted(json.load(f), key=lambda c: c["id"])
+    check_outage_keys(cities)
+
+    strings = _StringTable()
+    city_records = bytearray()
+    street_records = bytearray()
+    streets_count = 0
+    for city in cities:
+        streets = city["loaded_streets"]
+        city_records += _CITY.pack(
+            city["id"],
+            city["mahoz_id"],
+            city["distinct_id"],
+            strings.add(city["name"]),
+            strings.add(city["mahoz_name"]),
+            strings.add(city["distinct_name"]),
+            streets_count,
+            len(streets),
+        )
+        for street in streets:
+            street_records += _STREET.pack(street["id"], strings.add(street["name"]))
+        streets_count += len(streets)
+
+    offsets, blob = strings.pack()
+    # replaced at once, a running bot can have the old one mapped
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                len(cities),
+                streets_count,
+                len(strings.strings),
+                len(blob),
+                source_size,
+                source_mtime,
+            )
+        )
+        f.write(city_records)
+        f.write(street_records)
+        f.write(offsets)
+        f.write(blob)
+    os.replace(tmp_path, snapshot_path)
+
+
+def check_outage_keys(cities: list[dict]):
+    """
+    Checks every street of the reference data comes
+    back the same from a packed outage key, the
+    monitor polls the address it unpacks
+
+    :param cities: the cities of cities_streets.json
+    :type cities: list[dict]
+    :raises ValueError: a street that does not
+    """
+    for city in cities:
+        for street in city["loaded_streets"]:
+            for home_num in (1, MAX_HOME_NUM):
+                address = (city["id"], street["id"], home_num)
+                if split_outage_key(gen_outage_key(*address)) != address:
+                    raise ValueError(f"outage key of {address} does not round trip")
+
+
+class ReferenceSnapshot:
+    """
+    Read only, memory mapped view
+    of a cities and streets snapshot
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH, json_path: str = JSON_PATH) -> None:
+        """
+        :param path: snapshot path
+        :type path: str
+        :param json_path: the json it has to be built from,
+            not checked if missing
+        :type json_path: str
+        :raises ValueError: if the file is not a snapshot of this format
+            version, or was built from another json
+        """
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mm) < _HEADER.size:
+            self._mm.close()
+            raise ValueError(f"{path} is not a reference snapshot")
+        (
+            magic,
+            version,
+            cities,
+            streets,
+            strings,
+            blob_size,
+            source_size,
+            source_mtime,
+        ) = _HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a v{FORMAT_VERSION} reference snapshot")
+        stamp = _source_stamp(json_path)
+        if stamp is not None and stamp != (source_size, source_mtime):
+            self._mm.close()
+            raise ValueError(f"{path} was built from another {json_path}")
+
+        self.cities_count = cities
+        self.streets_count = streets
+        self._cities_offset = _HEADER.size
+        self._streets_offset = self._cities_offset + cities * _CITY.size
+        self._offsets_offset = self._streets_offset + streets * _STREET.size
+        self._blob_offset = self._offsets_offset + (strings + 1) * _OFFSET.size
+        if self._blob_offset + blob_size != len(self._mm):
+            self._mm.close()
+            raise ValueError(f"{path} is truncated")
+        # decoded on first bulk read
+        self._strings: list[str] = None
+
+    def _str(self, index: int) -> str:
+        if self._strings is not None:
+            return self._strings[index]
+        start, end = struct.unpack_from(
+            "<II", self._mm, self._offsets_offset + index * _OFFSET.size
+        )
+        # - 1, without the NUL separator
+        return self._mm[
+            self._blob_offset + start : self._blob_offset + end - 1
+        ].decode()
+
+    def _load_strings(self) -> list[str]:
+        if self._strings is None:
+            blob = self._mm[self._blob_offset :]
+            self._strings = blob.decode().split("\0")[:-1]
+        return self._strings
+
+    def city(self, index: int) -> SnapshotCity:
+        """
+        :param index: city index, 0..cities_count
+        :type index: int
+        :return: the city
+        :rtype: SnapshotCity
+        """
+        return self._make_city(
+            _CITY.unpack_from(self._mm, self._cities_offset + index * _CITY.size)
+        )
+
+    def _make_city(self, record: tuple) -> SnapshotCity:
+        (
+            id,
+            mahoz_id,
+            distinct_id,
+            name,
+            mahoz_name,
+            distinct_name,
+            streets_start,
+            streets_count,
+        ) = record
+        return SnapshotCity(
+            id=id,
+            name=self._str(name),
+            mahoz_id=mahoz_id,
+            mahoz_name=self._str(mahoz_name),
+            distinct_name=self._str(distinct_name),
+            distinct_id=distinct_id,
+            streets_start=streets_start,
+            streets_count=streets_count,
+        )
+
+    def find_city(self, city_id: int) -> Optional[SnapshotCity]:
+        """
+        Binary search of a city by id
+
+        :param city_id: iec city id
+        :type city_id: int
+        :return: the city, None if not found
+        :rtype: Optional[SnapshotCity]
+        """
+        lo, hi = 0, self.cities_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (id,) = struct.unpack_from(
+                "<i", self._mm, self._cities_offset + mid * _CITY.size
+            )
+            if id == city_id:
+                return self.city(mid)
+            if id < city_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def cities(self) -> Iterator[SnapshotCity]:
+        """
+        All the cities, sorted by id
+        """
+        self._load_strings()
+        view = memoryview(self._mm)[self._cities_offset : self._streets_offset]
+        try:
+            for record in _CITY.iter_unpack(view):
+                yield self._make_city(record)
+        finally:
+            view.release()
+
+    def streets_of(self, city: SnapshotCity) -> list[SnapshotStreet]:
+        """
+        :param city: a city of this snapshot
+        :type city: SnapshotCity
+        :return: the city streets
+        :rtype: list[SnapshotStreet]
+        """
+        strings = self._load_strings()
+        start = self._streets_offset + city.streets_start * _STREET.size
+        end = start + city.streets_count * _STREET.size
+        return [
+            SnapshotStreet(id, strings[name])
+            for id, name in _STREET.iter_unpack(self._mm[start:end])
+        ]
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self) -> "ReferenceSnapshot":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_snapshot(
+    path: str = SNAPSHOT_PATH, json_path: str = JSON_PATH, rebuild: bool = False
+) -> Optional[ReferenceSnapshot]:
+    """
+    Opens the snapshot if it exists, is of the current
+    format version and was built from the json
+
+    :param path: snapshot path
+    :type path: str
+    :param json_path: cities_streets.json path
+    :type json_path: str
+    :param rebuild: build it again if missing or outdated,
+        defaults to False
+    :type rebuild: bool, optional
+    :return: the snapshot, None if missing or outdated
+        (and could not be rebuilt)
+    :rtype: Optional[ReferenceSnapshot]
+    """
+    try:
+        return ReferenceSnapshot(path, json_path)
+    except (OSError, ValueError):
+        if not rebuild or _source_stamp(json_path) is None:
+            return None
+    try:
+        build_snapshot(json_path, path)
+        return ReferenceSnapshot(path, json_path)
+    except (OSError, ValueError):
+        logging.getLogger(__name__).exception("Could not rebuild the snapshot")
+        return None
+
+
+if __name__ == "__main__":
+    build_snapshot(*sys.argv[1:3])
@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+from collections import deque
+from typing import Optional
+
+__all__ = ("RequestScheduler",)
+
+# interactive requests that can go ahead of background ones in a row
+MAX_CREDIT = 2.0
+
+
+def _now() -> float:
+    # loop time, like the monitor, so a simulation clock paces it too
+    return asyncio.get_running_loop().time()
+
+
+class RequestScheduler:
+    """
+    Paces the IEC requests to one every interval seconds.
+    Interactive requests (a user is waiting for the answer)
+    go before background (monitor) ones, but while background
+    requests are waiting they take at most interactive_share
+    of the requests, so polling is not starved.
+    Without credit left the oldest request goes first,
+    never worse than first come first served.
+    """
+
+    def __init__(self, interval: float, interactive_share: float) -> None:
+        """
+        :param interval: seconds between requests
+        :type interval: float
+        :param interactive_share: 0-1, share of the requests
+            interactive ones can take ahead of background ones
+        :type interactive_share: float
+        """
+        self.interval = interval
+        self.interactive_share = min(max(interactive_share, 0.0), 0.9)
+        self._next_slot = 0.0
+        self._credit = MAX_CREDIT
+        # interactive: deque of (arrival, future)
+        self._queues: dict[bool, deque[tuple[int, asyncio.Future]]] = {
+            True: deque(),
+            False: deque(),
+        }
+        self._arrivals = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.interactive_granted = 0
+        self.background_granted = 0
+
+    def configure(self, interval: float, interactive_share: float):
+        """
+        Changes the pace of the running scheduler,
+        the next slot moves by the interval change
+
+        :param interval: seconds between requests
+        :type interval: float
+        :param interactive_share: 0-1, share of the requests
+            interactive ones can take ahead of background ones
+        :type interactive_share: float
+        """
+        self._next_slot += interval - self.interval
+        self.interval = interval
+        self.interactive_share = min(max(interactive_share, 0.0), 0.9)
+        if self._dispatcher is not None and not self._dispatcher.done():
+            # it sleeps until the old next slot, its only await
+            self._dispatcher.cancel()
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    @property
+    def waiting(self) -> int:
+        """
+        Requests waiting for a slot
+        """
+        return sum(
+            not fut.done() for queue in self._queues.values() for _, fut in queue
+        )
+
+    @property
+    def backlog(self) -> float:
+        """
+        Seconds until the requests waiting now are sent
+        """
+        next_slot = max(self._next_slot - _now(), 0.0)
+        return next_slot + self.waiting * self.interval
+
+    async def acquire(self, interactive: bool = False):
+        """
+        Waits for the request slot
+
+        :param interactive: a user is waiting, defaults to False
+        :type interactive: bool, optional
+        """
+        if (
+            not self._queues[True]
+            and not self._queues[False]
+            and _now() >= self._next_slot
+        ):
+            self._grant(interactive, background_waiting=False)
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[interactive].append((next(self._arrivals), fut))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await fut
+
+    async def _dispatch(self):
+        while self._trim():
+            wait = self._next_slot - _now()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            background_waiting = bool(self._queues[False])
+            interactive = self._pick()
+            _, fut = self._queues[interactive].popleft()
+            self._grant(interactive, background_waiting)
+            fut.set_result(None)
+
+    def _trim(self) -> bool:
+        """
+        Drops the cancelled waiters at the head of the queues
+
+        :return: True if requests are waiting
+        :rtype: bool
+        """
+        for queue in self._queues.values():
+            while queue and queue[0][1].done():
+                queue.popleft()
+        return bool(self._queues[True] or self._queues[False])
+
+    def _pick(self) -> bool:
+        """
+        :return: True to let an interactive request go next
+        :rtype: bool
+        """
+        interactive, background = self._queues[True], self._queues[False]
+        if not background:
+            return True
+        if not interactive:
+            return False
+        if self._credit >= 1:
+            return True
+        return interactive[0][0] < background[0][0]
+
+    def _grant(self, interactive: bool, background_waiting: bool):
+        self._next_slot = _now() + self.interval
+        if interactive:
+            self.interactive_granted += 1
+            if background_waiting:
+                self._credit = max(self._credit - 1, 0.0)
+        else:
+            self.background_granted += 1
+            share = self.interactive_share
+            self._credit = min(self._credit + share / (1 - share), MAX_CREDIT)
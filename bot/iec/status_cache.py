@@ -0,0 +1,167 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from bot.config import config
+from bot.iec.api import IECApi, IECOutageStatus, iec_api
+from bot.tracing import span
+
+__all__ = ("outage_status_cache", "OutageStatusCache", "StatusKey")
+
+# (city_id, district_id, street_id, home_num)
+StatusKey = tuple[int, int, int, int]
+
+
+@dataclass
+class CachedStatus:
+    status: IECOutageStatus
+    fetched_at: float
+    # fetched by the monitor polling, the address is subscribed
+    from_monitor: bool
+
+
+class OutageStatusCache:
+    """
+    Short lived cache in front of
+    IECApi.get_outage_for_address.
+    Concurrent requests for the same address
+    share one IEC request, and the monitor results
+    are kept so checking a subscribed address
+    does not cost a rate limited request.
+    """
+
+    # prune expired entries every N stores
+    PRUNE_EVERY = 256
+
+    def __init__(self, api: IECApi, ttl: float, monitored_ttl: float) -> None:
+        """
+        :param api: the iec api
+        :type api: IECApi
+        :param ttl: seconds a status is fresh
+        :type ttl: float
+        :param monitored_ttl: seconds a status fetched by the monitor is fresh
+        :type monitored_ttl: float
+        """
+        self.api = api
+        self.ttl = ttl
+        self.monitored_ttl = monitored_ttl
+        self._entries: dict[StatusKey, CachedStatus] = {}
+        self._inflight: dict[StatusKey, asyncio.Future] = {}
+        self._stores = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _max_age(self, entry: CachedStatus) -> float:
+        return self.monitored_ttl if entry.from_monitor else self.ttl
+
+    def get_cached(self, key: StatusKey) -> IECOutageStatus:
+        """
+        Gets a fresh cached status, never requests IEC
+
+        :param key: (city_id, district_id, street_id, home_num)
+        :type key: StatusKey
+        :return: the status, None if not cached or expired
+        :rtype: IECOutageStatus
+        """
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry.fetched_at <= self._max_age(entry):
+            return entry.status
+        return None
+
+    async def get_outage_for_address(
+        self, city_id: int, district_id: int, street_id: int, home_num: int
+    ) -> IECOutageStatus:
+        """
+        Gets outage status from the cache,
+        or from IEC if not fresh
+
+        :param city_id: the iec city id
+        :type city_id: int
+        :param district_id: the iec city district id
+        :type district_id: int
+        :param street_id: the iec street id
+        :type street_id: int
+        :param home_num: the house number
+        :type home_num: int
+        :return: the outage status
+        :rtype: IECOutageStatus
+        """
+        key = (city_id, district_id, street_id, home_num)
+        status = self.get_cached(key)
+        if status:
+            self.hits += 1
+            return status
+        self.misses += 1
+        return await self._fetch(key, from_monitor=False)
+
+    async def refresh(
+        self, city_id: int, district_id: int, street_id: int, home_num: int
+    ) -> IECOutageStatus:
+        """
+        Gets outage status from IEC and stores it,
+        used by the monitor polling.
+        Joins a request already in flight for the address.
+
+        :param city_id: the iec city id
+        :type city_id: int
+        :param district_id: the iec city district id
+        :type district_id: int
+        :param street_id: the iec street id
+        :type street_id: int
+        :param home_num: the house number
+        :type home_num: int
+        :return: the outage status
+        :rtype: IECOutageStatus
+        """
+        key = (city_id, district_id, street_id, home_num)
+        return await self._fetch(key, from_monitor=True)
+
+    async def _fetch(self, key: StatusKey, from_monitor: bool) -> IECOutageStatus:
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._request(key, from_monitor))
+            self._inflight[key] = fut
+            # shield, a cancelled waiter must not cancel the shared request
+            return await asyncio.shield(fut)
+        self.coalesced += 1
+        # the request is traced in the check that started it
+        with span("iec_shared"):
+            return await asyncio.shield(fut)
+
+    async def _request(self, key: StatusKey, from_monitor: bool) -> IECOutageStatus:
+        try:
+            status = await self.api.get_outage_for_address(
+                *key, interactive=not from_monitor
+            )
+        finally:
+            del self._inflight[key]
+        self._store(key, status, from_monitor)
+        return status
+
+    def _store(self, key: StatusKey, status: IECOutageStatus, from_monitor: bool):
+        self._entries[key] = CachedStatus(status, time.monotonic(), from_monitor)
+
+        self._stores += 1
+        if self._stores % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """
+        Removes expired entries
+        """
+        now = time.monotonic()
+        self._entries = {
+            k: e
+            for k, e in self._entries.items()
+            if now - e.fetched_at <= self._max_age(e)
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+outage_status_cache = OutageStatusCache(
+    iec_api,
+    ttl=config.iec.status_cache_ttl,
+    monitored_ttl=config.iec.status_cache_monitored_ttl,
+)
@@ -0,0 +1,47 @@
+import time
+
+__all__ = ("WindowCounter",)
+
+
+class WindowCounter:
+    """
+    Counts events in the last window seconds,
+    in one second buckets so adding and counting
+    are cheap and memory stays the same
+    """
+
+    def __init__(self, window: int = 60) -> None:
+        """
+        :param window: seconds, defaults to 60
+        :type window: int, optional
+        """
+        self.window = window
+        self._buckets = [0] * window
+        # the second each bucket counts
+        self._seconds = [0] * window
+        self.total = 0
+
+    def add(self, n: int = 1):
+        """
+        :param n: events, defaults to 1
+        :type n: int, optional
+        """
+        now = int(time.monotonic())
+        i = now % self.window
+        if self._seconds[i] != now:
+            self._seconds[i] = now
+            self._buckets[i] = 0
+        self._buckets[i] += n
+        self.total += n
+
+    def count(self) -> int:
+        """
+        :return: events in the last window seconds
+        :rtype: int
+        """
+        now = int(time.monotonic())
+        return sum(
+            n
+            for n, second in zip(self._buckets, self._seconds)
+            if now - second < self.window
+        )
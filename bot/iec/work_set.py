@@ -0,0 +1,168 @@
+import logging
+from collections import Counter
+from typing import Iterator
+from bot.db.models import Address
+
+__all__ = ("address_work_set", "AddressWorkSet", "AddressKey")
+
+# (city_id, district_id, street_id, home_num)
+AddressKey = tuple[int, int, int, int]
+
+
+class AddressWorkSet:
+    """
+    The unique subscribed addresses the monitor checks.
+    Seeded once from the db and then kept up to date by
+    address add/delete events, every address counts its
+    subscriptions so it stays while anyone is subscribed.
+    reconcile() repairs drift from missed events.
+    Also indexed by street and city to find neighbours.
+    """
+
+    def __init__(self) -> None:
+        self._subscriptions: Counter[AddressKey] = Counter()
+        # (city_id, street_id): addresses
+        self._by_street: dict[tuple[int, int], set[AddressKey]] = {}
+        # city_id: addresses
+        self._by_city: dict[int, set[AddressKey]] = {}
+        # events since the last load, a load is not applied if it changed
+        self._events = 0
+        self.seeded = False
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    async def _load() -> Counter[AddressKey]:
+        rows = await Address.filter(user__is_active=True).values_list(
+            "city_id", "city__district_id", "street_id", "home_num"
+        )
+        return Counter(rows)
+
+    def _replace(self, subscriptions: Counter[AddressKey]):
+        self._subscriptions = subscriptions
+        self._by_street.clear()
+        self._by_city.clear()
+        for key in subscriptions:
+            self._index(key)
+
+    def _index(self, key: AddressKey):
+        city_id, _, street_id, _ = key
+        self._by_street.setdefault((city_id, street_id), set()).add(key)
+        self._by_city.setdefault(city_id, set()).add(key)
+
+    def _unindex(self, key: AddressKey):
+        city_id, _, street_id, _ = key
+        street = self._by_street[(city_id, street_id)]
+        street.discard(key)
+        if not street:
+            del self._by_street[(city_id, street_id)]
+        city = self._by_city[city_id]
+        city.discard(key)
+        if not city:
+            del self._by_city[city_id]
+
+    async def seed(self):
+        """
+        Loads the addresses from the db, once
+        """
+        if self.seeded:
+            return
+        self._replace(await self._load())
+        self.seeded = True
+        self.logger.info(f"Work set seeded with {len(self)} addresses")
+
+    async def reconcile(self) -> int:
+        """
+        Reloads the addresses from the db
+        and replaces the work set if it drifted
+
+        :return: addresses that were missing or extra
+        :rtype: int
+        """
+        events = self._events
+        loaded = await self._load()
+        if events != self._events:
+            # changed while loading, try again next time
+            return 0
+
+        current = self._subscriptions
+        drift = sum(
+            1 for k in loaded.keys() | current.keys() if loaded[k] != current[k]
+        )
+        if drift:
+            self.logger.warning(f"Work set drifted by {drift} addresses, repaired")
+            self._replace(loaded)
+        return drift
+
+    def add(self, city_id: int, district_id: int, street_id: int, home_num: int):
+        """
+        An address subscription was added
+
+        :param city_id: iec city id
+        :type city_id: int
+        :param district_id: iec city district id
+        :type district_id: int
+        :param street_id: iec street id
+        :type street_id: int
+        :param home_num: home number
+        :type home_num: int
+        """
+        self._events += 1
+        key = (city_id, district_id, street_id, home_num)
+        self._subscriptions[key] += 1
+        if self._subscriptions[key] == 1:
+            self._index(key)
+
+    def remove(self, city_id: int, district_id: int, street_id: int, home_num: int):
+        """
+        An address subscription was removed
+
+        :param city_id: iec city id
+        :type city_id: int
+        :param district_id: iec city district id
+        :type district_id: int
+        :param street_id: iec street id
+        :type street_id: int
+        :param home_num: home number
+        :type home_num: int
+        """
+        self._events += 1
+        key = (city_id, district_id, street_id, home_num)
+        if key not in self._subscriptions:
+            return
+        if self._subscriptions[key] == 1:
+            del self._subscriptions[key]
+            self._unindex(key)
+        else:
+            self._subscriptions[key] -= 1
+
+    def on_street(self, city_id: int, street_id: int) -> set[AddressKey]:
+        """
+        :param city_id: iec city id
+        :type city_id: int
+        :param street_id: iec street id
+        :type street_id: int
+        :return: the subscribed addresses on the street
+        :rtype: set[AddressKey]
+        """
+        return self._by_street.get((city_id, street_id), set())
+
+    def in_city(self, city_id: int) -> set[AddressKey]:
+        """
+        :param city_id: iec city id
+        :type city_id: int
+        :return: the subscribed addresses in the city
+        :rtype: set[AddressKey]
+        """
+        return self._by_city.get(city_id, set())
+
+    def __contains__(self, key: AddressKey) -> bool:
+        return key in self._subscriptions
+
+    def __iter__(self) -> Iterator[AddressKey]:
+        return iter(self._subscriptions)
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+
+address_work_set = AddressWorkSet()
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from aiogram import types
 from bot.db.models import Address
 import bot.handlers.callbacks.address_keyboard as address_kb
@@ -31,6 +32,67 @@ def get_addresses_keyboard(
     return markup
 
 
+class AddressMenuCache:
+    """
+    The addresses menu keyboard of every user, rendered
+    once and reused until the user adds or deletes an address
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """
+        :param max_size: users kept
+        :type max_size: int
+        """
+        self.max_size = max_size
+        # user id: (keyboard, addresses count)
+        self._menus: OrderedDict[
+            int, tuple[types.InlineKeyboardMarkup, int]
+        ] = OrderedDict()
+        # bumped by every invalidate, a menu loaded
+        # meanwhile may be stale and is not kept
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, user_id: int) -> tuple[types.InlineKeyboardMarkup, int]:
+        """
+        :param user_id: telegram user id
+        :type user_id: int
+        :return: the menu keyboard and the user addresses count
+        :rtype: tuple[types.InlineKeyboardMarkup, int]
+        """
+        menu = self._menus.get(user_id)
+        if menu:
+            self._menus.move_to_end(user_id)
+            self.hits += 1
+            return menu
+
+        self.misses += 1
+        version = self._version
+        addresses = await Address.filter(user_id=user_id).select_related(
+            "city", "street"
+        )
+        menu = (get_addresses_keyboard(addresses, add_new_btn=True), len(addresses))
+        if version == self._version:
+            self._menus[user_id] = menu
+            if len(self._menus) > self.max_size:
+                self._menus.popitem(last=False)
+        return menu
+
+    def invalidate(self, user_id: int):
+        """
+        The user addresses changed
+
+        :param user_id: telegram user id
+        :type user_id: int
+        """
+        self._version += 1
+        self._menus.pop(user_id, None)
+
+
+address_menus = AddressMenuCache(max_size=5000)
+
+
 def get_view_address_keyboard(id: int) -> types.InlineKeyboardMarkup:
     markup = types.InlineKeyboardMarkup()
 
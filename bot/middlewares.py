@@ -1,8 +1,24 @@
+import logging
+import time
+from collections import Counter
+from bisect import bisect_left
+from contextvars import ContextVar
 from aiogram.dispatcher.handler import current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, Update
 
 from bot.db.models import User
+from bot.db.user_cache import user_cache
+from bot.db.query_tracker import (
+    install_query_tracker,
+    stop_tracking,
+    track_queries,
+    tracked_queries,
+)
+from bot.config import config
+
+# upper bounds of the latency histogram buckets, ms
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
 
 
 def prefetch_user(func):
@@ -22,10 +38,7 @@ class UserMiddleware(BaseMiddleware):
             attr = getattr(handler, "userdata_required", False)
             if not attr:
                 return
-        user = await User.filter(id=telegram_id).first()
-        if user:
-            return user
-        return await User.create(id=telegram_id)
+        return await user_cache.get_or_create(telegram_id)
 
     async def on_process_message(self, message: Message, data: dict):
         data["user"] = await self.get_user(message.from_user.id)
@@ -34,3 +47,161 @@ class UserMiddleware(BaseMiddleware):
         self, callback_query: CallbackQuery, data: dict
     ):
         data["user"] = await self.get_user(callback_query.from_user.id)
+
+
+class LatencyHistogram:
+    """
+    Latencies of a handler in LATENCY_BUCKETS_MS buckets
+    """
+
+    __slots__ = ("counts", "total_ms", "max_ms", "queries")
+
+    def __init__(self) -> None:
+        # the last bucket is above the last bound
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def record(self, ms: float, queries: int):
+        """
+        :param ms: update latency
+        :type ms: float
+        :param queries: db queries of the update
+        :type queries: int
+        """
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.queries += queries
+
+    def percentile(self, p: float) -> float:
+        """
+        :param p: 0-100
+        :type p: float
+        :return: upper bound of the bucket of the percentile (at most the max), ms
+        :rtype: float
+        """
+        target = self.count * p / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                if i == len(LATENCY_BUCKETS_MS):
+                    return self.max_ms
+                return min(LATENCY_BUCKETS_MS[i], self.max_ms)
+        return 0.0
+
+
+class HandlerTimings:
+    """
+    Latency histograms of all the handlers
+    """
+
+    def __init__(self) -> None:
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self.slow_updates = 0
+
+    def record(self, handler: str, ms: float, queries: int):
+        """
+        :param handler: handler name
+        :type handler: str
+        :param ms: update latency
+        :type ms: float
+        :param queries: db queries of the update
+        :type queries: int
+        """
+        histogram = self.histograms.get(handler)
+        if histogram is None:
+            histogram = self.histograms[handler] = LatencyHistogram()
+        histogram.record(ms, queries)
+
+    def report(self) -> str:
+        """
+        :return: a table of the handlers latencies
+        :rtype: str
+        """
+        lines = [
+            f"{'handler':<32} {'count':>6} {'avg':>7} {'p50':>6} {'p95':>6} "
+            f"{'max':>7} {'queries':>7}"
+        ]
+        for name, h in sorted(
+            self.histograms.items(), key=lambda item: -item[1].total_ms
+        ):
+            lines.append(
+                f"{name:<32} {h.count:>6} {h.total_ms / h.count:>6.1f}ms "
+                f"{h.percentile(50):>4.0f}ms {h.percentile(95):>4.0f}ms "
+                f"{h.max_ms:>5.0f}ms {h.queries / h.count:>7.1f}"
+            )
+        lines.append(f"slow updates: {self.slow_updates}")
+        return "\n".join(lines)
+
+
+handler_timings = HandlerTimings()
+
+
+class _UpdateTiming:
+    __slots__ = ("start", "handler", "token")
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.handler: str = None
+        self.token = track_queries()
+
+
+_update_timing: ContextVar[_UpdateTiming] = ContextVar("update_timing", default=None)
+
+
+class TimingMiddleware(BaseMiddleware):
+    """
+    Records the latency and the db queries of every update
+    per handler in handler_timings, and logs the updates
+    slower than config.bot.slow_update_threshold with their queries
+    """
+
+    def __init__(self):
+        super(TimingMiddleware, self).__init__()
+        install_query_tracker()
+        self.logger = logging.getLogger(__name__)
+
+    async def on_pre_process_update(self, update: Update, data: dict):
+        _update_timing.set(_UpdateTiming())
+
+    @staticmethod
+    def _set_handler():
+        timing = _update_timing.get()
+        handler = current_handler.get()
+        if timing and handler:
+            timing.handler = handler.__name__
+
+    async def on_process_message(self, message: Message, data: dict):
+        self._set_handler()
+
+    async def on_process_callback_query(
+        self, callback_query: CallbackQuery, data: dict
+    ):
+        self._set_handler()
+
+    async def on_post_process_update(self, update: Update, result, data: dict):
+        timing = _update_timing.get()
+        if timing is None:
+            return
+        ms = (time.perf_counter() - timing.start) * 1000
+        queries = tracked_queries()
+        stop_tracking(timing.token)
+
+        handler = timing.handler or "unhandled"
+        handler_timings.record(handler, ms, len(queries))
+        if ms >= config.bot.slow_update_threshold * 1000:
+            handler_timings.slow_updates += 1
+            # repeated queries (n+1) once, with a count
+            counts = Counter(queries)
+            self.logger.warning(
+                f"Slow update {update.update_id} ({handler}) took {ms:.0f}ms, "
+                f"{len(queries)} queries:\n"
+                + "\n".join(f"{n}x {query}" for query, n in counts.items())
+            )
@@ -0,0 +1,151 @@
+"""
+A small sampling profiler for the running bot, a thread samples
+the event loop thread stack every few ms and the samples are
+split into the dispatcher (handlers) and the outages monitor.
+"""
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+
+__all__ = ("profiler", "SamplingProfiler")
+
+# seconds between samples
+SAMPLE_INTERVAL = 0.005
+# innermost frames shown for a hot path
+STACK_DEPTH = 6
+TOP = 12
+
+# part: path fragment of a frame that puts the sample in it, by priority
+PARTS = (
+    ("monitor", os.path.join("bot", "iec", "moitor_outages")),
+    ("dispatcher", os.path.join("bot", "handlers")),
+    ("dispatcher", os.path.join("aiogram", "dispatcher")),
+)
+IDLE_FUNCTIONS = {"select", "poll", "epoll", "_run_once"}
+
+# (path, line, function)
+Frame = tuple[str, int, str]
+# (part, frames innermost first)
+Sample = tuple[str, tuple[Frame, ...]]
+
+
+def _frame(frame: FrameType) -> Frame:
+    code = frame.f_code
+    path = code.co_filename
+    if "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    elif path.startswith(os.getcwd()):
+        path = os.path.relpath(path)
+    else:
+        # stdlib, asyncio/base_events.py
+        path = os.path.join(*path.split(os.sep)[-2:])
+    return path, frame.f_lineno, code.co_name
+
+
+class SamplingProfiler:
+    """
+    Samples the event loop thread for
+    some seconds, one profile at a time
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        """
+        :param interval: seconds between samples
+        :type interval: float
+        """
+        self.interval = interval
+        self.running = False
+
+    def _sample(self, frame: FrameType) -> Sample:
+        frames = []
+        part = None
+        # the outermost matching frame decides the part (the task that
+        # runs it), and the frames outside of it are the event loop
+        part_depth = None
+        while frame is not None:
+            path = frame.f_code.co_filename
+            for name, fragment in PARTS:
+                if fragment in path:
+                    part, part_depth = name, len(frames)
+                    break
+            frames.append(frame)
+            frame = frame.f_back
+        if part is None:
+            part = "idle" if frames[0].f_code.co_name in IDLE_FUNCTIONS else "other"
+        else:
+            frames = frames[: part_depth + 1]
+        return part, tuple(_frame(f) for f in frames)
+
+    async def profile(self, seconds: float) -> str:
+        """
+        Samples the event loop thread
+
+        :param seconds: how long
+        :type seconds: float
+        :raises RuntimeError: if allready profiling
+        :return: the report
+        :rtype: str
+        """
+        if self.running:
+            raise RuntimeError("Allready profiling")
+        self.running = True
+        thread_id = threading.get_ident()
+        stop = threading.Event()
+        samples: list[Sample] = []
+
+        def sampler():
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    samples.append(self._sample(frame))
+
+        thread = threading.Thread(target=sampler, name="profiler", daemon=True)
+        thread.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
+            self.running = False
+        return self._report(samples, seconds)
+
+    @staticmethod
+    def _report(samples: list[Sample], seconds: float) -> str:
+        total = len(samples) or 1
+        lines = [f"{len(samples)} samples in {seconds}s"]
+        parts = Counter(part for part, _ in samples)
+        lines += [f"  {p}: {n / total:.1%}" for p, n in parts.most_common()]
+
+        for part in ("dispatcher", "monitor", "other"):
+            part_samples = [frames for p, frames in samples if p == part]
+            if not part_samples:
+                continue
+            functions = Counter()
+            paths = Counter()
+            for frames in part_samples:
+                # inclusive, once per sample
+                functions.update({f"{path} {name}" for path, _, name in frames})
+                paths[
+                    " < ".join(
+                        f"{path}:{line} {name}"
+                        for path, line, name in frames[:STACK_DEPTH]
+                    )
+                ] += 1
+
+            lines.append(f"\n== {part}: {len(part_samples)} samples ==")
+            lines.append("top functions (inclusive):")
+            lines += [
+                f"  {n / total:6.1%}  {label}"
+                for label, n in functions.most_common(TOP)
+            ]
+            lines.append("hot paths (innermost first):")
+            lines += [
+                f"  {n / total:6.1%}  {path}" for path, n in paths.most_common(TOP)
+            ]
+        return "\n".join(lines)
+
+
+profiler = SamplingProfiler()
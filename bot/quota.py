@@ -0,0 +1,63 @@
+import time
+from collections import deque
+from bot.config import config
+
+__all__ = ("check_quota", "UserQuota")
+
+# acquires between dropping the users with no recent uses
+PRUNE_EVERY = 1000
+
+
+class UserQuota:
+    """
+    Allows a user limit uses in the last window seconds
+    """
+
+    def __init__(self, limit: int, window: float) -> None:
+        """
+        :param limit: uses in a window, 0 for unlimited
+        :type limit: int
+        :param window: seconds
+        :type window: float
+        """
+        self.limit = limit
+        self.window = window
+        # user id: monotonic times of the uses, oldest first
+        self._uses: dict[int, deque[float]] = {}
+        self._acquires = 0
+        self.rejected = 0
+
+    def acquire(self, user_id: int) -> float:
+        """
+        Uses the quota of the user if it allows
+
+        :param user_id: telegram user id
+        :type user_id: int
+        :return: 0 if allowed, else seconds until it is
+        :rtype: float
+        """
+        if self.limit <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._acquires += 1
+        if self._acquires % PRUNE_EVERY == 0:
+            self._prune(now)
+
+        uses = self._uses.setdefault(user_id, deque())
+        while uses and now - uses[0] >= self.window:
+            uses.popleft()
+        if len(uses) >= self.limit:
+            self.rejected += 1
+            return uses[0] + self.window - now
+        uses.append(now)
+        return 0.0
+
+    def _prune(self, now: float):
+        self._uses = {
+            user_id: uses
+            for user_id, uses in self._uses.items()
+            if uses and now - uses[-1] < self.window
+        }
+
+
+check_quota = UserQuota(config.bot.check_quota, config.bot.check_quota_window)
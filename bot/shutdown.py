@@ -0,0 +1,131 @@
+"""
+Orderly shutdown: stop taking new work, let the work in
+flight finish, save the monitor state, send what is
+pending and only then close the db and the sessions.
+The waits share one deadline, config.monitor.shutdown_timeout,
+below the docker stop grace period
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from aiogram import Dispatcher
+from tortoise import Tortoise
+from bot.broadcast import Broadcaster
+from bot.config import config
+from bot.iec.api import iec_api
+from bot.iec.moitor_outages import OutagesMonitor
+
+__all__ = ("shutdown",)
+
+logger = logging.getLogger(__name__)
+
+
+class ShutdownReport:
+    """
+    Times the shutdown phases, a failed phase is
+    logged and the next ones still run
+    """
+
+    def __init__(self) -> None:
+        self._start = time.perf_counter()
+        # (phase, seconds, note)
+        self.phases: list[tuple[str, float, str]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[list[str]]:
+        """
+        :param name: the phase
+        :type name: str
+        :yield: notes of the phase, to append to
+        :rtype: Iterator[list[str]]
+        """
+        notes = []
+        start = time.perf_counter()
+        try:
+            yield notes
+        except Exception:
+            logger.exception(f"Shutdown phase {name} failed")
+            notes.append("failed")
+        self.phases.append((name, time.perf_counter() - start, ", ".join(notes)))
+
+    def __str__(self) -> str:
+        phases = ", ".join(
+            f"{name} {seconds:.2f}s" + (f" ({note})" if note else "")
+            for name, seconds, note in self.phases
+        )
+        return f"Shutdown in {time.perf_counter() - self._start:.2f}s: {phases}"
+
+
+async def shutdown(
+    dp: Dispatcher,
+    monitor: OutagesMonitor,
+    broadcaster: Broadcaster,
+    background: list[asyncio.Task],
+):
+    """
+    :param dp: the dispatcher, polling allready stopped
+    :type dp: Dispatcher
+    :param monitor: the outages monitor
+    :type monitor: OutagesMonitor
+    :param broadcaster: the admin broadcaster
+    :type broadcaster: Broadcaster
+    :param background: tasks that can be cancelled right away
+    :type background: list[asyncio.Task]
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config.monitor.shutdown_timeout
+    report = ShutdownReport()
+
+    def remaining() -> float:
+        return max(deadline - loop.time(), 0)
+
+    with report.phase("stop"):
+        dp.stop_polling()
+        monitor.stop_monitoring()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+    with report.phase("drain") as notes:
+        abandoned = await monitor.drain(remaining())
+        if abandoned:
+            notes.append(f"{abandoned} checks abandoned")
+        # wait_for with no time left times out even on a wait that is done
+        if not broadcaster.running:
+            await broadcaster.stop()
+        else:
+            try:
+                await asyncio.wait_for(broadcaster.stop(), remaining())
+            except asyncio.TimeoutError:
+                notes.append("broadcast not paused")
+
+    # before the flush, the longest wait
+    with report.phase("snapshot") as notes:
+        notes.append(f"{monitor.save_state()} unchecked")
+        notes.append(f"{len(monitor.active_outages)} active outages")
+
+    with report.phase("flush") as notes:
+        pending = monitor.digests and sum(
+            digest.flush_task is not None for digest in monitor.digests.digests.values()
+        )
+        if pending:
+            notes.append(f"{pending} digests")
+            try:
+                await asyncio.wait_for(monitor.digests.flush_all(), remaining())
+            except asyncio.TimeoutError:
+                notes.append("timed out")
+
+    with report.phase("close"):
+        iec_api.rbzid.close()
+        # created on the first IEC request
+        if iec_api.session is not None:
+            await iec_api.session.close()
+        await Tortoise.close_connections()
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+    logger.warning(str(report))
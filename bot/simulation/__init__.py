@@ -0,0 +1,41 @@
+"""
+Offline simulation of the outages monitor. The real
+monitor pipeline runs against a simulated IEC and telegram
+on a virtual clock, so a day of polling takes seconds,
+to compare scheduling policies before deploying them.
+--crash-at restarts the monitor without its saved state,
+the check errors after the restore should stay 0, like
+--addresses 2000 --hours 6 --crash-at 2
+
+usage: python -m bot.simulation [--addresses N] [--hours H]
+       [--seed S] [--scenario NAME] [--events FILE]
+       [--save-events FILE] [--latency SECONDS]
+       [--policy NAME:section.field=value,...]
+       [--crash-at HOUR] [--output FILE]
+"""
+from bot.simulation.clock import VirtualClockLoop, run
+from bot.simulation.engine import Policy, SimulationResult, simulate
+from bot.simulation.scenario import (
+    SCENARIOS,
+    OutageEvent,
+    Population,
+    generate_events,
+    generate_population,
+    load_events,
+    save_events,
+)
+
+__all__ = (
+    "VirtualClockLoop",
+    "run",
+    "Policy",
+    "SimulationResult",
+    "simulate",
+    "SCENARIOS",
+    "OutageEvent",
+    "Population",
+    "generate_events",
+    "generate_population",
+    "load_events",
+    "save_events",
+)
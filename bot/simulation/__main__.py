@@ -0,0 +1,152 @@
+import argparse
+import json
+import logging
+from typing import Optional
+from bot.simulation.clock import run
+from bot.simulation.engine import Policy, SimulationResult, simulate
+from bot.simulation.scenario import (
+    SCENARIOS,
+    generate_events,
+    generate_population,
+    load_events,
+    outage_episodes,
+    save_events,
+)
+
+# seconds, the detection delay curve points
+DELAY_STEPS = (60, 2 * 60, 5 * 60, 10 * 60, 15 * 60, 30 * 60, 60 * 60, 2 * 60 * 60)
+
+
+def _minutes(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds / 60:.1f}m"
+
+
+def format_report(results: list[SimulationResult], title: str) -> str:
+    """
+    :param results: a result per policy
+    :type results: list[SimulationResult]
+    :param title: the first line
+    :type title: str
+    :return: the policies side by side
+    :rtype: str
+    """
+    width = max([10] + [len(r.policy) + 2 for r in results])
+
+    def row(label: str, values: list) -> str:
+        return f"{label:<22}" + "".join(f"{str(v):>{width}}" for v in values)
+
+    p = SimulationResult.percentile
+    lines = [
+        title,
+        "",
+        row("", [r.policy for r in results]),
+        row("IEC requests", [r.requests for r in results]),
+        row("outages detected", [f"{r.detected}/{r.episodes}" for r in results]),
+        row("missed", [r.missed for r in results]),
+        row("pending at the end", [r.pending for r in results]),
+        row("requests per outage", [r.requests // max(r.detected, 1) for r in results]),
+    ]
+    for q in (50, 90, 99):
+        lines.append(
+            row(f"start delay p{q}", [_minutes(p(r.start_delays, q)) for r in results])
+        )
+    lines.append(
+        row("start delay max", [_minutes(p(r.start_delays, 100)) for r in results])
+    )
+    for q in (50, 90):
+        lines.append(
+            row(f"end delay p{q}", [_minutes(p(r.end_delays, q)) for r in results])
+        )
+    lines += [
+        row("telegram messages", [r.messages for r in results]),
+        row("check errors", [r.errors for r in results]),
+        row("ran in", [f"{r.wall_time:.1f}s" for r in results]),
+        "",
+        "outages detected within",
+    ]
+    lines += [
+        row(f"  {_minutes(step)}", [f"{r.detected_within(step):.0%}" for r in results])
+        for step in DELAY_STEPS
+    ]
+    lines += ["", "IEC requests per hour"]
+    hours = max(len(r.requests_per_hour) for r in results)
+    lines += [
+        row(f"  {hour:02d}", [r.requests_per_hour[hour] for r in results])
+        for hour in range(hours)
+    ]
+    return "\n".join(lines)
+
+
+async def run_policies(args: argparse.Namespace) -> list[SimulationResult]:
+    if args.events:
+        header, events = load_events(args.events)
+        args.addresses, args.seed, args.hours = (
+            header["addresses"],
+            header["seed"],
+            header["hours"],
+        )
+        population = generate_population(args.addresses, args.seed)
+    else:
+        population = generate_population(args.addresses, args.seed)
+        events = generate_events(population, args.hours, args.seed, args.scenario)
+    if args.save_events:
+        save_events(args.save_events, events, args.addresses, args.seed, args.hours)
+
+    args.episodes = len(outage_episodes(events))
+    policies = [Policy.parse(text) for text in args.policy or ["current"]]
+    return [
+        await simulate(
+            population,
+            events,
+            policy,
+            args.hours,
+            args.latency,
+            args.seed,
+            args.crash_at,
+        )
+        for policy in policies
+    ]
+
+
+def main(args: argparse.Namespace):
+    results = run(run_policies(args))
+    source = args.events or f"scenario {args.scenario}"
+    if args.crash_at:
+        source += f", restarted without state at {args.crash_at}h"
+    print(
+        format_report(
+            results,
+            f"{source}, {args.addresses} addresses, {args.hours}h, "
+            f"{args.episodes} outages, seed {args.seed}",
+        )
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([r.__dict__ for r in results], f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bot.simulation")
+    parser.add_argument("--addresses", type=int, default=2000)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--events", help="replays a trace saved with --save-events")
+    parser.add_argument("--save-events", help="saves the events trace, jsonl")
+    parser.add_argument(
+        "--latency", type=float, default=0.3, help="IEC seconds per request"
+    )
+    parser.add_argument(
+        "--policy",
+        action="append",
+        help="NAME:section.field=value,... (config settings), "
+        "repeat to compare, defaults to the current config",
+    )
+    parser.add_argument(
+        "--crash-at",
+        type=float,
+        help="restarts the monitor at this hour without its saved state",
+    )
+    parser.add_argument("--output", help="writes the results as json")
+    logging.basicConfig(level=logging.WARNING)
+    main(parser.parse_args())
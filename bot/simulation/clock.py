@@ -0,0 +1,136 @@
+"""
+An event loop with a virtual clock. When nothing is ready
+to run it jumps to the next timer instead of sleeping,
+so a day of asyncio.sleep calls takes no real time
+"""
+import asyncio
+import functools
+import selectors
+from contextlib import contextmanager
+from typing import Awaitable, Iterator, TypeVar
+import aiosqlite.core
+
+__all__ = ("VirtualClockLoop", "tracking_thread_calls", "run")
+
+T = TypeVar("T")
+
+# aiosqlite.core.Connection methods that wait for its thread
+THREAD_CALLS = ("_execute", "_connect")
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    """
+    Polls the real selector without blocking, and advances
+    the loop clock by the timeout instead of waiting it
+    """
+
+    def __init__(self, loop: "VirtualClockLoop") -> None:
+        self._loop = loop
+        self._selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        return self._selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._selector.modify(fileobj, events, data)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self):
+        self._selector.close()
+
+    def select(self, timeout=None):
+        ready = self._selector.select(0)
+        if ready or timeout == 0:
+            return ready
+        if self._loop.thread_calls or timeout is None:
+            # a thread wakes the loop up when it is done,
+            # the clock stands still meanwhile
+            return self._selector.select(None)
+        self._loop.advance(timeout)
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    time() starts at 0 and moves only when every task
+    waits for a timer. Work on other threads (the sqlite
+    connection) is waited for in real time, see
+    tracking_thread_calls. Not for real network io
+    """
+
+    def __init__(self) -> None:
+        self._now = 0.0
+        # calls waiting for another thread
+        self.thread_calls = 0
+        super().__init__(_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float):
+        """
+        :param seconds: moves the clock forward
+        :type seconds: float
+        """
+        self._now += seconds
+
+
+def _tracked(method, loop: VirtualClockLoop):
+    @functools.wraps(method)
+    async def call(self, *args, **kwargs):
+        loop.thread_calls += 1
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            loop.thread_calls -= 1
+
+    return call
+
+
+@contextmanager
+def tracking_thread_calls(loop: VirtualClockLoop) -> Iterator[None]:
+    """
+    Counts the aiosqlite calls in flight, so the
+    clock does not jump while the db is working
+
+    :param loop: the loop
+    :type loop: VirtualClockLoop
+    """
+    cls = aiosqlite.core.Connection
+    originals = {name: cls.__dict__[name] for name in THREAD_CALLS}
+    for name, method in originals.items():
+        setattr(cls, name, _tracked(method, loop))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(cls, name, method)
+
+
+def run(main: Awaitable[T]) -> T:
+    """
+    Like asyncio.run, in a new VirtualClockLoop
+
+    :param main: the coroutine
+    :type main: Awaitable[T]
+    :return: its result
+    :rtype: T
+    """
+    loop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        with tracking_thread_calls(loop):
+            return loop.run_until_complete(main)
+    finally:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
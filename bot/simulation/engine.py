@@ -0,0 +1,475 @@
+"""
+Runs the real OutagesMonitor against a simulated IEC
+(answering from an outage event trace at the virtual
+time) and a simulated telegram, with an in memory db
+"""
+import asyncio
+import bisect
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Iterator, Optional
+from aiogram.types.message import Message
+from tortoise import Tortoise
+from bot.config import config
+from bot.db import init_db
+from bot.db.models import Address, City, Street, User
+from bot.iec.api import classify_failure, iec_api
+from bot.iec.decoding import IECOutageStatus
+from bot.iec.decoding_benchmark import NO_OUTAGE_BODY, OUTAGE_BODY
+from bot.iec.moitor_outages import OutagesMonitor
+from bot.iec.request_scheduler import RequestScheduler
+from bot.iec.work_set import AddressKey
+from bot.simulation.scenario import (
+    HOUR,
+    OutageEvent,
+    Population,
+    outage_episodes,
+)
+from bot.tracing import Trace
+
+__all__ = ("Policy", "SimulationResult", "simulate")
+
+TIMEZONE = "Asia/Jerusalem"
+# the time 0 of the simulation, for the IEC outage times
+SIM_EPOCH = datetime(2022, 1, 1)
+# seconds the checks in flight get to finish at the end
+DRAIN_TIMEOUT = 60
+# seconds a telegram call takes
+TELEGRAM_LATENCY = 0.05
+# seconds the bot is down after a simulated crash, the
+# outages that end meanwhile are first seen ended
+CRASH_DOWNTIME = 30 * 60
+# set for every run, nothing is written outside the simulation
+SIMULATION_OVERRIDES = {"tracing.file": "", "monitor.state_file": ""}
+
+
+@dataclass
+class Policy:
+    name: str
+    # "section.field": value, set on config while it runs
+    overrides: dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, text: str) -> "Policy":
+        """
+        :param text: NAME[:section.field=value,...], like
+            fast:monitor.round_interval=0,iec.request_interval=0.8
+        :type text: str
+        :raises ValueError: on an unknown setting
+        :return: the policy
+        :rtype: Policy
+        """
+        name, _, settings = text.partition(":")
+        overrides = {}
+        for setting in filter(None, settings.split(",")):
+            key, _, raw = setting.partition("=")
+            current = _setting(key)
+            if isinstance(current, bool):
+                overrides[key] = raw.lower() in ("1", "true", "yes")
+            else:
+                overrides[key] = type(current)(raw)
+        return cls(name, overrides)
+
+
+def _setting(key: str) -> Any:
+    section, _, name = key.partition(".")
+    try:
+        return getattr(getattr(config, section), name)
+    except AttributeError:
+        raise ValueError(f"unknown setting {key}") from None
+
+
+@contextmanager
+def _overridden(overrides: dict[str, Any]) -> Iterator[None]:
+    old = {key: _setting(key) for key in overrides}
+    for key, value in overrides.items():
+        section, _, name = key.partition(".")
+        setattr(getattr(config, section), name, value)
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            section, _, name = key.partition(".")
+            setattr(getattr(config, section), name, value)
+
+
+class SimulatedResponse:
+    content_type = "application/json"
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self) -> str:
+        return self.body.decode()
+
+
+class SimulatedIEC:
+    """
+    Stands in for the aiohttp session of the IEC api,
+    answers the address status at the virtual time
+    """
+
+    def __init__(
+        self,
+        population: Population,
+        events: list[OutageEvent],
+        latency: float,
+        seed: int,
+        started: float,
+    ) -> None:
+        """
+        :param population: the addresses
+        :type population: Population
+        :param events: the outage events
+        :type events: list[OutageEvent]
+        :param latency: average seconds a request takes
+        :type latency: float
+        :param seed: random seed of the latencies
+        :type seed: int
+        :param started: loop time of the start
+        :type started: float
+        """
+        self.latency = latency
+        self.started = started
+        self._rng = random.Random(f"iec-{seed}")
+        # (city_id, street_id, home_num): events of the address
+        self._events: dict[tuple[int, int, int], list[OutageEvent]] = defaultdict(list)
+        for event in events:
+            for i in event.addresses:
+                city_id, _, street_id, home_num = population.addresses[i]
+                self._events[(city_id, street_id, home_num)].append(event)
+        self._bodies: dict[int, bytes] = {}
+        self.requests_per_hour = Counter()
+
+    @property
+    def requests(self) -> int:
+        return sum(self.requests_per_hour.values())
+
+    async def request(self, method: str, path: str, params: dict = None, **kwargs):
+        now = asyncio.get_running_loop().time() - self.started
+        self.requests_per_hour[int(now // HOUR)] += 1
+        await asyncio.sleep(self.latency * self._rng.uniform(0.5, 1.5))
+        key = (params["cityID"], params["streetID"], params["homeNum"])
+        for event in self._events.get(key, ()):
+            if event.visible_from <= now < event.end:
+                return SimulatedResponse(self._body(event))
+        return SimulatedResponse(NO_OUTAGE_BODY)
+
+    def _body(self, event: OutageEvent) -> bytes:
+        body = self._bodies.get(event.incident_id)
+        if body is None:
+            start = SIM_EPOCH + timedelta(seconds=event.start)
+            end = SIM_EPOCH + timedelta(seconds=event.end)
+            status = json.loads(OUTAGE_BODY)
+            status.update(
+                IsActiveIncident=event.kind != "planned",
+                IsPlannedOutage=event.kind == "planned",
+                Time_Outage=start.isoformat(timespec="seconds"),
+                IncidentID=event.incident_id,
+                IncidentStatusName=f"צפי לסיום {end:%H:%M %d/%m/%Y}",
+            )
+            body = json.dumps(status, ensure_ascii=False).encode()
+            self._bodies[event.incident_id] = body
+        return body
+
+    async def close(self):
+        pass
+
+
+class SimulatedBot:
+    """
+    Stands in for the telegram bot, counts the messages
+    """
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.deleted = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> Message:
+        await asyncio.sleep(TELEGRAM_LATENCY)
+        self.sent += 1
+        return Message(message_id=self.sent, chat={"id": chat_id, "type": "private"})
+
+    async def delete_message(self, chat_id: int, message_id: int) -> bool:
+        await asyncio.sleep(TELEGRAM_LATENCY)
+        self.deleted += 1
+        return True
+
+
+class SimulatedMonitor(OutagesMonitor):
+    """
+    Records when outages starts and ends are detected,
+    and the checks that failed on a bot error
+    """
+
+    def __init__(self, telegram_bot: SimulatedBot, started: float) -> None:
+        super().__init__(telegram_bot)
+        self.started = started
+        # (seconds from the start, (city_id, street_id, home_num), start or end)
+        self.detections: list[tuple[float, tuple[int, int, int], str]] = []
+        # failure: count, IEC failures not included
+        self.check_errors = Counter()
+
+    def _detected(self, key: tuple[int, int, int], what: str):
+        now = asyncio.get_running_loop().time() - self.started
+        self.detections.append((now, key, what))
+
+    async def _process_new_outage(
+        self,
+        outage: IECOutageStatus,
+        outage_key: int,
+        city_id: int,
+        district_id: int,
+        street_id: int,
+        home_num: int,
+    ):
+        self._detected((city_id, street_id, home_num), "start")
+        await super()._process_new_outage(
+            outage, outage_key, city_id, district_id, street_id, home_num
+        )
+
+    async def _process_outage_ended(
+        self, outage_key: int, city_id: int, street_id: int, home_num: int
+    ):
+        self._detected((city_id, street_id, home_num), "end")
+        await super()._process_outage_ended(outage_key, city_id, street_id, home_num)
+
+    def _check_done(
+        self, add: AddressKey, error: Exception = None, trace: Trace = None
+    ):
+        if error is not None and classify_failure(error) is None:
+            self.check_errors[type(error).__name__] += 1
+        super()._check_done(add, error, trace)
+
+
+@dataclass
+class SimulationResult:
+    policy: str
+    requests_per_hour: list[int]
+    # outages (overlapping events of an address merged)
+    episodes: int
+    detected: int
+    # ended before the monitor saw them
+    missed: int
+    # still going at the end, not seen yet
+    pending: int
+    # seconds from the start (or announcement) / end until detected
+    start_delays: list[float]
+    end_delays: list[float]
+    messages: int
+    # checks failed on a bot error, the simulated IEC does not fail
+    errors: int
+    wall_time: float
+
+    @property
+    def requests(self) -> int:
+        return sum(self.requests_per_hour)
+
+    @staticmethod
+    def percentile(delays: list[float], p: float) -> Optional[float]:
+        """
+        :param delays: sorted delays
+        :type delays: list[float]
+        :param p: 0-100
+        :type p: float
+        :return: the percentile, None if empty
+        :rtype: Optional[float]
+        """
+        if not delays:
+            return None
+        return delays[min(len(delays) - 1, int(len(delays) * p / 100))]
+
+    def detected_within(self, seconds: float) -> float:
+        """
+        :param seconds: delay
+        :type seconds: float
+        :return: share of the outages detected within the delay
+        :rtype: float
+        """
+        if not self.episodes:
+            return 0.0
+        return bisect.bisect_right(self.start_delays, seconds) / self.episodes
+
+
+async def _populate(population: Population):
+    cities = {}
+    streets = {}
+    for city_id, district_id, street_id, _ in population.addresses:
+        cities[city_id] = City(
+            id=city_id, name=f"city {city_id}", district_id=district_id
+        )
+        streets[street_id] = Street(
+            id=street_id, name=f"street {street_id}", city_id=city_id
+        )
+    await City.bulk_create(list(cities.values()))
+    await Street.bulk_create(list(streets.values()))
+    await User.bulk_create(
+        [User(id=user_id) for user_id in {u for u, _ in population.subscriptions}]
+    )
+    addresses = []
+    for user_id, i in population.subscriptions:
+        city_id, _, street_id, home_num = population.addresses[i]
+        addresses.append(
+            Address(
+                city_id=city_id, street_id=street_id, home_num=home_num, user_id=user_id
+            )
+        )
+    await Address.bulk_create(addresses)
+
+
+def _analyze(
+    policy: Policy,
+    population: Population,
+    events: list[OutageEvent],
+    monitor: SimulatedMonitor,
+    iec: SimulatedIEC,
+    hours: float,
+    wall_time: float,
+) -> SimulationResult:
+    horizon = hours * HOUR
+    index = {
+        (city_id, street_id, home_num): i
+        for i, (city_id, _, street_id, home_num) in enumerate(population.addresses)
+    }
+    detections = {"start": defaultdict(list), "end": defaultdict(list)}
+    for t, key, what in monitor.detections:
+        detections[what][index[key]].append(t)
+
+    episodes = [e for e in outage_episodes(events) if e.start < horizon]
+    start_delays, end_delays = [], []
+    missed = pending = 0
+    for n, episode in enumerate(episodes):
+        following = episodes[n + 1] if n + 1 < len(episodes) else None
+        until = (
+            following.start
+            if following and following.address == episode.address
+            else float("inf")
+        )
+        starts = detections["start"][episode.address]
+        i = bisect.bisect_left(starts, episode.start)
+        if i == len(starts) or starts[i] >= until:
+            if episode.end <= horizon:
+                missed += 1
+            else:
+                pending += 1
+            continue
+        start_delays.append(starts[i] - episode.start)
+
+        ends = detections["end"][episode.address]
+        i = bisect.bisect_left(ends, episode.end)
+        if i < len(ends) and ends[i] < until:
+            end_delays.append(ends[i] - episode.end)
+
+    hours_count = max(int(horizon // HOUR), 1)
+    return SimulationResult(
+        policy=policy.name,
+        requests_per_hour=[iec.requests_per_hour[h] for h in range(hours_count)],
+        episodes=len(episodes),
+        detected=len(start_delays),
+        missed=missed,
+        pending=pending,
+        start_delays=sorted(start_delays),
+        end_delays=sorted(end_delays),
+        messages=monitor.telegram_bot.sent,
+        errors=sum(monitor.check_errors.values()),
+        wall_time=wall_time,
+    )
+
+
+async def _crash_and_restart(monitor: SimulatedMonitor) -> SimulatedMonitor:
+    """
+    Stops the monitor without saving its state, like a
+    crash, and after CRASH_DOWNTIME starts another on the
+    same db, which restores the active outages from the
+    open db outages
+
+    :param monitor: the running monitor
+    :type monitor: SimulatedMonitor
+    :return: the restarted monitor, with the same records
+    :rtype: SimulatedMonitor
+    """
+    monitor.stop_monitoring()
+    await monitor.drain(DRAIN_TIMEOUT)
+    await asyncio.sleep(CRASH_DOWNTIME)
+    restarted = SimulatedMonitor(monitor.telegram_bot, monitor.started)
+    restarted.detections = monitor.detections
+    restarted.check_errors = monitor.check_errors
+    asyncio.ensure_future(restarted.start_monitoring())
+    return restarted
+
+
+async def simulate(
+    population: Population,
+    events: list[OutageEvent],
+    policy: Policy,
+    hours: float,
+    latency: float = 0.3,
+    seed: int = 0,
+    crash_at: float = None,
+) -> SimulationResult:
+    """
+    Runs the monitor for hours of virtual time,
+    in a VirtualClockLoop
+
+    :param population: the monitored addresses
+    :type population: Population
+    :param events: the outage events
+    :type events: list[OutageEvent]
+    :param policy: the settings to run with
+    :type policy: Policy
+    :param hours: virtual hours
+    :type hours: float
+    :param latency: average seconds of an IEC request, defaults to 0.3
+    :type latency: float, optional
+    :param seed: random seed of the latencies, defaults to 0
+    :type seed: int, optional
+    :param crash_at: virtual hour to restart the monitor
+        without its saved state, defaults to None
+    :type crash_at: float, optional
+    :return: the detection delays and IEC requests
+    :rtype: SimulationResult
+    """
+    loop = asyncio.get_running_loop()
+    wall_start = time.perf_counter()
+    session, scheduler = iec_api.session, iec_api.scheduler
+    with _overridden({**SIMULATION_OVERRIDES, **policy.overrides}):
+        await init_db(TIMEZONE, "sqlite://:memory:")
+        try:
+            await _populate(population)
+            started = loop.time()
+            iec = SimulatedIEC(population, events, latency, seed, started)
+            iec_api.session = iec
+            iec_api.scheduler = RequestScheduler(
+                config.iec.request_interval, config.iec.interactive_share
+            )
+            monitor = SimulatedMonitor(SimulatedBot(), started)
+            asyncio.ensure_future(monitor.start_monitoring())
+            if crash_at is not None and 0 < crash_at < hours:
+                await asyncio.sleep(crash_at * HOUR)
+                monitor = await _crash_and_restart(monitor)
+            await asyncio.sleep(max(started + hours * HOUR - loop.time(), 0))
+            monitor.stop_monitoring()
+            await monitor.drain(DRAIN_TIMEOUT)
+            if monitor.digests:
+                await monitor.digests.flush_all()
+        finally:
+            iec_api.session, iec_api.scheduler = session, scheduler
+            await Tortoise.close_connections()
+
+    wall_time = time.perf_counter() - wall_start
+    logging.getLogger(__name__).info(
+        f"Simulated {policy.name} in {wall_time:.1f}s, {iec.requests} requests"
+    )
+    return _analyze(policy, population, events, monitor, iec, hours, wall_time)
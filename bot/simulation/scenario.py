@@ -0,0 +1,268 @@
+"""
+Synthetic populations of monitored addresses and
+outage event traces for the simulation, generated
+from a seed and saved as json lines to replay them
+"""
+import json
+import math
+import random
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Optional
+from bot.iec.work_set import AddressKey
+
+__all__ = (
+    "Population",
+    "OutageEvent",
+    "Episode",
+    "SCENARIOS",
+    "generate_population",
+    "generate_events",
+    "outage_episodes",
+    "save_events",
+    "load_events",
+)
+
+HOUR = 60 * 60
+FIRST_INCIDENT_ID = 5_000_000
+
+# scenario: kinds of events in it
+SCENARIOS = {
+    "calm": ("fault",),
+    "storm": ("fault", "storm"),
+    "planned": ("fault", "planned"),
+    "flapping": ("fault", "flap"),
+    "mixed": ("fault", "storm", "planned", "flap"),
+}
+
+
+@dataclass
+class Population:
+    # (city_id, district_id, street_id, home_num)
+    addresses: list[AddressKey]
+    # (user_id, index in addresses)
+    subscriptions: list[tuple[int, int]]
+
+    def streets(self) -> dict[tuple[int, int], list[int]]:
+        """
+        :return: (city_id, street_id): indexes of its addresses
+        :rtype: dict[tuple[int, int], list[int]]
+        """
+        streets = defaultdict(list)
+        for i, (city_id, _, street_id, _) in enumerate(self.addresses):
+            streets[(city_id, street_id)].append(i)
+        return dict(streets)
+
+
+@dataclass
+class OutageEvent:
+    # fault, storm, planned or flap
+    kind: str
+    incident_id: int
+    # seconds from the start of the simulation
+    start: float
+    end: float
+    # indexes in Population.addresses
+    addresses: list[int]
+    # planned outages are shown by IEC from this time, before the start
+    announced: Optional[float] = None
+
+    @property
+    def visible_from(self) -> float:
+        return self.start if self.announced is None else self.announced
+
+
+@dataclass
+class Episode:
+    """
+    A time an address had no power (or a planned outage
+    announced), overlapping events merged
+    """
+
+    address: int
+    start: float
+    end: float
+    kind: str
+
+
+def generate_population(addresses: int, seed: int) -> Population:
+    """
+    Cities of streets of a few to 30 monitored
+    homes, every home with one to three users
+
+    :param addresses: monitored addresses
+    :type addresses: int
+    :param seed: random seed
+    :type seed: int
+    :return: the population
+    :rtype: Population
+    """
+    rng = random.Random(f"population-{seed}")
+    keys: list[AddressKey] = []
+    city = 0
+    while len(keys) < addresses:
+        city += 1
+        city_id = 1000 + city
+        district_id = city % 7 + 1
+        for street in range(rng.randint(5, 30)):
+            street_id = city_id * 100 + street
+            homes = rng.sample(range(1, 120), rng.randint(3, 30))
+            keys += [(city_id, district_id, street_id, home) for home in sorted(homes)]
+    keys = keys[:addresses]
+
+    subscriptions = []
+    user_id = 100
+    for i in range(len(keys)):
+        for _ in range(1 + (rng.random() < 0.3) + (rng.random() < 0.1)):
+            user_id += 1
+            subscriptions.append((user_id, i))
+    return Population(keys, subscriptions)
+
+
+def _duration(rng: random.Random, median: float, low: float, high: float) -> float:
+    return min(max(rng.lognormvariate(math.log(median), 0.7), low), high)
+
+
+def generate_events(
+    population: Population, hours: float, seed: int, scenario: str = "mixed"
+) -> list[OutageEvent]:
+    """
+    :param population: the addresses
+    :type population: Population
+    :param hours: length of the trace
+    :type hours: float
+    :param seed: random seed
+    :type seed: int
+    :param scenario: one of SCENARIOS, defaults to mixed
+    :type scenario: str, optional
+    :return: the events by start
+    :rtype: list[OutageEvent]
+    """
+    rng = random.Random(f"events-{seed}-{scenario}")
+    duration = hours * HOUR
+    streets = population.streets()
+    street_keys = sorted(streets)
+    size = len(population.addresses)
+    incident_ids = iter(range(FIRST_INCIDENT_ID, FIRST_INCIDENT_ID + 10**7))
+    events: list[OutageEvent] = []
+
+    def add(kind: str, start: float, length: float, addresses: list[int], **kw):
+        events.append(
+            OutageEvent(
+                kind, next(incident_ids), start, start + length, addresses, **kw
+            )
+        )
+
+    kinds = SCENARIOS[scenario]
+    if "fault" in kinds:
+        # a fault an hour per 700 addresses, most take a whole street
+        t = rng.expovariate(size / 700 / HOUR)
+        while t < duration:
+            street = streets[rng.choice(street_keys)]
+            hit = street if rng.random() < 0.7 else [rng.choice(street)]
+            add("fault", t, _duration(rng, 1.5 * HOUR, 600, 8 * HOUR), hit)
+            t += rng.expovariate(size / 700 / HOUR)
+
+    if "storm" in kinds:
+        # half the streets of one or two cities within an hour
+        storm_start = rng.uniform(0.3, 0.7) * duration
+        cities = sorted({city_id for city_id, _ in street_keys})
+        hit_cities = set(rng.sample(cities, min(len(cities), rng.randint(1, 2))))
+        for key in street_keys:
+            if key[0] in hit_cities and rng.random() < 0.5:
+                start = storm_start + rng.uniform(0, HOUR)
+                add(
+                    "storm",
+                    start,
+                    _duration(rng, 4 * HOUR, HOUR, 12 * HOUR),
+                    streets[key],
+                )
+
+    if "planned" in kinds:
+        for _ in range(2 * max(1, size // 1000)):
+            start = rng.uniform(0.2, 0.9) * duration
+            announced = max(start - rng.uniform(2 * HOUR, 12 * HOUR), 0.0)
+            add(
+                "planned",
+                start,
+                rng.uniform(2 * HOUR, 6 * HOUR),
+                streets[rng.choice(street_keys)],
+                announced=announced,
+            )
+
+    if "flap" in kinds:
+        # an address losing power again and again for a few minutes
+        for _ in range(max(1, size // 1000)):
+            address = rng.randrange(size)
+            t = rng.uniform(0, 0.8 * duration)
+            for _ in range(rng.randint(6, 12)):
+                down = rng.uniform(120, 900)
+                add("flap", t, down, [address])
+                t += down + rng.uniform(120, 900)
+
+    events.sort(key=lambda event: event.visible_from)
+    return events
+
+
+def outage_episodes(events: list[OutageEvent]) -> list[Episode]:
+    """
+    :param events: the events
+    :type events: list[OutageEvent]
+    :return: the outages of every address, overlapping
+        events merged, by address and start
+    :rtype: list[Episode]
+    """
+    by_address: dict[int, list[OutageEvent]] = defaultdict(list)
+    for event in events:
+        for address in event.addresses:
+            by_address[address].append(event)
+
+    episodes = []
+    for address in sorted(by_address):
+        current: Optional[Episode] = None
+        for event in sorted(by_address[address], key=lambda e: e.visible_from):
+            if current and event.visible_from <= current.end:
+                current.end = max(current.end, event.end)
+                continue
+            current = Episode(address, event.visible_from, event.end, event.kind)
+            episodes.append(current)
+    return episodes
+
+
+def save_events(
+    path: str, events: list[OutageEvent], addresses: int, seed: int, hours: float
+):
+    """
+    Saves a trace to replay, the first line is
+    the population it was generated for
+
+    :param path: jsonl file
+    :type path: str
+    :param events: the events
+    :type events: list[OutageEvent]
+    :param addresses: population size
+    :type addresses: int
+    :param seed: population seed
+    :type seed: int
+    :param hours: length of the trace
+    :type hours: float
+    """
+    with open(path, "w") as f:
+        f.write(json.dumps({"addresses": addresses, "seed": seed, "hours": hours}))
+        f.write("\n")
+        for event in events:
+            f.write(json.dumps(asdict(event)))
+            f.write("\n")
+
+
+def load_events(path: str) -> tuple[dict, list[OutageEvent]]:
+    """
+    :param path: jsonl file from save_events
+    :type path: str
+    :return: (population params, events)
+    :rtype: tuple[dict, list[OutageEvent]]
+    """
+    with open(path) as f:
+        header = json.loads(f.readline())
+        events = [OutageEvent(**json.loads(line)) for line in f if line.strip()]
+    return header, events
@@ -0,0 +1,130 @@
+"""
+Live health numbers of the bot for the admin /stats,
+all from in memory counters (no db queries) so it
+is cheap to run during an incident
+"""
+import os
+import resource
+import time
+from typing import Optional
+from bot.db import db_file_size
+from bot.db.user_cache import user_cache
+from bot.iec.api import iec_api
+from bot.iec.moitor_outages import OutagesMonitor
+from bot.iec.status_cache import outage_status_cache
+from bot.broadcast import Broadcaster
+from bot.quota import check_quota
+
+__all__ = ("collect_stats", "format_stats")
+
+STARTED_AT = time.time()
+
+
+def process_rss() -> int:
+    """
+    :return: resident memory of the process in bytes,
+        the peak if the current is unknown (not linux)
+    :rtype: int
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+
+def collect_stats(monitor: OutagesMonitor, broadcaster: Broadcaster = None) -> dict:
+    """
+    :param monitor: the outages monitor
+    :type monitor: OutagesMonitor
+    :param broadcaster: the admin broadcaster, defaults to None
+    :type broadcaster: Broadcaster, optional
+    :return: the numbers
+    :rtype: dict
+    """
+    checked, round_total, eta = monitor.round_progress()
+    requests = iec_api.requests.count()
+    cache_reads = outage_status_cache.hits + outage_status_cache.misses
+    user_reads = user_cache.hits + user_cache.misses
+    return {
+        "addresses": len(monitor.work_set),
+        "active_outages": len(monitor.active_outages),
+        "active_incidents": len(monitor.active_incidents),
+        "round": monitor.rounds,
+        "round_checked": checked,
+        "round_total": round_total,
+        "round_eta": eta,
+        "last_round_duration": monitor.last_round_duration,
+        "in_flight": monitor.checks_in_flight,
+        "queues": monitor.queue_depths(),
+        "iec_requests_per_min": requests,
+        "iec_error_rate": iec_api.failures.count() / requests if requests else 0.0,
+        "circuit": iec_api.circuit_breaker.state.value,
+        "rate_limit_waiting": iec_api.rate_limit_waiting,
+        "rate_limit_backlog": iec_api.rate_limit_backlog,
+        "interactive_requests": iec_api.scheduler.interactive_granted,
+        "checks_over_quota": check_quota.rejected,
+        "cache_hit_rate": outage_status_cache.hits / cache_reads
+        if cache_reads
+        else 0.0,
+        "users_cached": len(user_cache),
+        "user_cache_hit_rate": user_cache.hits / user_reads if user_reads else 0.0,
+        "telegram_in_flight": monitor.telegram_in_flight,
+        "digests_pending": len(monitor.digests.digests) if monitor.digests else 0,
+        "broadcast": broadcaster.job.id
+        if broadcaster and broadcaster.running
+        else None,
+        "db_size": db_file_size(),
+        "rss": process_rss(),
+        "uptime": time.time() - STARTED_AT,
+    }
+
+
+def format_stats(stats: dict) -> str:
+    """
+    :param stats: from collect_stats
+    :type stats: dict
+    :return: the stats as text lines
+    :rtype: str
+    """
+    s = stats
+    progress = s["round_checked"] / s["round_total"] if s["round_total"] else 0
+    queues = ", ".join(f"{k} {v}" for k, v in s["queues"].items()) or "not started"
+    lines = [
+        f"addresses monitored: {s['addresses']}",
+        f"active outages: {s['active_outages']} "
+        f"({s['active_incidents']} incidents)",
+        f"round {s['round']}: {s['round_checked']}/{s['round_total']} "
+        f"({progress:.0%}), eta {_duration(s['round_eta'])}, "
+        f"last round {_duration(s['last_round_duration'])}",
+        f"pipeline: {s['in_flight']} in flight, queues: {queues}",
+        f"IEC: {s['iec_requests_per_min']} requests/min, "
+        f"{s['iec_error_rate']:.1%} errors, circuit {s['circuit']}",
+        f"rate limiter: {s['rate_limit_waiting']} waiting, "
+        f"{s['rate_limit_backlog']:.1f}s backlog, "
+        f"{s['interactive_requests']} user checks sent, "
+        f"{s['checks_over_quota']} over quota",
+        f"status cache hits: {s['cache_hit_rate']:.0%}",
+        f"user cache: {s['users_cached']} users, "
+        f"{s['user_cache_hit_rate']:.0%} hits",
+        f"telegram: {s['telegram_in_flight']} sends in flight, "
+        f"{s['digests_pending']} digests pending",
+    ]
+    if s["broadcast"] is not None:
+        lines.append(f"broadcast #{s['broadcast']} running")
+    lines += [
+        f"db: {s['db_size'] / 1024 ** 2:.1f}MB, rss: {s['rss'] / 1024 ** 2:.1f}MB",
+        f"uptime: {_duration(s['uptime'])}",
+    ]
+    return "\n".join(lines)
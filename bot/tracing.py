@@ -0,0 +1,386 @@
+"""
+Structured traces of the monitor address checks.
+A check has one trace, with spans for every step it went
+through (queue waits, rate limit, IEC http, decode, diff,
+db, telegram sends), written as a json line to a rotating
+file when it finishes.
+
+usage: python -m bot.tracing [--since ISO] [--until ISO]
+       [--address CITY-STREET-HOME] [--trace TRACE_ID]
+       [--slowest N] [FILE ...]
+"""
+import argparse
+import glob
+import heapq
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Awaitable, Iterable, Iterator, Optional
+from bot.config import config
+
+__all__ = ("tracer", "Tracer", "Trace", "span", "traced", "active_trace")
+
+OUTCOME_UNCHANGED = "unchanged"
+OUTCOME_PROCESSED = "processed"
+
+
+class Trace:
+    """
+    The spans of one address check, times are
+    perf_counter and written as ms from the start
+    """
+
+    __slots__ = (
+        "trace_id",
+        "kind",
+        "address",
+        "district_id",
+        "started_at",
+        "round_wait",
+        "outcome",
+        "spans",
+        "_start",
+        "_queued_at",
+    )
+
+    def __init__(
+        self,
+        kind: str,
+        city_id: int,
+        district_id: int,
+        street_id: int,
+        home_num: int,
+    ) -> None:
+        self.trace_id = os.urandom(8).hex()
+        self.kind = kind
+        # same as the monitor logs
+        self.address = f"{city_id}-{street_id}-{home_num}"
+        self.district_id = district_id
+        self.started_at = time.time()
+        # seconds from the start of the round until the check started
+        self.round_wait: Optional[float] = None
+        self.outcome = OUTCOME_UNCHANGED
+        self.spans: list[dict] = []
+        self._start = time.perf_counter()
+        self._queued_at = self._start
+
+    def add_span(self, name: str, start: float, end: float = None, **attrs):
+        """
+        :param name: the step
+        :type name: str
+        :param start: perf_counter
+        :type start: float
+        :param end: perf_counter, defaults to now
+        :type end: float, optional
+        """
+        end = end or time.perf_counter()
+        attrs["name"] = name
+        attrs["start_ms"] = round((start - self._start) * 1000, 1)
+        attrs["ms"] = round((end - start) * 1000, 1)
+        self.spans.append(attrs)
+
+    def queued(self):
+        """
+        The check was put in a queue
+        """
+        self._queued_at = time.perf_counter()
+
+    def dequeued(self, queue: str):
+        """
+        The check was taken out of the queue,
+        adds the wait as a span
+
+        :param queue: queue name
+        :type queue: str
+        """
+        self.add_span("queue." + queue, self._queued_at)
+
+    @property
+    def duration(self) -> float:
+        """
+        :return: seconds since the start
+        :rtype: float
+        """
+        return time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        record = {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "address": self.address,
+            "district_id": self.district_id,
+            "start": datetime.fromtimestamp(self.started_at).isoformat(
+                timespec="milliseconds"
+            ),
+            "ms": round(self.duration * 1000, 1),
+            "outcome": self.outcome,
+            "spans": self.spans,
+        }
+        if self.round_wait is not None:
+            record["round_wait_ms"] = round(self.round_wait * 1000)
+        return record
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+@contextmanager
+def active_trace(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """
+    Spans in this context (and tasks created in it)
+    are added to the trace
+
+    :param trace: the trace
+    :type trace: Optional[Trace]
+    """
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    """
+    Adds a span to the active trace, if any
+
+    :param name: the step
+    :type name: str
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        trace.add_span(name, start, **attrs)
+
+
+async def traced(aw: Awaitable, name: str, **attrs):
+    """
+    Awaits in a span, for asyncio.gather
+
+    :param aw: the awaitable
+    :type aw: Awaitable
+    :param name: the step
+    :type name: str
+    :return: the result of aw
+    """
+    with span(name, **attrs):
+        return await aw
+
+
+class Tracer:
+    """
+    Creates the traces and writes the finished ones,
+    all the failed, processed and slow checks
+    and config.tracing.sample_rate of the rest
+    """
+
+    def __init__(self) -> None:
+        self.finished = 0
+        self.written = 0
+        self._logger: Optional[logging.Logger] = None
+
+    @staticmethod
+    def start(
+        kind: str, city_id: int, district_id: int, street_id: int, home_num: int
+    ) -> Trace:
+        """
+        :param kind: poll (the monitor pipeline) or check
+        :type kind: str
+        :return: a new trace
+        :rtype: Trace
+        """
+        return Trace(kind, city_id, district_id, street_id, home_num)
+
+    def _sink(self) -> logging.Logger:
+        if self._logger is None:
+            os.makedirs(os.path.dirname(config.tracing.file) or ".", exist_ok=True)
+            handler = RotatingFileHandler(
+                config.tracing.file,
+                maxBytes=config.tracing.max_bytes,
+                backupCount=config.tracing.backups,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger(__name__ + ".sink")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def finish(self, trace: Optional[Trace], outcome: str = None):
+        """
+        Writes the trace if it is sampled
+
+        :param trace: the trace
+        :type trace: Optional[Trace]
+        :param outcome: the failure, defaults to trace.outcome
+        :type outcome: str, optional
+        """
+        if trace is None or not config.tracing.file:
+            return
+        self.finished += 1
+        if outcome:
+            trace.outcome = outcome
+        if (
+            trace.outcome == OUTCOME_UNCHANGED
+            and trace.duration < config.tracing.slow_threshold
+            and random.random() >= config.tracing.sample_rate
+        ):
+            return
+        try:
+            self._sink().info(json.dumps(trace.to_dict(), default=str))
+            self.written += 1
+        except Exception:
+            logging.getLogger(__name__).exception("Could not write trace")
+
+
+tracer = Tracer()
+
+
+def read_traces(paths: Iterable[str]) -> Iterator[dict]:
+    """
+    :param paths: jsonl trace files
+    :type paths: Iterable[str]
+    :yield: the traces
+    :rtype: Iterator[dict]
+    """
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _percentile(values: list[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def summarize(traces: Iterable[dict], slowest: int = 5) -> str:
+    """
+    Where the time of the checks goes,
+    per span name and outcome. The share is of the
+    total checks time, concurrent spans (telegram
+    sends to many users) can add up to more
+
+    :param traces: trace records
+    :type traces: Iterable[dict]
+    :param slowest: slowest traces listed, defaults to 5
+    :type slowest: int, optional
+    :return: the report
+    :rtype: str
+    """
+    span_ms: dict[str, list[float]] = defaultdict(list)
+    outcomes = Counter()
+    total_ms = 0.0
+    first = last = None
+    # (ms, trace_id, trace) min heap of the slowest
+    slow: list[tuple[float, str, dict]] = []
+    for trace in traces:
+        outcomes[trace["outcome"]] += 1
+        total_ms += trace["ms"]
+        first = min(first or trace["start"], trace["start"])
+        last = max(last or trace["start"], trace["start"])
+        for s in trace["spans"]:
+            span_ms[s["name"]].append(s["ms"])
+        item = (trace["ms"], trace["trace_id"], trace)
+        if len(slow) < slowest:
+            heapq.heappush(slow, item)
+        elif slowest:
+            heapq.heappushpop(slow, item)
+
+    count = sum(outcomes.values())
+    if not count:
+        return "no traces"
+    lines = [
+        f"{count} traces from {first} to {last}",
+        "outcomes: " + ", ".join(f"{o} {n}" for o, n in outcomes.most_common()),
+        f"avg check {total_ms / count:.0f}ms",
+        "",
+        f"{'span':<20} {'count':>7} {'share':>6} {'avg':>8} {'p50':>8} "
+        f"{'p95':>8} {'max':>9}",
+    ]
+    for name, values in sorted(span_ms.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        total = sum(values)
+        lines.append(
+            f"{name:<20} {len(values):>7} {total / total_ms:>6.1%} "
+            f"{total / len(values):>6.0f}ms {_percentile(values, 50):>6.0f}ms "
+            f"{_percentile(values, 95):>6.0f}ms {values[-1]:>7.0f}ms"
+        )
+    lines.append("\nslowest:")
+    lines += [
+        f"  {t['ms']:>8.0f}ms {t['start']} {t['address']} {t['outcome']} "
+        f"{t['trace_id']}"
+        for _, _, t in sorted(slow, reverse=True)
+    ]
+    return "\n".join(lines)
+
+
+def format_trace(trace: dict) -> str:
+    """
+    :param trace: a trace record
+    :type trace: dict
+    :return: the trace spans as a timeline
+    :rtype: str
+    """
+    lines = [
+        f"{trace['trace_id']} {trace['kind']} {trace['address']} "
+        f"{trace['start']} {trace['ms']:.0f}ms {trace['outcome']}"
+    ]
+    if "round_wait_ms" in trace:
+        lines.append(f"  waited {trace['round_wait_ms']}ms in the round")
+    for s in trace["spans"]:
+        attrs = " ".join(
+            f"{k}={v}" for k, v in s.items() if k not in ("name", "start_ms", "ms")
+        )
+        lines.append(
+            f"  +{s['start_ms']:>9.1f}ms {s['ms']:>9.1f}ms  {s['name']} {attrs}"
+        )
+    return "\n".join(lines)
+
+
+def main(args: argparse.Namespace):
+    paths = args.files or sorted(
+        glob.glob(config.tracing.file + "*"), key=os.path.getmtime
+    )
+    traces = (
+        t
+        for t in read_traces(paths)
+        if (not args.since or t["start"] >= args.since)
+        and (not args.until or t["start"] <= args.until)
+        and (not args.address or t["address"] == args.address)
+        and (not args.trace or t["trace_id"] == args.trace)
+    )
+    if args.address or args.trace:
+        for trace in traces:
+            print(format_trace(trace))
+        return
+    print(summarize(traces, args.slowest))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bot.tracing")
+    parser.add_argument("files", nargs="*", help="defaults to TRACE_FILE and backups")
+    parser.add_argument("--since", help="ISO time, 2022-02-01T18:00")
+    parser.add_argument("--until", help="ISO time")
+    parser.add_argument("--address", help="CITY-STREET-HOME, prints its traces")
+    parser.add_argument("--trace", help="prints one trace")
+    parser.add_argument("--slowest", type=int, default=5)
+    main(parser.parse_args())
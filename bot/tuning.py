@@ -0,0 +1,242 @@
+"""
+Settings an admin can change while the bot runs (/tune),
+applied to the running rate limit, scheduler and monitor
+and saved to config.bot.tunables_file, so a restart keeps
+them over the environment values
+"""
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Optional
+from bot.config import config
+from bot.iec.api import iec_api
+from bot.quota import check_quota
+
+if TYPE_CHECKING:
+    from bot.iec.moitor_outages import OutagesMonitor
+
+__all__ = ("Tunable", "Tunables", "tunables")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Tunable:
+    # section.field in config, like iec.request_interval
+    key: str
+    type: type
+    minimum: float
+    maximum: float
+    # makes the running objects use the new config value, the
+    # settings without one are read from config on every use
+    apply: Optional[Callable[["Tunables"], None]] = None
+
+    def parse(self, raw: str) -> Any:
+        """
+        :param raw: the value as typed
+        :type raw: str
+        :raises ValueError: not a number or out of range
+        :return: the value
+        :rtype: Any
+        """
+        value = self.type(raw)
+        if not self.minimum <= value <= self.maximum:
+            raise ValueError(
+                f"{self.key} must be {self.minimum}-{self.maximum}, got {raw}"
+            )
+        return value
+
+    def get(self) -> Any:
+        section, _, name = self.key.partition(".")
+        return getattr(getattr(config, section), name)
+
+    def set(self, value: Any):
+        section, _, name = self.key.partition(".")
+        setattr(getattr(config, section), name, value)
+
+
+def _apply_scheduler(_: "Tunables"):
+    iec_api.scheduler.configure(
+        config.iec.request_interval, config.iec.interactive_share
+    )
+
+
+def _apply_rbzid(_: "Tunables"):
+    # from the next cookie, the current one keeps its expiry
+    iec_api.rbzid.lifetime = config.iec.rbzid_lifetime
+    iec_api.rbzid.refresh_ahead = config.iec.rbzid_refresh_ahead
+
+
+def _apply_workers(tunables: "Tunables"):
+    if tunables.monitor is not None:
+        tunables.monitor.resize_workers()
+
+
+def _apply_quota(_: "Tunables"):
+    check_quota.limit = config.bot.check_quota
+
+
+TUNABLES = (
+    Tunable("iec.request_interval", float, 0.1, 60, _apply_scheduler),
+    Tunable("iec.interactive_share", float, 0, 0.9, _apply_scheduler),
+    Tunable("iec.request_timeout", int, 1, 120),
+    Tunable("iec.rbzid_lifetime", int, 60, 24 * 60 * 60, _apply_rbzid),
+    Tunable("iec.rbzid_refresh_ahead", int, 0, 60 * 60, _apply_rbzid),
+    Tunable("monitor.round_interval", int, 0, 24 * 60 * 60),
+    Tunable("monitor.fetch_concurrency", int, 1, 32, _apply_workers),
+    Tunable("monitor.process_concurrency", int, 1, 32, _apply_workers),
+    Tunable("monitor.burst_max_addresses", int, 0, 500),
+    Tunable("bot.check_quota", int, 0, 1000, _apply_quota),
+)
+
+
+class Tunables:
+    """
+    Changes the tunable settings together or not at all
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: json file of the changed settings
+        :type path: str
+        """
+        self.path = path
+        self.by_key = {tunable.key: tunable for tunable in TUNABLES}
+        # the environment values, what reset goes back to
+        self.defaults = {key: tunable.get() for key, tunable in self.by_key.items()}
+        # set when the monitor is created, to resize its workers
+        self.monitor: Optional["OutagesMonitor"] = None
+
+    def apply(self, changes: dict[str, Any]) -> dict[str, tuple[Any, Any]]:
+        """
+        Validates all the changes before changing anything,
+        then sets them and updates the running objects
+        without awaiting in between, and saves them
+
+        :param changes: key: value, as typed or parsed
+        :type changes: dict[str, Any]
+        :raises ValueError: an unknown key or a bad value,
+            nothing was changed
+        :return: key: (old, new) of the settings that changed
+        :rtype: dict[str, tuple[Any, Any]]
+        """
+        parsed = {key: self._parse(key, raw) for key, raw in changes.items()}
+        if parsed.get(
+            "iec.rbzid_refresh_ahead", config.iec.rbzid_refresh_ahead
+        ) >= parsed.get("iec.rbzid_lifetime", config.iec.rbzid_lifetime):
+            raise ValueError("iec.rbzid_refresh_ahead must be below iec.rbzid_lifetime")
+        return self._set(parsed)
+
+    def _set(self, values: dict[str, Any]) -> dict[str, tuple[Any, Any]]:
+        """
+        Sets valid values and updates the running objects,
+        without awaiting in between, and saves them
+
+        :param values: key: value
+        :type values: dict[str, Any]
+        :return: key: (old, new) of the settings that changed
+        :rtype: dict[str, tuple[Any, Any]]
+        """
+        changed = {}
+        for key, value in values.items():
+            tunable = self.by_key[key]
+            if tunable.get() != value:
+                changed[key] = (tunable.get(), value)
+                tunable.set(value)
+        applies = {self.by_key[key].apply for key in changed} - {None}
+        for apply in applies:
+            apply(self)
+        if changed:
+            logger.warning(
+                "Tuned "
+                + ", ".join(f"{k} {old} -> {new}" for k, (old, new) in changed.items())
+            )
+            self.save()
+        return changed
+
+    def _parse(self, key: str, raw: Any) -> Any:
+        tunable = self.by_key.get(key)
+        if tunable is None:
+            raise ValueError(f"unknown setting {key}")
+        return tunable.parse(raw)
+
+    def reset(self, keys: list[str] = None) -> dict[str, tuple[Any, Any]]:
+        """
+        :param keys: settings to set back to the environment
+            values, defaults to all. Not range checked, the
+            environment can set values out of the /tune ranges
+        :type keys: list[str], optional
+        :raises ValueError: an unknown key
+        :return: key: (old, new) of the settings that changed
+        :rtype: dict[str, tuple[Any, Any]]
+        """
+        keys = keys or list(self.by_key)
+        unknown = [key for key in keys if key not in self.by_key]
+        if unknown:
+            raise ValueError(f"unknown setting {unknown[0]}")
+        return self._set({key: self.defaults[key] for key in keys})
+
+    def overrides(self) -> dict[str, Any]:
+        """
+        :return: key: value of the settings that differ
+            from the environment values
+        :rtype: dict[str, Any]
+        """
+        return {
+            key: tunable.get()
+            for key, tunable in self.by_key.items()
+            if tunable.get() != self.defaults[key]
+        }
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.overrides(), f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            logger.exception("Could not save the tuned settings")
+
+    def load(self):
+        """
+        Applies the settings saved by the last run,
+        a bad one does not drop the rest
+        """
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            logger.exception(f"Could not load the tuned settings from {self.path}")
+            return
+        valid = {}
+        for key, value in saved.items():
+            try:
+                valid[key] = self._parse(key, value)
+            except ValueError as e:
+                logger.warning(f"Ignored a saved tuned setting: {e}")
+        try:
+            self.apply(valid)
+        except ValueError as e:
+            logger.warning(f"Ignored the saved tuned settings: {e}")
+
+    def describe(self) -> str:
+        """
+        :return: a line per setting, its value,
+            environment value and range
+        :rtype: str
+        """
+        lines = []
+        for key, tunable in self.by_key.items():
+            value, default = tunable.get(), self.defaults[key]
+            changed = "" if value == default else f" (env {default})"
+            lines.append(
+                f"{key}={value}{changed} [{tunable.minimum}-{tunable.maximum}]"
+            )
+        return "\n".join(lines)
+
+
+tunables = Tunables(config.bot.tunables_file)
@@ -1,5 +1,7 @@
 from datetime import datetime
+from typing import Union
 from bot.db.models import City, Outage, Street
+from bot.iec.active_outages import ActiveIncident, ActiveOutageData
 from bot.iec.api import IECOutageStatus
 
 
@@ -32,7 +34,11 @@ def time_diff_between_two_dates_text(d1: datetime, d2: datetime) -> str:
     return get_hours(diff / 60)
 
 
-def detail_text_from_outage(outage: Outage, full_address_name: str) -> str:
+def detail_text_from_outage(
+    outage: Union[Outage, ActiveOutageData],
+    full_address_name: str,
+    details: str = None,
+) -> str:
     """
     Construct a detail outage text from outage
     and full address.
@@ -49,10 +55,12 @@ def detail_text_from_outage(outage: Outage, full_address_name: str) -> str:
     סיבת עיכוב: עומס תקלות חריג
     '
 
-    :param outage: db outage model
-    :type outage: Outage
+    :param outage: db outage model or active outage
+    :type outage: Union[Outage, ActiveOutageData]
     :param full_address_name: full address formated
     :type full_address_name: str
+    :param details: outage_details_text of the outage if allready rendered
+    :type details: str, optional
     :return: [description]
     :rtype: str
     """
@@ -60,8 +68,22 @@ def detail_text_from_outage(outage: Outage, full_address_name: str) -> str:
 
     text = f"הפסקת חשמל {planned}ב{full_address_name}"
     text += "\n\n"
+    text += details if details is not None else outage_details_text(outage)
+    return text
+
+
+def outage_details_text(outage: Union[Outage, ActiveOutageData, ActiveIncident]) -> str:
+    """
+    The outage details part of detail_text_from_outage,
+    without the address. Same for all the outages
+    of an incident
 
-    text += (
+    :param outage: db outage model, active outage or incident
+    :type outage: Union[Outage, ActiveOutageData, ActiveIncident]
+    :return: the details text
+    :rtype: str
+    """
+    text = (
         "<b>התחילה ב:</b> " + datetime.strftime(outage.start_time, "%d/%m %H:%M") + "\n"
     )
 
@@ -97,14 +119,14 @@ def detail_text_from_outage(outage: Outage, full_address_name: str) -> str:
 
 
 def compare_db_outage_outage_status(
-    db_outage: Outage, outage_status: IECOutageStatus
+    db_outage: Union[Outage, ActiveOutageData], outage_status: IECOutageStatus
 ) -> bool:
     """
     Compares all attributes between
     IECOutageStatus and a db Outage model
 
-    :param db_outage: db Outage model
-    :type db_outage: Outage
+    :param db_outage: db Outage model or active outage
+    :type db_outage: Union[Outage, ActiveOutageData]
     :param outage_status: iec outage status resp
     :type outage_status: IECOutageStatus
     :return: True if all attributes are the same else False